@@ -0,0 +1,219 @@
+"""Benchmark map loading and the generators against a saved baseline.
+
+Times get_device_modbus_maps in every combination of its flags,
+generate_c_header.generate, generate_embedded_constants.generate and
+validate.validate, over ljm_constants.json and over synthetic versions of it
+with more registers, made by generate_synthetic_constants. Synthetic files
+scaled past generate_synthetic_constants.MAX_VALID_SCALE have duplicate
+addresses; validate is still timed on them, with the errors it reports
+ignored.
+
+Usage:
+    python benchmark.py --save                  Record a baseline
+    python benchmark.py                         Compare against it
+    python benchmark.py --scales 1,10,100 --threshold 0.1
+
+A benchmark that fails stops the run with an error naming it. Comparing
+exits with 1 if any benchmark got slower than the baseline by more than the
+threshold. Baselines are specific to a machine, so record one
+on the machine that compares against it.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import generate_c_header
+import generate_embedded_constants
+import generate_synthetic_constants
+import ljmmm
+import validate
+
+SRC_FILE = 'LabJack/LJM/ljm_constants.json'
+BASELINE_FILE = 'benchmark_baseline.json'
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_SCALES = [1, 10]
+DEFAULT_REPEAT = 3
+MAP_FLAGS = ['expand_names', 'inc_orig', 'expand_alt_names',
+    'render_descriptions']
+SYNTHETIC_SEED = 0
+
+def write_scaled_file(src, scale, directory):
+    if scale == 1:
+        return src
+    path = os.path.join(directory, 'ljm_constants_x%d.json' % scale)
+    generate_synthetic_constants.generate(scale, path, seed=SYNTHETIC_SEED,
+        src=src)
+    return path
+
+@contextlib.contextmanager
+def patched(module, **attributes):
+    originals = dict((name, getattr(module, name)) for name in attributes)
+    for name in attributes:
+        setattr(module, name, attributes[name])
+    try:
+        yield
+    finally:
+        for name in originals:
+            setattr(module, name, originals[name])
+
+def clear_caches():
+    ljmmm.apply_anchors.cache_clear()
+    ljmmm.compile_ljmmm_field.cache_clear()
+
+def get_benchmarks(src, output_dir, expect_valid=True):
+    """Get (name, function) of every benchmark over a constants file.
+
+    @keyword expect_valid: If False, the validate benchmark does not fail
+        when validate finds errors in src.
+    """
+    benchmarks = []
+    for values in itertools.product([False, True], repeat=len(MAP_FLAGS)):
+        flags = dict(zip(MAP_FLAGS, values))
+        name = 'get_device_modbus_maps[%s]' % ','.join(
+            '%s=%d' % (x, flags[x]) for x in MAP_FLAGS)
+        benchmarks.append((name, lambda flags=flags:
+            ljmmm.get_device_modbus_maps(src=src, **flags)))
+
+    def run_c_header():
+        # The gcc sanity test is not part of what is benchmarked
+        with patched(generate_c_header, SRC_FILE=src,
+            OUTPUT_FILE=os.path.join(output_dir, 'LabJackMModbusMap.h'),
+            sanity_test=lambda: None):
+            generate_c_header.generate()
+
+    def run_embedded_constants():
+        with patched(generate_embedded_constants, SRC_FILE=src,
+            OUTPUT_FILE=os.path.join(output_dir, 'LJM_EC.h')):
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_embedded_constants.generate()
+
+    def run_validate():
+        # validate exits with 1 once it has run every check and found errors
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            try:
+                validate.validate(src, raw_only=True)
+            except SystemExit:
+                if expect_valid:
+                    raise RuntimeError('%s does not pass validate.py:\n%s' % (
+                        src, output.getvalue()))
+
+    benchmarks.append(('generate_c_header.generate', run_c_header))
+    benchmarks.append(('generate_embedded_constants.generate',
+        run_embedded_constants))
+    benchmarks.append(('validate.validate', run_validate))
+    return benchmarks
+
+def run(src=SRC_FILE, scales=DEFAULT_SCALES, repeat=DEFAULT_REPEAT,
+    name_filter=None):
+    """Run every benchmark, keeping the best of repeat runs of each.
+
+    @return: Seconds by benchmark name, names being prefixed by the scale.
+    @rtype: dict
+    """
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for scale in scales:
+            scaled_src = write_scaled_file(src, scale, directory)
+            expect_valid = scale <= \
+                generate_synthetic_constants.MAX_VALID_SCALE
+            for (name, function) in get_benchmarks(scaled_src, directory,
+                expect_valid=expect_valid):
+                name = 'x%d/%s' % (scale, name)
+                if name_filter and not name_filter in name:
+                    continue
+                try:
+                    seconds = min(timeit.repeat(function,
+                        setup=clear_caches, number=1, repeat=repeat))
+                except (Exception, SystemExit) as e:
+                    raise RuntimeError('Benchmark %s failed: %s: %s' % (
+                        name, type(e).__name__, e)) from e
+                results[name] = seconds
+                print('%-90s %9.4f s' % (name, seconds))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def compare_results(baseline, results, threshold=DEFAULT_THRESHOLD):
+    """Find the benchmarks that got slower than the threshold allows.
+
+    @return: (name, baseline seconds, seconds) of each regression.
+    @rtype: list of tuple
+    """
+    regressions = []
+    for name in sorted(results):
+        if name in baseline and \
+            results[name] > baseline[name] * (1 + threshold):
+            regressions.append((name, baseline[name], results[name]))
+    return regressions
+
+def get_environment():
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--src', default=SRC_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true',
+        help='record the results as the baseline instead of comparing')
+    parser.add_argument('--scales', default=','.join(str(x) for x in DEFAULT_SCALES),
+        help='comma separated register count multipliers')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='allowed slowdown, 0.25 meaning 25%% slower')
+    parser.add_argument('--filter', default=None,
+        help='only run benchmarks whose name contains this')
+    args = parser.parse_args(argv)
+
+    scales = [int(x) for x in args.scales.split(',')]
+    results = run(src=args.src, scales=scales, repeat=args.repeat,
+        name_filter=args.filter)
+
+    if args.save:
+        baseline = {'environment': get_environment(), 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            baseline['environment'] = get_environment()
+        baseline['results'].update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Saved %d results to %s' % (len(results), args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at %s, run with --save first' % args.baseline)
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != get_environment():
+        print('Warning: baseline was recorded with %s' %
+            baseline.get('environment'))
+
+    missing = [x for x in results if not x in baseline['results']]
+    if missing:
+        print('No baseline for %d benchmarks, skipped' % len(missing))
+    regressions = compare_results(baseline['results'], results,
+        args.threshold)
+    for (name, old, new) in regressions:
+        print('[REGRESSION] %s: %.4f s -> %.4f s (%+.0f%%)' % (
+            name, old, new, (new / old - 1) * 100))
+    if regressions:
+        return 1
+    print('No regressions above %.0f%%' % (args.threshold * 100))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
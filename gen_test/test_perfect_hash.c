@@ -0,0 +1,31 @@
+// Sanity test
+
+#include "LabJackMPerfectHash.h"
+
+int main() {
+    int address = -1;
+    int type = -1;
+    int i;
+
+    if (!LJM_PH_Lookup("AIN0", &address, &type) || address != 0 || type != 3) {
+        return 1;
+    }
+
+    if (!LJM_PH_Lookup("DIO10", &address, &type) || address != 2010 || type != 0) {
+        return 2;
+    }
+
+    if (LJM_PH_Lookup("NOT_A_REGISTER", &address, &type)) {
+        return 3;
+    }
+
+    // Every name must hash to its own slot
+    for (i = 0; i < LJM_PH_NUM_NAMES; i++) {
+        if (!LJM_PH_Lookup(LJM_PH_Names[i], &address, &type) ||
+            address != LJM_PH_Addresses[i]) {
+            return 4;
+        }
+    }
+
+    return 0;
+}
@@ -0,0 +1,17 @@
+"""Generate a memory-mappable binary version of the LabJack LJM Modbus Map.
+
+The output is read with ljmmm.CompiledConstants.
+"""
+import ljmmm
+
+SRC_FILE = 'LabJack/LJM/ljm_constants.json'
+OUTPUT_FILE = 'gen_output/ljm_constants.bin'
+
+def generate():
+    ljmmm.write_compiled_constants(OUTPUT_FILE, src=SRC_FILE)
+    with ljmmm.CompiledConstants(OUTPUT_FILE) as constants:
+        print("Wrote %d registers of constants version %s to %s" % (
+            len(constants), constants.version, OUTPUT_FILE))
+
+if __name__ == "__main__":
+    generate()
@@ -1,6 +1,5 @@
 """Generate a C header file for the LabJack LJM Modbus Map.
 """
-import json
 import os
 import subprocess as sp
 from sys import platform
@@ -62,25 +61,35 @@ def sanity_test():
         raise Exception("Expected output to be 0, but was: %d" % ret)
 
 def generate():
-    modbus_maps_expanded = ljmmm.get_device_modbus_maps(
-        src=SRC_FILE,
-        expand_names=True,
-        expand_alt_names=True
-    )
-
-    constants_contents = json.loads(ljmmm.read_file(src=SRC_FILE))
+    document = ljmmm.ConstantsDocument(SRC_FILE)
 
     with open(OUTPUT_FILE, 'w') as file:
-        init(file, constants_contents['header']['version'])
-
-        printed = []
-        for device in modbus_maps_expanded:
-            for reg in modbus_maps_expanded[device]:
+        init(file, document.header['version'])
+
+        # Expand the registers once, grouping them by device, and write them
+        # device by device. Only references to the expanded registers are
+        # kept, not a map with one copy of each register per device
+        device_names = ljmmm.get_device_names(document)
+        device_regs = dict((x, []) for x in device_names)
+        for reg in ljmmm.iter_registers(
+            src=document,
+            expand_names=True,
+            expand_alt_names=True,
+            render_descriptions=False
+        ):
+            for device in reg['devices']:
+                device_regs[device['device']].append(reg)
+
+        printed = set()
+        for device in device_names:
+            if device == "DIGIT":
+                continue
+            for reg in device_regs[device]:
 
                 # Remove duplication by name. By address would omit altnames
                 name = reg['name']
                 if (not name in printed):
-                    printed.append(name)
+                    printed.add(name)
                     output_reg(file, reg)
                 # else:
                 #     print "Duplicate: %s" % reg["name"]
@@ -1,6 +1,5 @@
 """Generate a C header file for the embedded LabJack LJM Modbus Map.
 """
-import json
 import os
 import subprocess
 
@@ -408,13 +407,13 @@ def print_conflict_directory(file, conflict_dir):
     file.write("};\n")
 
 def generate(make_constants_header=True):
+    document = ljmmm.ConstantsDocument(SRC_FILE)
     modbus_maps = ljmmm.get_device_modbus_maps(
-        src=SRC_FILE,
+        src=document,
         expand_names=False,
         expand_alt_names=True,
+        render_descriptions=False,
     )
-
-    constants_contents = json.loads(ljmmm.read_file(src=SRC_FILE))
     reg_names = []
     reg_dir = []
     conflict_dir = {}
@@ -439,7 +438,7 @@ def generate(make_constants_header=True):
 
     if (make_constants_header):
         with open(OUTPUT_FILE, 'w') as file:
-            init(file, constants_contents["header"]["version"], num_registers)
+            init(file, document.header["version"], num_registers)
             print_registers(file, sorted_registers)
             print_conflict_tables(file, conflict_dir)
             print_conflict_directory(file, conflict_dir)
@@ -0,0 +1,337 @@
+"""Generate minimal perfect hash lookup tables for LabJack LJM register names.
+
+Every expanded register name and altname of ljm_constants.json gets one slot
+in a table of exactly as many slots as names. A name is looked up with one
+CRC-32, one table read and one string comparison, with no probing.
+
+The hash is CHD ("hash, displace and compress"): names are split into
+buckets by crc32(name), and each bucket gets a displacement d chosen so that
+mix(crc32(name) + d * DISPLACEMENT_MULTIPLIER) % number of names puts its
+names in free slots, mix being the MurmurHash3 32-bit finalizer. Buckets of
+a single name store -(slot + 1) instead. crc32 is the zlib CRC-32, so
+zlib.crc32 computes it in Python.
+
+Outputs a Python module and a C header defining the tables and a lookup
+function. Run with --benchmark to compare against a dict and against the
+CRC binary search used by generate_embedded_constants.
+"""
+import bisect
+import os
+import subprocess as sp
+import sys
+import timeit
+import zlib
+from sys import platform
+
+import generate_embedded_constants as genconsts
+import ljmmm
+from generate_c_header import get_reg_enum
+
+SRC_FILE = 'LabJack/LJM/ljm_constants.json'
+PY_OUTPUT_FILE = 'gen_output/ljm_perfect_hash.py'
+C_OUTPUT_FILE = 'gen_output/LabJackMPerfectHash.h'
+SANITY_TEST_FILE = 'gen_test/test_perfect_hash.c'
+
+DISPLACEMENT_MULTIPLIER = 0x9E3779B9
+NAMES_PER_BUCKET = 4
+MAX_DISPLACEMENT = 1 << 20
+
+def get_registers(src=SRC_FILE):
+    """Get (name, address, type enum) of every distinct register name.
+
+    When a name appears more than once the first one wins, as in
+    ljmmm.NameResolver.
+    """
+    registers = []
+    names = set()
+    for reg in ljmmm.iter_registers(
+        src=src,
+        expand_names=True,
+        expand_alt_names=True,
+        render_descriptions=False
+    ):
+        name = reg['name']
+        if (not name in names):
+            names.add(name)
+            registers.append((name, reg['address'], get_reg_enum(reg)))
+    return registers
+
+def hash_name(name):
+    return zlib.crc32(name.encode('ascii'))
+
+def mix(h):
+    # CRC-32 is linear, so the slot is taken from a non-linear mix of it
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h
+
+def get_displaced_slot(h, d, num_slots):
+    return mix((h + d * DISPLACEMENT_MULTIPLIER) & 0xFFFFFFFF) % num_slots
+
+def make_perfect_hash(names):
+    """Find displacements that hash names to distinct slots.
+
+    @return: The displacement of each bucket and the name in each slot.
+    @rtype: tuple of (list of int, list of str)
+    """
+    num_slots = len(names)
+    num_buckets = max(1, (num_slots + NAMES_PER_BUCKET - 1) // NAMES_PER_BUCKET)
+    buckets = [[] for i in range(num_buckets)]
+    for name in names:
+        h = hash_name(name)
+        buckets[h % num_buckets].append((name, h))
+
+    displacements = [0] * num_buckets
+    slots = [None] * num_slots
+    order = sorted(range(num_buckets), key=lambda i: -len(buckets[i]))
+    free_slots = None
+    for bucket_index in order:
+        bucket = buckets[bucket_index]
+        if len(bucket) == 0:
+            break
+
+        if len(bucket) == 1:
+            # Whatever is still free is free for good, so place the single
+            # name buckets in order without hashing
+            if free_slots is None:
+                free_slots = [i for i in range(num_slots) if slots[i] is None]
+            slot = free_slots.pop()
+            slots[slot] = bucket[0][0]
+            displacements[bucket_index] = -(slot + 1)
+            continue
+
+        for d in range(MAX_DISPLACEMENT):
+            placed = set(get_displaced_slot(h, d, num_slots)
+                for (name, h) in bucket)
+            if len(placed) == len(bucket) and \
+                all(slots[i] is None for i in placed):
+                break
+        else:
+            raise Exception("No displacement found for %s" %
+                str([x[0] for x in bucket]))
+        for (name, h) in bucket:
+            slots[get_displaced_slot(h, d, num_slots)] = name
+        displacements[bucket_index] = d
+
+    return (displacements, slots)
+
+def get_slot(name, displacements, num_slots):
+    h = hash_name(name)
+    d = displacements[h % len(displacements)]
+    if d < 0:
+        return -d - 1
+    return get_displaced_slot(h, d, num_slots)
+
+def make_tables(registers):
+    """Order the registers by slot.
+
+    @return: displacements, and names, addresses and types by slot.
+    @rtype: tuple of lists
+    """
+    (displacements, slots) = make_perfect_hash([x[0] for x in registers])
+    by_name = dict((x[0], x) for x in registers)
+    addresses = [by_name[name][1] for name in slots]
+    types = [by_name[name][2] for name in slots]
+    return (displacements, slots, addresses, types)
+
+def write_list(file, name, values, per_line):
+    file.write("%s = [\n" % name)
+    for i in range(0, len(values), per_line):
+        file.write("    %s,\n" % ", ".join(repr(x) for x in values[i:i + per_line]))
+    file.write("]\n\n")
+
+def write_python(file, constants_version, tables):
+    (displacements, names, addresses, types) = tables
+    file.write('"""LabJack LJM register name minimal perfect hash.\n')
+    file.write('\n')
+    file.write('Generated by generate_perfect_hash.py. Do not edit.\n')
+    file.write('"""\n')
+    file.write("import zlib\n")
+    file.write("\n")
+    file.write("LABJACKM_CONSTANTS_VERSION = %r\n" % constants_version)
+    file.write("DISPLACEMENT_MULTIPLIER = %d\n" % DISPLACEMENT_MULTIPLIER)
+    file.write("\n")
+    write_list(file, "DISPLACEMENTS", displacements, 12)
+    write_list(file, "NAMES", names, 4)
+    write_list(file, "ADDRESSES", addresses, 12)
+    write_list(file, "TYPES", types, 20)
+    file.write("def lookup(name):\n")
+    file.write('    """Get (address, type) of a register name, or None."""\n')
+    file.write("    h = zlib.crc32(name.encode('ascii', 'replace'))\n")
+    file.write("    d = DISPLACEMENTS[h % len(DISPLACEMENTS)]\n")
+    file.write("    if d < 0:\n")
+    file.write("        slot = -d - 1\n")
+    file.write("    else:\n")
+    file.write("        h = (h + d * DISPLACEMENT_MULTIPLIER) & 0xFFFFFFFF\n")
+    file.write("        h ^= h >> 16\n")
+    file.write("        h = (h * 0x85EBCA6B) & 0xFFFFFFFF\n")
+    file.write("        h ^= h >> 13\n")
+    file.write("        h = (h * 0xC2B2AE35) & 0xFFFFFFFF\n")
+    file.write("        h ^= h >> 16\n")
+    file.write("        slot = h % len(NAMES)\n")
+    file.write("    if NAMES[slot] != name:\n")
+    file.write("        return None\n")
+    file.write("    return (ADDRESSES[slot], TYPES[slot])\n")
+
+def write_c_array(file, declaration, values, per_line):
+    file.write("%s[] = {\n" % declaration)
+    for i in range(0, len(values), per_line):
+        file.write("\t%s,\n" % ", ".join(str(x) for x in values[i:i + per_line]))
+    file.write("};\n\n")
+
+def make_crc_table():
+    table = []
+    for i in range(0, 256):
+        r = i
+        for j in range(0, 8):
+            if (r & 1):
+                r = (r >> 1) ^ 0xEDB88320
+            else:
+                r = r >> 1
+        table.append(r)
+    return table
+
+def write_c(file, constants_version, tables):
+    (displacements, names, addresses, types) = tables
+    file.write("// LabJack LJM register name minimal perfect hash\n")
+    file.write("// Generated by generate_perfect_hash.py. Do not edit.\n")
+    file.write("#ifndef LABJACKM_PERFECT_HASH_HEADER\n")
+    file.write("#define LABJACKM_PERFECT_HASH_HEADER\n")
+    file.write("\n")
+    file.write("#include <stdint.h>\n")
+    file.write("#include <string.h>\n")
+    file.write("\n")
+    file.write("#define LJM_PH_CONSTANTS_VERSION \"%s\"\n" % constants_version)
+    file.write("#define LJM_PH_NUM_NAMES %d\n" % len(names))
+    file.write("#define LJM_PH_NUM_BUCKETS %d\n" % len(displacements))
+    file.write("#define LJM_PH_DISPLACEMENT_MULTIPLIER 0x%08XU\n" % DISPLACEMENT_MULTIPLIER)
+    file.write("\n")
+    file.write("#ifdef __cplusplus\n")
+    file.write("extern \"C\" {\n")
+    file.write("#endif\n")
+    file.write("\n")
+    write_c_array(file, "static const uint32_t LJM_PH_CRCTable",
+        ["0x%08XU" % x for x in make_crc_table()], 8)
+    write_c_array(file, "static const int32_t LJM_PH_Displacements",
+        displacements, 12)
+    write_c_array(file, "static const char * const LJM_PH_Names",
+        ['"%s"' % x for x in names], 4)
+    write_c_array(file, "static const int32_t LJM_PH_Addresses", addresses, 12)
+    write_c_array(file, "static const uint8_t LJM_PH_Types", types, 20)
+    file.write("static uint32_t LJM_PH_CRC32(uint32_t crc, const char * name)\n")
+    file.write("{\n")
+    file.write("\tcrc = ~crc;\n")
+    file.write("\twhile (*name) {\n")
+    file.write("\t\tcrc = LJM_PH_CRCTable[(crc ^ (uint8_t)*name++) & 0xFF] ^ (crc >> 8);\n")
+    file.write("\t}\n")
+    file.write("\treturn ~crc;\n")
+    file.write("}\n")
+    file.write("\n")
+    file.write("// Returns 1 and sets address and type if name is a register name,\n")
+    file.write("// returns 0 otherwise.\n")
+    file.write("static int LJM_PH_Lookup(const char * name, int * address, int * type)\n")
+    file.write("{\n")
+    file.write("\tuint32_t h = LJM_PH_CRC32(0, name);\n")
+    file.write("\tint32_t d = LJM_PH_Displacements[h % LJM_PH_NUM_BUCKETS];\n")
+    file.write("\tuint32_t slot;\n")
+    file.write("\tif (d < 0) {\n")
+    file.write("\t\tslot = (uint32_t)(-d - 1);\n")
+    file.write("\t} else {\n")
+    file.write("\t\th += (uint32_t)d * LJM_PH_DISPLACEMENT_MULTIPLIER;\n")
+    file.write("\t\th ^= h >> 16;\n")
+    file.write("\t\th *= 0x85EBCA6BU;\n")
+    file.write("\t\th ^= h >> 13;\n")
+    file.write("\t\th *= 0xC2B2AE35U;\n")
+    file.write("\t\th ^= h >> 16;\n")
+    file.write("\t\tslot = h % LJM_PH_NUM_NAMES;\n")
+    file.write("\t}\n")
+    file.write("\tif (strcmp(LJM_PH_Names[slot], name) != 0) {\n")
+    file.write("\t\treturn 0;\n")
+    file.write("\t}\n")
+    file.write("\t*address = LJM_PH_Addresses[slot];\n")
+    file.write("\t*type = LJM_PH_Types[slot];\n")
+    file.write("\treturn 1;\n")
+    file.write("}\n")
+    file.write("\n")
+    file.write("#ifdef __cplusplus\n")
+    file.write("}\n")
+    file.write("#endif\n")
+    file.write("\n")
+    file.write("#endif // #define LABJACKM_PERFECT_HASH_HEADER\n")
+
+def sanity_test():
+    include_dir = os.path.split(C_OUTPUT_FILE)[0]
+    ret = sp.run([
+        'gcc',
+        '-o', 'gen_test/test_perfect_hash',
+        SANITY_TEST_FILE,
+        '-I%s' % include_dir
+    ]).returncode
+    if ret != 0:
+        raise Exception("Could not compile %s" % SANITY_TEST_FILE)
+
+    ret = sp.run(['gen_test/test_perfect_hash']).returncode
+    if ret != 0:
+        raise Exception("Expected output to be 0, but was: %d" % ret)
+
+def benchmark(registers, tables, number=5):
+    """Print the time per lookup of every name, by lookup method."""
+    (displacements, names, addresses, types) = tables
+    by_name = dict((x[0], (x[1], x[2])) for x in registers)
+    num_slots = len(names)
+
+    def perfect_hash_lookup(name):
+        slot = get_slot(name, displacements, num_slots)
+        if names[slot] == name:
+            return (addresses[slot], types[slot])
+        return None
+
+    # The lookup of the embedded constants, without its conflict tables:
+    # the CRC32/POSIX of the name without digits, binary searched
+    (reg_dir, conflict_dir, num_dup_registers) = genconsts.generate(False)
+    crcs = sorted(int(x["crc"], 16) for x in reg_dir)
+    crc_table = genconsts.make_crc_table(32, 256, 0x04C11DB7, 0xFFFFFFFF)
+    def embedded_lookup(name):
+        short_name = genconsts.shorten_reg_name(name)[0]
+        crc = genconsts.crc32_posix(bytearray(short_name, "ascii"),
+            crc_table, 0xFFFFFFFF, 0)
+        i = bisect.bisect_left(crcs, crc)
+        return i < len(crcs) and crcs[i] == crc
+
+    lookup_names = [x[0] for x in registers]
+    methods = [
+        ("dict", by_name.get),
+        ("perfect hash", perfect_hash_lookup),
+        ("embedded CRC binary search", embedded_lookup),
+    ]
+    for (method_name, lookup) in methods:
+        seconds = min(timeit.repeat(
+            lambda: [lookup(x) for x in lookup_names],
+            number=1,
+            repeat=number
+        ))
+        print("%-28s %8.3f us per lookup" % (
+            method_name, seconds / len(lookup_names) * 1e6))
+
+def generate(run_benchmark=False):
+    document = ljmmm.ConstantsDocument(SRC_FILE)
+    constants_version = document.header['version']
+    registers = get_registers(document)
+    tables = make_tables(registers)
+
+    with open(PY_OUTPUT_FILE, 'w') as file:
+        write_python(file, constants_version, tables)
+    with open(C_OUTPUT_FILE, 'w') as file:
+        write_c(file, constants_version, tables)
+
+    if platform != "win32":
+        sanity_test()
+    if run_benchmark:
+        benchmark(registers, tables)
+    return (registers, tables)
+
+if __name__ == "__main__":
+    generate(run_benchmark=("--benchmark" in sys.argv[1:]))
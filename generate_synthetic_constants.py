@@ -0,0 +1,256 @@
+"""Generate large synthetic constants files for scale testing.
+
+The output is ljm_constants.json plus synthetic registers and errors, up to
+a multiple of its register and error counts. Each synthetic register is a
+copy of a randomly chosen real register, so types, tags, access, LJMMM
+ranges, altnames and device lists follow the real distribution, with:
+
+- a unique name, the real name prefixed by a letters only stem
+- addresses in the parts of the 16-bit Modbus address space no real
+  register uses, allocated without overlaps for as long as they fit, up to
+  MAX_VALID_SCALE (4) times the real registers. Beyond that, the free addresses are
+  allocated again from the start, so synthetic registers share addresses
+  with other synthetic registers, and validate.py reports them as
+  duplicate addresses
+- fwmin values drawn from those of the same device in the real file
+- now and then a step or a second #(...) range in its name
+- now and then siblings differing only by a number, like SYNTHAB1_X and
+  SYNTHAB2_X, which end up in the same conflict table of
+  generate_embedded_constants
+
+The output passes validate.py up to that scale and is the same for the same
+seed.
+
+Usage:
+    python generate_synthetic_constants.py SCALE OUTPUT_FILE [SEED]
+"""
+import itertools
+import json
+import random
+import sys
+
+import ljmmm
+
+SRC_FILE = 'LabJack/LJM/ljm_constants.json'
+DEFAULT_SEED = 0
+MAX_ADDRESS = 65535
+# Largest scale whose synthetic registers all get addresses of their own, so
+# that the output passes validate.py
+MAX_VALID_SCALE = 4
+# Synthetic error codes start above all real ones
+FIRST_ERROR_CODE = 100000
+
+SIBLINGS_PROBABILITY = 0.05
+MAX_SIBLINGS = 4
+STEP_PROBABILITY = 0.1
+SECOND_RANGE_PROBABILITY = 0.03
+EXPLICIT_FWMIN_PROBABILITY = 0.5
+
+def get_stem(index):
+    """Letters only name stem: SYNTHA, SYNTHB, ..., SYNTHBA, ..."""
+    letters = ''
+    while True:
+        letters = chr(ord('A') + index % 26) + letters
+        index //= 26
+        if index == 0:
+            break
+    return 'SYNTH%s' % letters
+
+def get_fwmins_by_device(registers):
+    fwmins = {}
+    for register in registers:
+        for device in register['devices']:
+            device = ljmmm.interpret_firmware(device)
+            fwmins.setdefault(device['device'], set()).add(
+                device.get('fwmin', 0))
+    return dict((x, sorted(fwmins[x])) for x in fwmins)
+
+def make_name(template_name, prefix, rng, allow_second_range=True):
+    template = ljmmm.compile_ljmmm_field(template_name)
+    if len(template.ranges) == 0:
+        return prefix + '_' + template_name
+
+    numbers = template.ranges[0]
+    step = numbers.step
+    if rng.random() < STEP_PROBABILITY:
+        step = 2
+    name_range = '#(%d:%d%s)' % (numbers.start, numbers.stop - 1,
+        ':%d' % step if step != 1 else '')
+    name = prefix + '_' + template.literals[0] + name_range + \
+        template.literals[1]
+    if allow_second_range and rng.random() < SECOND_RANGE_PROBABILITY:
+        name += '_CH#(0:%d)' % rng.randint(1, 3)
+    return name
+
+def make_register(template, prefix, address, fwmins_by_device, rng):
+    register = dict(template)
+    # parse_register_data pairs altnames with names of a single range only
+    register['name'] = make_name(template['name'], prefix, rng,
+        allow_second_range=(not template.get('altnames')))
+    register['address'] = address
+    if 'altnames' in template:
+        # An altname must expand to as many names as the name
+        register['altnames'] = ['ALT%s_%s' % (chr(ord('A') + i),
+            register['name']) for (i, x) in enumerate(template['altnames'])
+            if x]
+    register['description'] = '%s Synthetic register %s.' % (
+        template.get('description', ''), prefix)
+
+    devices = []
+    for device in template['devices']:
+        device_name = ljmmm.interpret_firmware(device)['device']
+        if rng.random() < EXPLICIT_FWMIN_PROBABILITY:
+            device = {
+                'device': device_name,
+                'fwmin': rng.choice(fwmins_by_device[device_name])
+            }
+        devices.append(device)
+    register['devices'] = devices
+    return register
+
+def get_address_span(register):
+    num_names = len(ljmmm.compile_ljmmm_field(register['name']))
+    if register['type'] == 'STRING':
+        num_names = 1
+    return num_names * ljmmm.get_datatype_span(register['type'])
+
+def get_free_address_ranges(registers):
+    """Get the [start, end) address ranges, up to MAX_ADDRESS, that none of
+    registers covers."""
+    spans = sorted((x['address'], x['address'] + get_address_span(x))
+        for x in registers)
+    free = []
+    position = 0
+    for (start, end) in spans:
+        if start > position:
+            free.append((position, start))
+        position = max(position, end)
+    if position <= MAX_ADDRESS:
+        free.append((position, MAX_ADDRESS + 1))
+    return free
+
+class AddressAllocator(object):
+    """Hand out addresses from free ranges in order, starting over from the
+    first range once all are used."""
+
+    def __init__(self, free_ranges):
+        self.free_ranges = free_ranges
+        self.range_index = 0
+        self.address = free_ranges[0][0]
+        self.largest = max(end - start for (start, end) in free_ranges)
+
+    def allocate(self, span):
+        if span > self.largest:
+            raise ValueError('No free address range fits %d addresses' % span)
+        while True:
+            (start, end) = self.free_ranges[self.range_index]
+            self.address = max(self.address, start)
+            if self.address + span <= end:
+                address = self.address
+                self.address += span
+                return address
+            self.range_index = (self.range_index + 1) % len(self.free_ranges)
+            if self.range_index == 0:
+                self.address = 0
+
+    def skip(self, count):
+        self.address += count
+
+def iter_synthetic_registers(registers, count, seed=DEFAULT_SEED,
+    reserved_registers=None):
+    """Yield count synthetic registers modeled on registers.
+
+    Their addresses avoid those of registers and, if given,
+    reserved_registers.
+    """
+    rng = random.Random(seed)
+    fwmins_by_device = get_fwmins_by_device(registers)
+    addresses = AddressAllocator(get_free_address_ranges(
+        registers + (reserved_registers or [])))
+    stem_index = 0
+    made = 0
+    while made < count:
+        template = rng.choice(registers)
+        stem = get_stem(stem_index)
+        stem_index += 1
+
+        prefixes = [stem]
+        if rng.random() < SIBLINGS_PROBABILITY:
+            prefixes = [stem + str(i) for i in
+                range(1, rng.randint(2, MAX_SIBLINGS) + 1)]
+        for prefix in prefixes[:count - made]:
+            register = make_register(template, prefix, None,
+                fwmins_by_device, rng)
+            register['address'] = addresses.allocate(
+                get_address_span(register))
+            addresses.skip(rng.randint(0, 2))
+            made += 1
+            yield register
+
+def iter_synthetic_errors(errors, count, seed=DEFAULT_SEED):
+    """Yield count synthetic errors modeled on errors."""
+    rng = random.Random(seed)
+    code = FIRST_ERROR_CODE
+    for i in range(0, count):
+        template = rng.choice(errors)
+        error = dict(template)
+        error['error'] = code
+        error['string'] = '%s_%s' % (get_stem(i), template['string'])
+        code += rng.randint(1, 3)
+        yield error
+
+def write_list(file, items):
+    file.write('[')
+    for (i, item) in enumerate(items):
+        if i:
+            file.write(',')
+        file.write('\n  ')
+        file.write(json.dumps(item))
+    file.write('\n]')
+
+def write_synthetic_constants(file, scale, seed=DEFAULT_SEED, src=SRC_FILE):
+    """Write a constants file with scale times the registers of src.
+
+    Registers are written as they are generated, so memory use does not
+    grow with scale.
+
+    @param file: Where to write the JSON to.
+    @type file: file-like object
+    @param scale: The register and error count multiplier, at least 1.
+    @type scale: int
+    """
+    with open(src) as f:
+        contents = json.load(f)
+    registers = contents['registers']
+    errors = contents['errors']
+    synthetic_registers = iter_synthetic_registers(registers,
+        (scale - 1) * len(registers), seed,
+        reserved_registers=contents.get('registers_beta', []))
+    synthetic_errors = iter_synthetic_errors(errors,
+        (scale - 1) * len(errors), seed)
+
+    file.write('{')
+    for (i, key) in enumerate(contents):
+        if i:
+            file.write(',')
+        file.write('\n"%s": ' % key)
+        if key == 'registers':
+            write_list(file, itertools.chain(registers, synthetic_registers))
+        elif key == 'errors':
+            write_list(file, itertools.chain(errors, synthetic_errors))
+        else:
+            file.write(json.dumps(contents[key]))
+    file.write('\n}\n')
+
+def generate(scale, output_file, seed=DEFAULT_SEED, src=SRC_FILE):
+    with open(output_file, 'w') as file:
+        write_synthetic_constants(file, scale, seed=seed, src=src)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print('Usage: %s SCALE OUTPUT_FILE [SEED]' % sys.argv[0])
+        exit(1)
+    seed = DEFAULT_SEED
+    if len(sys.argv) > 3:
+        seed = int(sys.argv[3])
+    generate(int(sys.argv[1]), sys.argv[2], seed=seed)
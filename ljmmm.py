@@ -4,10 +4,39 @@
 @license GNU GPL v3
 """
 
+import bisect
 import copy
+import functools
+import hashlib
+import itertools
 import json
+import marshal
+import mmap
+import os
 import re
 import string
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 # from sets import Set
 
 DEFAULT_FILE_NAME = "ljm_constants/LabJack/LJM/ljm_constants.json"
@@ -28,6 +57,21 @@ DATATYPE_SIZES_IN_REGISTERS = {
     "INT64": 4,
     "STRING": None
 }
+# LJM_STRING_ALLOCATION_SIZE / LJM_BYTES_PER_REGISTER in LabJackM.h
+STRING_SIZE_IN_REGISTERS = 25
+# Big-endian NumPy dtype of each data type as found in Modbus responses
+DATATYPE_NUMPY_DTYPES = {
+    "BYTE": ">u2",
+    "FLOAT32": ">f4",
+    "FLOAT": ">f4",
+    "UINT16": ">u2",
+    "UINT32": ">u4",
+    "UINT64": ">u8",
+    "INT16": ">i2",
+    "INT32": ">i4",
+    "INT64": ">i8",
+    "STRING": "S%d" % (STRING_SIZE_IN_REGISTERS * 2)
+}
 DATATYPE_TYPE_INDEX = {
     "UINT16": "0",
     "UINT32": "1",
@@ -60,6 +104,85 @@ URL_REGEX += r'(?:(\/\S+)*)'
 URL_REGEX += r')'
 FIND_URLS = re.compile(URL_REGEX, re.IGNORECASE)
 FIND_ENDING_PUNCTUATION = re.compile(r'.*([.,;\)])$')
+FIND_LJMMM_RANGES = re.compile(r'\#\((\d+)\:(\d+)\:?(\d+)?\)')
+FIND_DIGIT_RUNS = re.compile(r'\d+')
+# A complete string literal, or the start of a line or block comment
+FIND_JSON_COMMENT_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|//|/\*')
+FIND_JSON_NON_WHITESPACE = re.compile(r'[^ \t\n\r]|$')
+
+# Bump whenever a change to this module changes the output of
+# get_device_modbus_maps so that old cache files are no longer used.
+MAP_CACHE_FORMAT_VERSION = 1
+DEFAULT_MAP_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "ljmmm"
+)
+# Largest quantity of registers a Modbus Read Holding Registers request may
+# ask for.
+MODBUS_MAX_READ_REGISTERS = 125
+# Stream channel holding the upper 16 bits of the previous 32-bit channel
+STREAM_DATA_CAPTURE_16 = "STREAM_DATA_CAPTURE_16"
+STREAM_32_BIT_DATATYPES = {"UINT32": "uint32", "INT32": "int32"}
+# Error code ranges from LabJackM.h that have no BEGIN / END markers in the
+# errors of a constants file, as (name, first, last)
+ERROR_CODE_RANGES = [
+    ("SUCCESS", 0, 0),
+    ("DEVICE_ERRORS", 2000, 2999),
+    ("USER_ERRORS", 3900, 3999),
+]
+FIND_ERROR_RANGE_MARKER = re.compile(r'^LJME_(\w+)_(BEGIN|END)$')
+# Codes below this are kept in a list indexed by code
+ERROR_INDEX_DENSE_SIZE = 4096
+# Layout of the files written by compile_constants. All integers are
+# little-endian. Strings are (offset, length) references into the UTF-8
+# string table at the end of the file.
+COMPILED_CONSTANTS_MAGIC = b"LJMC"
+COMPILED_CONSTANTS_FORMAT_VERSION = 1
+# Permissions of files written by write_compiled_constants
+COMPILED_CONSTANTS_MODE = 0o644
+COMPILED_DATATYPES = ("UINT16", "UINT32", "INT32", "FLOAT32", "UINT64",
+    "INT16", "INT64", "FLOAT", "BYTE", "STRING")
+COMPILED_FLAGS = ("read", "write", "streamable", "isBuffer", "usesRAM")
+# magic, format version, register record size, device count, device
+# string references, version string, register count, records, hash slot
+# count, hash slots, sorted addresses, record index of each sorted
+# address, error count, sorted error codes, error records, string table
+COMPILED_HEADER = struct.Struct("<4s4I2I2I2I2I3II")
+# name, description, address, type, flags, then one float64 fwmin per
+# device, NaN for devices the register is not on
+COMPILED_REGISTER = struct.Struct("<IIIIIBBxx")
+# name, description
+COMPILED_ERROR = struct.Struct("<IIII")
+COMPILED_STRING_REF = struct.Struct("<II")
+# Module functions instrumented by profile_phases, by the phase they are
+# reported under
+PROFILED_PHASES = (
+    ("read_file", "read_file"),
+    ("json_decode", "decode_json_str"),
+    ("json_decode", "load_json_sections"),
+    ("interpret_ljmmm_field", "compile_ljmmm_field"),
+    ("interpret_ljmmm_field", "interpret_ljmmm_field"),
+    ("apply_anchors", "apply_anchors"),
+    ("parse_register_data", "iter_register_data"),
+    ("device_assembly", "make_shared_register"),
+    ("device_assembly", "make_device_register_entry"),
+)
+# Columns of the tables made by get_register_columns, as NumPy dtypes
+REGISTER_TABLE_DTYPE = [
+    ("address", "u4"),
+    ("size", "u2"),
+    ("type", "i2"),
+    ("read", "?"),
+    ("write", "?"),
+    ("streamable", "?"),
+    ("fwmin", "f8"),
+    ("name", "u4"),
+]
+# Fields of parsed registers holding lists, which make_device_register_entry
+# copies for each dict entry
+REGISTER_LIST_FIELDS = ("tags", "constants", "altnames")
+# Seconds between checks of ConstantsWatcher for a changed constants file
+DEFAULT_WATCH_INTERVAL = 1.0
 
 def read_file(src=DEFAULT_FILE_NAME):
     """Read a file and return the contents with a default file name.
@@ -75,23 +198,83 @@ def read_file(src=DEFAULT_FILE_NAME):
         contents = file_bytes.decode("utf-8","ignore")
     return contents
 
+def iter_lines_without_comments(lines):
+    """Remove comments from the lines of a .json file as they are read.
+
+    Removes // line comments, including ones trailing other content, and
+    /* */ block comments, which may span lines. Comment markers inside string
+    literals are left alone. Every line is yielded, so line numbers in JSON
+    decoding errors still match the file. Runs in time linear in the size of
+    the input.
+
+    @param lines: The lines of the file, for example a file object.
+    @type lines: iterable of str
+    @return: The lines with comments removed.
+    @rtype: iterator of str
+    """
+    in_block_comment = False
+    for line in lines:
+        if line.endswith("\n"):
+            (line, newline) = (line[:-1], "\n")
+        else:
+            newline = ""
+        pieces = []
+        position = 0
+        while position < len(line):
+            if in_block_comment:
+                end = line.find("*/", position)
+                if end == -1:
+                    break
+                in_block_comment = False
+                position = end + 2
+                continue
+
+            match = FIND_JSON_COMMENT_TOKENS.search(line, position)
+            if match is None:
+                pieces.append(line[position:])
+                break
+            token = match.group()
+            if token == "//":
+                pieces.append(line[position:match.start()])
+                break
+            if token == "/*":
+                pieces.append(line[position:match.start()])
+                pieces.append(" ")
+                in_block_comment = True
+            else:
+                pieces.append(line[position:match.end()])
+            position = match.end()
+        yield "".join(pieces) + newline
+
+
 def parse_json_str_for_comments(src):
     """Prepare a .json file that could potentially have comments in it for parsing.
 
+    See iter_lines_without_comments for the comments that are removed.
+
     @keyword src: The raw .json string.
     @type src: str
     @return contents: String ready to be parsed by a JSON parser
     @rtype: str
     """
-    contents = ""
-    lines = src.split('\n')
-    for line in lines:
-        if len(line) >= 2:
-            if line[0] != '/' and line[1] != '/': 
-                contents = contents + line + '\n'
-        else:
-            contents = contents + line + '\n'
-    return contents
+    # Split on "\n" only: str.splitlines also splits on characters such as
+    # U+2028 that may appear inside string literals
+    lines = src.split("\n")
+    lines = [x + "\n" for x in lines[:-1]] + lines[-1:]
+    return "".join(iter_lines_without_comments(lines))
+
+def load_json_with_comments(f):
+    """Load a .json file that could potentially have comments in it.
+
+    Comments are removed line by line as the file is read, see
+    iter_lines_without_comments.
+
+    @param f: The open file, or any other iterable of lines.
+    @type f: file
+    @return: Object representing the loaded .json file.
+    @rtype: dict
+    """
+    return json.loads("".join(iter_lines_without_comments(f)))
 
 def load_json_file(src=DEFAULT_FILE_NAME, enable_utf8=False, enable_comments=False):
     """Load a .json file into memory with a default file name.
@@ -101,8 +284,18 @@ def load_json_file(src=DEFAULT_FILE_NAME, enable_utf8=False, enable_comments=Fal
     @return: Object representing the loaded .json file.
     @rtype: str
     """
+    return decode_json_str(read_file(src), enable_utf8=enable_utf8,
+        enable_comments=enable_comments)
+
+def decode_json_str(file_data, enable_utf8=False, enable_comments=False):
+    """Decode the contents of a .json file that has already been read.
+
+    @param file_data: The raw .json string.
+    @type file_data: str
+    @return: Object representing the decoded .json string.
+    @rtype: dict
+    """
     json_contents = {}
-    file_data = read_file(src)
     if enable_comments:
         file_data = parse_json_str_for_comments(file_data)
 
@@ -112,24 +305,281 @@ def load_json_file(src=DEFAULT_FILE_NAME, enable_utf8=False, enable_comments=Fal
         json_contents = json.loads(file_data)
     return json_contents
 
+def _skip_json_whitespace(text, position):
+    """Get the position of the first non-whitespace character from position."""
+    return FIND_JSON_NON_WHITESPACE.search(text, position).start()
+
+
+def build_json_section_offsets(text):
+    """Find where the value of each top-level key of a JSON object is.
+
+    Every value is decoded once to find where it ends.
+
+    @param text: A JSON object.
+    @type text: str
+    @return: The decoded object, and the [start, end) character offsets of
+        each value in text by key.
+    @rtype: tuple
+    @raise ValueError: Raised if text is not a JSON object.
+    """
+    decoder = json.JSONDecoder()
+    contents = {}
+    offsets = {}
+
+    position = _skip_json_whitespace(text, 0)
+    if text[position:position + 1] != "{":
+        raise ValueError("Expected a JSON object at position %d" % position)
+    position = _skip_json_whitespace(text, position + 1)
+    while text[position:position + 1] != "}":
+        (key, position) = decoder.raw_decode(text, position)
+        position = _skip_json_whitespace(text, position)
+        if text[position:position + 1] != ":":
+            raise ValueError("Expected ':' at position %d" % position)
+        position = _skip_json_whitespace(text, position + 1)
+        (value, end) = decoder.raw_decode(text, position)
+        contents[key] = value
+        offsets[key] = [position, end]
+
+        position = _skip_json_whitespace(text, end)
+        if text[position:position + 1] == ",":
+            position = _skip_json_whitespace(text, position + 1)
+        elif text[position:position + 1] != "}":
+            raise ValueError("Expected ',' or '}' at position %d" % position)
+    return (contents, offsets)
+
+
+def get_json_section_index_path(document, cache_dir=DEFAULT_MAP_CACHE_DIR):
+    """Get the name of the file the section offsets of a document are
+    cached in, which is derived from the contents of the document.
+
+    @param document: The document the offsets are of.
+    @type document: ConstantsDocument
+    @keyword cache_dir: The directory cache files are kept in.
+    @type cache_dir: str
+    @return: Path of the cache file.
+    @rtype: str
+    """
+    return os.path.join(cache_dir, "json_sections-%s.json" % document.digest)
+
+
+def load_json_sections(src=DEFAULT_FILE_NAME, sections=None,
+    cache_dir=DEFAULT_MAP_CACHE_DIR):
+    """Load only some of the top-level values of a .json file.
+
+    The first call for a version of a file decodes the whole file to find
+    where each top-level value is, and caches those offsets in cache_dir
+    (see get_json_section_index_path), keyed by the contents of the file.
+    Later calls, including calls from other processes, decode only the
+    requested values. If the cache can not be written, every call decodes
+    the whole file.
+
+    The file is read through the document, so sections loaded from the same
+    document always come from the same version of the file.
+
+    Does not support comments.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @keyword sections: The top-level keys to load. Defaults to all of them.
+    @type sections: iterable of str
+    @keyword cache_dir: The directory cache files are kept in. Defaults to
+        DEFAULT_MAP_CACHE_DIR.
+    @type cache_dir: str
+    @return: The requested keys that are in the file, and their values.
+    @rtype: dict
+    @raise ValueError: Raised if the file is not a JSON object.
+    """
+    document = get_constants_document(src)
+    text = document.text
+    index_path = get_json_section_index_path(document, cache_dir=cache_dir)
+
+    offsets = None
+    try:
+        with open(index_path) as index_file:
+            offsets = json.load(index_file)
+    except (OSError, ValueError):
+        pass
+
+    if offsets is not None:
+        if sections is None:
+            sections = list(offsets)
+        ret_dict = {}
+        try:
+            for section in sections:
+                if section in offsets:
+                    (start, end) = offsets[section]
+                    ret_dict[section] = json.loads(text[start:end])
+            return ret_dict
+        except (ValueError, TypeError):
+            # Damaged index, rebuild it
+            pass
+
+    (contents, offsets) = build_json_section_offsets(text)
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as index_file:
+                json.dump(offsets, index_file)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+    if sections is None:
+        return contents
+    return dict((x, contents[x]) for x in sections if x in contents)
+
+
+class ConstantsDocument(object):
+    """A JSON constants file that is read and decoded at most once.
+
+    The file is not touched until a section is first requested. Each section
+    (registers, registers_beta, errors, tag_mappings and header) is then
+    memoized, so repeated lookups on the same document share one decode.
+
+    The returned sections are shared with the document rather than copied;
+    callers that need to modify them should copy them first.
+
+    If the whole file has not been decoded yet, the small errors,
+    tag_mappings and header sections are decoded on their own with
+    load_json_sections, so a document only used for errors never decodes
+    the registers. Either way the file itself is read only once, so all
+    sections come from the same version of it.
+    """
+
+    def __init__(self, src=DEFAULT_FILE_NAME, enable_utf8=False,
+        enable_comments=False):
+        """Create a new document for a constants file.
+
+        @keyword src: The name of the file to open.
+        @type src: str
+        @keyword enable_utf8: Flag passed through to load_json_file.
+        @type enable_utf8: bool
+        @keyword enable_comments: Flag passed through to load_json_file.
+        @type enable_comments: bool
+        """
+        self.src = src
+        self.enable_utf8 = enable_utf8
+        self.enable_comments = enable_comments
+        self._text = None
+        self._contents = None
+        self._digest = None
+        self._views = {}
+
+    @property
+    def text(self):
+        """The undecoded file contents, read on first access."""
+        if self._text is None:
+            self._text = read_file(self.src)
+        return self._text
+
+    @property
+    def contents(self):
+        """The whole decoded JSON object, loaded on first access."""
+        if self._contents is None:
+            self._contents = decode_json_str(
+                self.text,
+                enable_utf8=self.enable_utf8,
+                enable_comments=self.enable_comments
+            )
+        return self._contents
+
+    @property
+    def digest(self):
+        """SHA-256 hex digest of the file contents.
+
+        Computing the digest reads the file but does not decode it.
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha256(
+                self.text.encode("utf-8")).hexdigest()
+        return self._digest
+
+    def _view(self, name, build):
+        """Return the memoized view called name, building it if needed."""
+        if not name in self._views:
+            self._views[name] = build()
+        return self._views[name]
+
+    def _section(self, name):
+        """Load a top-level section, without decoding the others if possible."""
+        if self._contents is not None or self.enable_comments or \
+            self.enable_utf8:
+            return self.contents[name]
+        return load_json_sections(self, [name])[name]
+
+    @property
+    def registers(self):
+        """The raw "registers" list."""
+        return self._view("registers",
+            lambda: self.contents.get("registers", []))
+
+    @property
+    def registers_beta(self):
+        """The raw "registers_beta" list."""
+        return self._view("registers_beta",
+            lambda: self.contents.get("registers_beta", []))
+
+    @property
+    def combined_registers(self):
+        """The raw "registers" list followed by the "registers_beta" list.
+
+        Unlike get_combined_registers_list, this does not extend the
+        "registers" list in place.
+        """
+        return self._view("combined_registers",
+            lambda: self.registers + self.registers_beta)
+
+    @property
+    def errors(self):
+        """The raw "errors" list."""
+        return self._view("errors", lambda: self._section("errors"))
+
+    @property
+    def tag_mappings(self):
+        """The raw "tag_mappings" object."""
+        return self._view("tag_mappings",
+            lambda: self._section("tag_mappings"))
+
+    @property
+    def header(self):
+        """The raw "header" object."""
+        return self._view("header", lambda: self._section("header"))
+
+
+def get_constants_document(src=DEFAULT_FILE_NAME, enable_utf8=False,
+    enable_comments=False):
+    """Get a ConstantsDocument for src.
+
+    @keyword src: The name of the file to open or an existing
+        ConstantsDocument, which is returned unchanged.
+    @type src: str or ConstantsDocument
+    @return: Document for the given source.
+    @rtype: ConstantsDocument
+    """
+    if isinstance(src, ConstantsDocument):
+        return src
+    return ConstantsDocument(src, enable_utf8=enable_utf8,
+        enable_comments=enable_comments)
+
+
 def get_raw_registers_data(src=DEFAULT_FILE_NAME, enable_utf8=False):
     """Load information about registers from constants JSON file.
 
-    @keyword src: The name of the file to open. Defaults to DEFAULT_FILE_NAME.
-    @type src: str
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
     @return: Raw JSON data dictionary loaded from source file.
     @rtype: dict
     """
-    json_contents = {}
-    if enable_utf8:
-        json_contents = json.JSONDecoder(encoding='utf-8').decode(read_file(src))
-    else:
-        json_contents = json.loads(read_file(src))
-
-    regular_registers = json_contents["registers"]
-    if "registers_beta" in json_contents:
-        regular_registers.extend(json_contents["registers_beta"])
-    return regular_registers
+    document = get_constants_document(src, enable_utf8=enable_utf8)
+    return document.combined_registers
 
 def get_combined_registers_list(json_contents):
     """Return an extend list of registers listed in a JSON file object.
@@ -175,6 +625,174 @@ def generate_int_enumeration(src):
     return ["%s%d%s" % (template_str, x, afterwards) for x in numbers]
 
 
+class LJMMMTemplate(object):
+    """A LabJack Modbus Map Markup name compiled into literal and range parts.
+
+    A name such as "DIO#(0:22)_EF_CONFIG_A" is parsed once into the segments
+    ["DIO", range(0, 23), "_EF_CONFIG_A"]. The names it stands for can then
+    be counted, iterated over lazily, looked up by position and mapped back
+    to their position without generating the whole list.
+
+    Names with several ranges stand for every combination of their values.
+    The first range varies fastest, which is the order of the nested lists
+    from interpret_ljmmm_field once flattened.
+
+    Use compile_ljmmm_field rather than creating templates directly, so that
+    templates are shared.
+    """
+
+    def __init__(self, src):
+        """Parse a LJMMM name.
+
+        @param src: The name to parse.
+        @type src: str
+        """
+        self.src = src
+        self.literals = []
+        self.ranges = []
+        position = 0
+        for match in FIND_LJMMM_RANGES.finditer(src):
+            (start, end, interval) = match.groups()
+            if interval:
+                interval = int(interval)
+            else:
+                interval = 1
+            self.literals.append(src[position:match.start()])
+            self.ranges.append(range(int(start), int(end) + 1, interval))
+            position = match.end()
+        self.literals.append(src[position:])
+
+        self.literals = tuple(x.replace("#pound", "#") for x in self.literals)
+        self.ranges = tuple(self.ranges)
+        self._length = 1
+        for numbers in self.ranges:
+            self._length *= len(numbers)
+        self._name_regex = None
+
+    def render(self, numbers):
+        """Get the name for one value of each range.
+
+        @param numbers: One number per range, in the order of the ranges.
+        @type numbers: sequence of int
+        @return: The name.
+        @rtype: str
+        """
+        parts = [self.literals[0]]
+        for (number, literal) in zip(numbers, self.literals[1:]):
+            parts.append(str(number))
+            parts.append(literal)
+        return "".join(parts)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        if not self.ranges:
+            yield self.literals[0]
+            return
+        for numbers in itertools.product(*reversed(self.ranges)):
+            yield self.render(numbers[::-1])
+
+    def __getitem__(self, index):
+        """Get the name at a position without expanding the others.
+
+        @param index: The position of the name. Negative positions count
+            from the end.
+        @type index: int
+        @return: The name.
+        @rtype: str
+        @raise IndexError: Raised if index is out of range.
+        """
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("LJMMM name index out of range")
+        numbers = []
+        for values in self.ranges:
+            (index, digit) = divmod(index, len(values))
+            numbers.append(values[digit])
+        return self.render(numbers)
+
+    def get_numbers(self, name):
+        """Get the value of each range that produces a name.
+
+        @param name: A name this template might stand for.
+        @type name: str
+        @return: One number per range, or None if the template does not
+            stand for name.
+        @rtype: list of int
+        """
+        if self._name_regex is None:
+            self._name_regex = re.compile(
+                "(\\d+)".join(re.escape(x) for x in self.literals) + "$"
+            )
+        match = self._name_regex.match(name)
+        if match is None:
+            return None
+        numbers = []
+        for (digits, values) in zip(match.groups(), self.ranges):
+            number = int(digits)
+            if str(number) != digits or not number in values:
+                return None
+            numbers.append(number)
+        return numbers
+
+    def index(self, name):
+        """Get the position of a name without expanding the template.
+
+        @param name: A name this template stands for.
+        @type name: str
+        @return: The position of name, such that self[position] == name.
+        @rtype: int
+        @raise ValueError: Raised if the template does not stand for name.
+        """
+        numbers = self.get_numbers(name)
+        if numbers is None:
+            raise ValueError("%s is not a name of %s" % (name, self.src))
+        index = 0
+        for (number, values) in reversed(list(zip(numbers, self.ranges))):
+            index = index * len(values) + values.index(number)
+        return index
+
+    def __contains__(self, name):
+        return self.get_numbers(name) is not None
+
+    def expand(self):
+        """Get all names, nested in the form returned by interpret_ljmmm_field.
+
+        @return: The only name if there are no ranges, otherwise nested lists
+            of names with one level per range and the last range outermost.
+        @rtype: str or list
+        """
+        return self._expand_nested(len(self.ranges) - 1, [None] * len(self.ranges))
+
+    def _expand_nested(self, range_index, numbers):
+        if range_index < 0:
+            return self.render(numbers)
+        ret_list = []
+        for number in self.ranges[range_index]:
+            numbers[range_index] = number
+            ret_list.append(self._expand_nested(range_index - 1, numbers))
+        return ret_list
+
+    def __repr__(self):
+        return "LJMMMTemplate(%r)" % self.src
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_ljmmm_field(src):
+    """Get the LJMMMTemplate for a LabJack Modbus Map Markup name.
+
+    Templates are cached, so compiling the same name again is cheap.
+
+    @param src: The name to compile.
+    @type src: str
+    @return: The compiled name.
+    @rtype: LJMMMTemplate
+    """
+    return LJMMMTemplate(src)
+
+
 def interpret_ljmmm_field(src):
     """Interpret a small string of LabJack Modbus Map Markup field notation.
 
@@ -186,23 +804,17 @@ def interpret_ljmmm_field(src):
                         number in parentheses with an interval of third number
                         between them. See generate_int_enumeration for more
                         info.
+        "%s#pound%s": Replaced by "#".
+
+    A string with multiple enumerations results in nested lists, the last
+    enumeration being the outermost list. See compile_ljmmm_field to work
+    with the names without generating them all.
 
     @param src: The code to execute.
     @type src: str
     @return: Result of running the snippet.
     """
-    # Interpret string enumeration (of form "%s#(%d:%d)")
-    enumeration_results = re.findall(
-        "(.*)\#\((\d+)\:(\d+)\:?(\d+)?\)(.*)",
-        src
-    )
-    if enumeration_results:
-        enumeration_tuple = enumeration_results[0]
-        result = generate_int_enumeration(enumeration_tuple)
-        return [interpret_ljmmm_field(x) for x in result]
-
-    src = src.replace("#pound", "#")
-    return src
+    return compile_ljmmm_field(src).expand()
 
 
 def enumerate_addresses(start_address, num_addresses, reg_per_address):
@@ -239,6 +851,24 @@ def get_datatype_size(datatype_name):
     return DATATYPE_SIZES_IN_REGISTERS[datatype_name]
 
 
+def get_datatype_span(datatype_name):
+    """Get the number of registers a single value of a datatype covers.
+
+    Same as get_datatype_size, except that STRING values are considered to
+    cover STRING_SIZE_IN_REGISTERS registers instead of None.
+
+    @param datatype_name: The name of the datatype to get the span for.
+    @type datatype_name: str
+    @return: Number of registers covered.
+    @rtype: int
+    @raise ValueError: Raised if datatype_name is not recognized.
+    """
+    size = get_datatype_size(datatype_name)
+    if size == None:
+        return STRING_SIZE_IN_REGISTERS
+    return size
+
+
 def get_datatype_type_index(datatype_name):
     """Get the type index of a datatype (generally an integer).
 
@@ -305,6 +935,27 @@ def interpret_access_descriptor(descriptor):
     return ACCESS_RESTRICTIONS_STRS[descriptor]
 
 
+ANCHOR_TEMPLATE = (
+    "<a target='_blank' rel='noopener noreferrer' href='%s'>"
+    "%s"
+    "</a>"
+    "<img "
+    "style='margin-right: -1;' "
+    "src='https://ljsimpleregisterlookup.herokuapp.com/static/images/ui-icons-extlink.png' />"
+)
+
+
+def _replace_url(match):
+    """re.sub callback for apply_anchors."""
+    url = match.group(0)
+    end_punc = FIND_ENDING_PUNCTUATION.search(url)
+    if end_punc:
+        url = str.rsplit(url, end_punc.group(1), 1)[0]
+        return ANCHOR_TEMPLATE % (url, url) + end_punc.group(1)
+    return ANCHOR_TEMPLATE % (url, url)
+
+
+@functools.lru_cache(maxsize=1024)
 def apply_anchors(text):
     """Parses the given text, applying <a> tags to URLs and returning the result
 
@@ -315,35 +966,17 @@ def apply_anchors(text):
 
     URLs are not allowed to contain a trailing comma, period, or semi-colon.
 
+    The text is scanned once and results are cached by text, so rendering
+    the same description again is free.
+
     @param text: text to apply anchor tags to
     @type text: str
     """
-    url_tuples = FIND_URLS.findall(text)
-    for url_tuple in url_tuples:
-        url = url_tuple[0]
-        end_punc = FIND_ENDING_PUNCTUATION.search(url)
-        if end_punc:
-            url = str.rsplit(url, end_punc.group(1), 1)[0]
-
-        # pos = text.find(url)
-        # if pos == -1:
-        #     raise ValueError('expected to find URL %s in text %s' % (url, text))
-        parts = str.split(text, url, 1)
-        text = parts[0] + (
-            "<a target='_blank' rel='noopener noreferrer' href='%s'>"
-            "%s"
-            "</a>"
-            "<img "
-            "style='margin-right: -1;' "
-            "src='https://ljsimpleregisterlookup.herokuapp.com/static/images/ui-icons-extlink.png' />"
-        )  % (url, url) + parts[1]
-
-
-    return text
+    return FIND_URLS.sub(_replace_url, text)
 
 
 def parse_register_data(raw_register_dict, expand_names=False,
-    expand_alt_names=False):
+    expand_alt_names=False, render_descriptions=True):
     """Parse information about a single register.
 
     Loads and interprets register information from the given dictionary
@@ -383,15 +1016,28 @@ def parse_register_data(raw_register_dict, expand_names=False,
     @type raw_register_dict: dict.
     @param expand_names: Choose whether or not to expand the register names
     @type expand_names: bool
+    @keyword render_descriptions: If False, descriptions are left as they are
+        in raw_register_dict instead of having apply_anchors applied. Callers
+        that do not use descriptions can skip rendering them this way.
+    @type render_descriptions: bool
     @return: List of interpreted dictionaries.
     @rtype: list of dict
     """
+    return list(iter_register_data(raw_register_dict, expand_names,
+        expand_alt_names, render_descriptions))
+
+
+def iter_register_data(raw_register_dict, expand_names=False,
+    expand_alt_names=False, render_descriptions=True):
+    """Same as parse_register_data, but yield the dictionaries one at a time.
+
+    @return: Iterator over interpreted dictionaries.
+    @rtype: iterator of dict
+    """
     if expand_names:
-        names = interpret_ljmmm_field(raw_register_dict["name"])
+        names = compile_ljmmm_field(raw_register_dict["name"])
     else:
-        names = raw_register_dict["name"]
-    if isinstance(names, str):
-        names = [names]
+        names = [raw_register_dict["name"]]
 
     datatype_str = raw_register_dict["type"]
     datatype_size = get_datatype_size(datatype_str)
@@ -414,9 +1060,11 @@ def parse_register_data(raw_register_dict, expand_names=False,
             num_addresses,
             datatype_size
         )
-    name_address_pairs = list(zip(names, addresses))
+    name_address_pairs = zip(names, addresses)
 
-    description = apply_anchors(raw_register_dict.get("description", ""))
+    description = raw_register_dict.get("description", "")
+    if render_descriptions:
+        description = apply_anchors(description)
     default = raw_register_dict.get("default", None)
     streamable = raw_register_dict.get("streamable", False)
     usesRAM = raw_register_dict.get("usesRAM", False)
@@ -429,7 +1077,6 @@ def parse_register_data(raw_register_dict, expand_names=False,
             altnames = [altnames]
 
     # Generate resulting dicts
-    ret_list = []
     altnames_count = 0
     for (name, address) in name_address_pairs:
         inner_altnames = altnames
@@ -437,25 +1084,23 @@ def parse_register_data(raw_register_dict, expand_names=False,
             inner_altnames = [x[altnames_count] for x in altnames]
             altnames_count = altnames_count + 1
 
-        ret_list.append(
-            {
-                "address": address,
-                "name": name,
-                "type": datatype_str,
-                "type_index": type_index,
-                #"numregs": datatype_size,
-                "devices": devices,
-                "readwrite": access_restrictions,
-                "tags": tags,
-                "description": description,
-                "default": default,
-                "streamable": streamable,
-                "usesRAM" : usesRAM,
-                "isBuffer": isBuffer,
-                "constants": constants,
-                "altnames": inner_altnames,
-            }
-        )
+        yield {
+            "address": address,
+            "name": name,
+            "type": datatype_str,
+            "type_index": type_index,
+            #"numregs": datatype_size,
+            "devices": devices,
+            "readwrite": access_restrictions,
+            "tags": tags,
+            "description": description,
+            "default": default,
+            "streamable": streamable,
+            "usesRAM" : usesRAM,
+            "isBuffer": isBuffer,
+            "constants": constants,
+            "altnames": inner_altnames,
+        }
 
     if expand_alt_names:
         alt_names = raw_register_dict.get("altnames", [])
@@ -464,9 +1109,9 @@ def parse_register_data(raw_register_dict, expand_names=False,
             del alt_names_dict["altnames"]
             for name in [x for x in alt_names if x != ""]:
                 alt_names_dict["name"] = name
-                ret_list.extend(parse_register_data(alt_names_dict, expand_names))
-
-    return ret_list
+                for register in iter_register_data(alt_names_dict,
+                    expand_names, render_descriptions=render_descriptions):
+                    yield register
 
 
 def interpret_tags(tags, tags_base_url='http://labjack.com/support/modbus/tags'):
@@ -492,7 +1137,8 @@ def interpret_tags(tags, tags_base_url='http://labjack.com/support/modbus/tags')
 
 
 def get_registers_data(src=DEFAULT_FILE_NAME, expand_names=False,
-    inc_orig=False, expand_alt_names=False, enable_utf8=False, enable_comments=False):
+    inc_orig=False, expand_alt_names=False, enable_utf8=False, enable_comments=False,
+    record_type=dict, render_descriptions=True):
     """Load and parse information about registers from JSON constants file.
 
     Loads and interprets registers information from the given JSON constants
@@ -505,8 +1151,9 @@ def get_registers_data(src=DEFAULT_FILE_NAME, expand_names=False,
     For more information see LabJack Modbus Map Markup notation
     documentation.
 
-    @keyword src: The name of the file to open. Defaults to DEFAULT_FILE_NAME.
-    @type src: str
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
     @keyword expand_names: Flag to indicate if LJMMM fields should be
         interpreted, expanding register entries from AIN#(0:2) to AIN#0, AIN#1,
         and AIN#2. Defaults to False.
@@ -514,17 +1161,30 @@ def get_registers_data(src=DEFAULT_FILE_NAME, expand_names=False,
     @keyword inc_orig: Flag to indicate if the results should be zipped in with
         the original register values. Defaults to False.
     @type inc_orig: bool
+    @keyword record_type: dict, or Register for compact records. Defaults to
+        dict.
+    @type record_type: type
+    @keyword render_descriptions: See parse_register_data. Defaults to True.
+    @type render_descriptions: bool
     @return: dict
     """
-    # raw_data = get_raw_registers_data(src=src, enable_utf8=enable_utf8, enable_comments=enable_comments)
-    raw_data = load_json_file(src=src, enable_utf8=enable_utf8, enable_comments=enable_comments)
-    raw_data = get_combined_registers_list(raw_data)
+    if record_type is not dict and record_type is not Register:
+        raise ValueError("%s is not a known record type." % record_type)
+
+    document = get_constants_document(src, enable_utf8=enable_utf8,
+        enable_comments=enable_comments)
+    raw_data = document.combined_registers
     ret_list = []
+    shared_tuples = {}
     for entry in raw_data:
+        registers = iter_register_data(entry, expand_names, expand_alt_names,
+            render_descriptions)
+        if record_type is Register:
+            registers = [Register(x, shared_tuples) for x in registers]
         if inc_orig:
-            ret_list.append(parse_register_data(entry, expand_names, expand_alt_names))
+            ret_list.append(list(registers))
         else:
-            ret_list.extend(parse_register_data(entry, expand_names, expand_alt_names))
+            ret_list.extend(registers)
 
     if inc_orig:
         return list(zip(raw_data, ret_list))
@@ -533,7 +1193,8 @@ def get_registers_data(src=DEFAULT_FILE_NAME, expand_names=False,
 
 
 def get_device_modbus_maps(src=DEFAULT_FILE_NAME, expand_names=False,
-    inc_orig=False, expand_alt_names=False, enable_utf8=False, enable_comments=False):
+    inc_orig=False, expand_alt_names=False, enable_utf8=False, enable_comments=False,
+    record_type=dict, render_descriptions=True, firmware=None):
     """Load register info from JSON constants file and structure by device.
 
     Loads and interprets registers information from the given JSON constants
@@ -565,8 +1226,9 @@ def get_device_modbus_maps(src=DEFAULT_FILE_NAME, expand_names=False,
     an address with two alternative names will correspond to three elements
     in the returned lists.
 
-    @keyword src: The name of the file to open. Defaults to DEFAULT_FILE_NAME.
-    @type src: str
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
     @keyword expand_names: Flag to indicate if LJMMM fields should be
         interpreted, expanding register entries from AIN#(0:2) to AIN#0, AIN#1,
         and AIN#2. Defaults to False.
@@ -574,70 +1236,2549 @@ def get_device_modbus_maps(src=DEFAULT_FILE_NAME, expand_names=False,
     @keyword inc_orig: Flag to indicate if the results should be zipped in with
         the original register values. Defaults to False.
     @type inc_orig: bool
+    @keyword record_type: The type of the register entries: dict,
+        DeviceRegisterView or Register. See make_device_register_entry.
+        Defaults to dict.
+    @type record_type: type
+    @keyword render_descriptions: See parse_register_data. Defaults to True.
+    @type render_descriptions: bool
+    @keyword firmware: If given, only include registers available on this
+        firmware version, that is registers with fwmin <= firmware. Either a
+        version for all devices or a dict of versions by device name, in
+        which case devices not in the dict are not filtered. Filtered lists
+        are ordered by fwmin, see FirmwareView. The maps are sorted by fwmin
+        once per ConstantsDocument and set of flags, so calls for several
+        versions of the same document only copy the registers of each
+        version. Defaults to None.
+    @type firmware: float or dict
     @return: dict
     """
-    registers_data = get_registers_data(src=src, expand_names=expand_names,
-        inc_orig=inc_orig, expand_alt_names=expand_alt_names, enable_utf8=enable_utf8, enable_comments=enable_comments)
-    device_maps = {}
+    if firmware is not None:
+        document = get_constants_document(src, enable_utf8=enable_utf8,
+            enable_comments=enable_comments)
+        (all_maps, views) = _get_firmware_maps(document, expand_names,
+            inc_orig, expand_alt_names, record_type, render_descriptions)
+        device_maps = {}
+        for (device_name, registers) in all_maps.items():
+            if not isinstance(firmware, dict):
+                registers = views[device_name].at(firmware)
+            elif device_name in firmware:
+                registers = views[device_name].at(firmware[device_name])
+            device_maps[device_name] = [copy_device_register_entry(x)
+                for x in registers]
+        return device_maps
 
-    if inc_orig:
-        preped_registers_data = []
-        for (orig, new_collection) in registers_data:
-            for new in new_collection:
-                preped_registers_data.append((orig, new))
-    else:
-        preped_registers_data = registers_data
-
-    for register in preped_registers_data:
-        if inc_orig: reg_devices = register[1]["devices"]
-        else: reg_devices = register["devices"]
-        for device in reg_devices:
+    device_maps = {}
+    shared_tuples = {}
+    for (orig, register) in iter_registers(src=src, expand_names=expand_names,
+        inc_orig=True, expand_alt_names=expand_alt_names,
+        enable_utf8=enable_utf8, enable_comments=enable_comments,
+        render_descriptions=render_descriptions):
+        shared = None
+        for device in register["devices"]:
 
             device_name = device["device"]
             if not device_name in device_maps:
                 device_maps[device_name] = []
             device_reg_list = device_maps[device_name]
 
-            if inc_orig: new_entry = copy.deepcopy(register[1])
-            else: new_entry = copy.deepcopy(register)
+            # If we want to ignore digit registers, ignore them
+            # Otherwise add them to the register list
+            if (device_name != "DIGIT"):
+                if shared is None:
+                    shared = make_shared_register(orig, register)
+                new_entry = make_device_register_entry(shared, device,
+                    record_type, shared_tuples)
+                if inc_orig:
+                    device_reg_list.append((orig, new_entry))
+                else:
+                    device_reg_list.append(new_entry)
+
+    return device_maps
+
+
+def make_shared_register(orig, register):
+    """Collect the fields of a register that are the same for every device.
+
+    @param orig: The raw register the register was parsed from.
+    @type orig: dict
+    @param register: A register in the form output by parse_register_data.
+    @type register: dict
+    @return: The fields of a get_device_modbus_maps entry, in the same
+        order. fwmin and deviceDescription are placeholders set to None.
+    @rtype: dict
+    """
+    shared = dict(register)
+    del shared["devices"]
+    del shared["readwrite"]
+    shared["constants"] = orig.get("constants", [])
+    # TODO: Something better
+    shared.pop("numregs", None)
+    shared["fwmin"] = None
+    shared["deviceDescription"] = None
+    access_permissions = register["readwrite"]
+    shared["read"] = access_permissions["read"]
+    shared["write"] = access_permissions["write"]
+    return shared
+
+
+class DeviceRegisterView(Mapping):
+    """Read-only view of a register as it appears on one device.
+
+    Holds the fields shared by all devices, as returned by
+    make_shared_register, plus the two fields that differ between devices:
+    fwmin and deviceDescription. Compares equal to the equivalent dict.
+    """
+
+    __slots__ = ("_shared", "_fwmin", "_device_description")
 
-            min_firmware = device.get("fwmin", 0)
-            new_entry["fwmin"] = min_firmware
-            new_entry["deviceDescription"] = device.get("description", "")
-            del new_entry["devices"]
+    def __init__(self, shared, fwmin, device_description):
+        self._shared = shared
+        self._fwmin = fwmin
+        self._device_description = device_description
 
-            access_permissions = new_entry["readwrite"]
-            read_val = access_permissions["read"]
-            write_val = access_permissions["write"]
-            new_entry["read"] = read_val
-            new_entry["write"] = write_val
-            del new_entry["readwrite"]
+    def __getitem__(self, key):
+        if key == "fwmin":
+            return self._fwmin
+        if key == "deviceDescription":
+            return self._device_description
+        return self._shared[key]
 
+    def __iter__(self):
+        return iter(self._shared)
+
+    def __len__(self):
+        return len(self._shared)
+
+    def __repr__(self):
+        return "DeviceRegisterView(%r)" % dict(self)
+
+
+def share_tuple(values, shared_tuples=None):
+    """Get a tuple equal to values, reusing an earlier equal tuple if any.
+
+    Strings in values are interned. Dicts, such as constants, are shared as
+    long as all of their values are hashable.
+
+    @param values: The values to put in the tuple.
+    @type values: iterable
+    @keyword shared_tuples: The tuples to reuse, by key, to which the tuple
+        is added if it is new. Kept by the caller for as long as tuples
+        should be shared, usually the building of one map. Defaults to no
+        sharing.
+    @type shared_tuples: dict
+    @return: The shared tuple.
+    @rtype: tuple
+    """
+    if not values:
+        return ()
+    values = tuple(sys.intern(x) if isinstance(x, str) else x for x in values)
+    if shared_tuples is None:
+        return values
+    try:
+        key = tuple(
+            tuple(sorted(x.items())) if isinstance(x, dict) else x
+            for x in values
+        )
+        return shared_tuples.setdefault(key, values)
+    except TypeError:
+        return values
+
+
+class Register(Mapping):
+    """Compact record for a register.
+
+    A record with __slots__ instead of a per-instance dict, for holding many
+    expanded registers in memory. Name, type and tag strings are interned
+    and list fields (tags, altnames, constants and devices) are stored as
+    shared tuples, so they do not compare equal to the lists of the
+    equivalent dict.
+
+    Fields are available as attributes and, since Register is a Mapping,
+    as keys. Only the fields of the dict a Register was created from are
+    present.
+
+    Tuples are shared between the Registers created with the same
+    shared_tuples dict, which the functions returning Registers create for
+    each call.
+    """
+
+    __slots__ = (
+        "address",
+        "name",
+        "type",
+        "type_index",
+        "devices",
+        "readwrite",
+        "tags",
+        "description",
+        "default",
+        "streamable",
+        "usesRAM",
+        "isBuffer",
+        "constants",
+        "altnames",
+        "fwmin",
+        "deviceDescription",
+        "read",
+        "write",
+    )
+    _fields = frozenset(__slots__)
+    _interned_fields = frozenset(["name", "type", "type_index"])
+    _tuple_fields = frozenset(["devices", "tags", "constants", "altnames"])
+
+    def __init__(self, fields, shared_tuples=None):
+        """Create a record.
+
+        @param fields: The fields of the register, for example a dict
+            output by parse_register_data or get_device_modbus_maps.
+        @type fields: dict
+        @keyword shared_tuples: See share_tuple.
+        @type shared_tuples: dict
+        @raise KeyError: Raised if fields contains an unknown field.
+        """
+        known_fields = self._fields
+        interned_fields = self._interned_fields
+        tuple_fields = self._tuple_fields
+        set_field = object.__setattr__
+        for (key, value) in fields.items():
+            if not key in known_fields:
+                raise KeyError(key)
+            if key in interned_fields:
+                value = sys.intern(value)
+            elif key in tuple_fields:
+                value = share_tuple(value, shared_tuples)
+            set_field(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Register records are read-only")
+
+    def __getitem__(self, key):
+        if not key in self._fields:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return "Register(%r)" % dict(self)
+
+
+def copy_json_value(value):
+    """Copy the lists and dicts of a decoded JSON value, like copy.deepcopy.
+
+    Much faster than copy.deepcopy since it does not track shared or
+    recursive references, which decoded JSON does not have.
+
+    @param value: The value to copy.
+    @type value: list, dict, str, int, float, bool or None
+    @return: The copy.
+    """
+    if isinstance(value, list):
+        if all(isinstance(x, str) for x in value):
+            return list(value)
+        return [copy_json_value(x) for x in value]
+    if isinstance(value, dict):
+        return dict((k, copy_json_value(v)) for (k, v) in value.items())
+    return value
+
+
+def copy_device_register_entry(entry):
+    """Copy an entry of a device's modbus map, as made by
+    make_device_register_entry, so that it can be modified.
+
+    Read-only DeviceRegisterView and Register entries are returned as they
+    are.
+
+    @param entry: The entry, or an (original register, entry) pair.
+    @type entry: dict, DeviceRegisterView, Register or tuple
+    @return: The copy.
+    @rtype: dict, DeviceRegisterView, Register or tuple
+    """
+    if isinstance(entry, tuple):
+        return (entry[0], copy_device_register_entry(entry[1]))
+    if not isinstance(entry, dict):
+        return entry
+    entry = dict(entry)
+    for key in REGISTER_LIST_FIELDS:
+        if entry.get(key):
+            entry[key] = copy_json_value(entry[key])
+    return entry
+
+
+def make_device_register_entry(shared, device, record_type=dict,
+    shared_tuples=None):
+    """Create the entry of a register for one device's modbus map.
+
+    dict entries get their own copies of the list fields of shared (tags,
+    constants and altnames), so they can be modified like the entries of a
+    freshly decoded file. DeviceRegisterView and Register entries share
+    them with each other and with the raw register and are read-only.
+
+    @param shared: Fields shared by all devices, from make_shared_register.
+    @type shared: dict
+    @param device: The explicit firmware descriptor of the device the entry
+        is for.
+    @type device: dict
+    @keyword record_type: dict for a new dict, DeviceRegisterView for a
+        read-only view that only stores the device specific fields or
+        Register for a compact record.
+    @type record_type: type
+    @keyword shared_tuples: Passed through to Register.
+    @type shared_tuples: dict
+    @return: Entry for the device's modbus map.
+    @rtype: dict, DeviceRegisterView or Register
+    """
+    min_firmware = device.get("fwmin", 0)
+    device_description = device.get("description", "")
+    if record_type is DeviceRegisterView:
+        return DeviceRegisterView(shared, min_firmware, device_description)
+    if record_type is not dict and record_type is not Register:
+        raise ValueError("%s is not a known record type." % record_type)
+
+    new_entry = dict(shared)
+    new_entry["fwmin"] = min_firmware
+    new_entry["deviceDescription"] = device_description
+    if record_type is Register:
+        return Register(new_entry, shared_tuples)
+    for key in REGISTER_LIST_FIELDS:
+        if new_entry.get(key):
+            new_entry[key] = copy_json_value(new_entry[key])
+    return new_entry
+
+
+def iter_registers(src=DEFAULT_FILE_NAME, expand_names=False, inc_orig=False,
+    expand_alt_names=False, enable_utf8=False, enable_comments=False,
+    render_descriptions=True):
+    """Same as get_registers_data, but yield registers one at a time.
+
+    Registers are parsed as they are requested, so only the raw JSON is held
+    in memory no matter how many registers expand_names produces.
+
+    @keyword inc_orig: Flag to indicate if (original register, register)
+        pairs should be yielded instead of registers. Unlike
+        get_registers_data, there is one pair per register rather than one
+        per original register. Defaults to False.
+    @type inc_orig: bool
+    @return: Iterator over registers in the form output by
+        parse_register_data.
+    @rtype: iterator
+    """
+    document = get_constants_document(src, enable_utf8=enable_utf8,
+        enable_comments=enable_comments)
+    for entry in document.combined_registers:
+        for register in iter_register_data(entry, expand_names,
+            expand_alt_names, render_descriptions):
             if inc_orig:
-                new_entry["description"] = register[1].get("description", "")
-                new_entry["constants"] = register[0].get("constants", [])
+                yield (entry, register)
             else:
-                new_entry["description"] = register.get("description", "")
-                new_entry["constants"] = register.get("constants", [])
+                yield register
 
-            # TODO: Something better
-            new_entry.pop("numregs", None)
-            # If we want to ignore digit registers, ignore them
-            # Otherwise add them to the register list
-            if (device["device"] != "DIGIT"):
+
+def iter_device_registers(device, src=DEFAULT_FILE_NAME, expand_names=False,
+    inc_orig=False, expand_alt_names=False, enable_utf8=False,
+    enable_comments=False, record_type=dict, render_descriptions=True):
+    """Same as get_device_modbus_maps()[device], but yield one at a time.
+
+    @param device: The name of the device to yield registers for.
+    @type device: str
+    @return: Iterator over registers in the form of the entries of
+        get_device_modbus_maps, or (original register, register) pairs if
+        inc_orig.
+    @rtype: iterator
+    """
+    if device == "DIGIT":
+        return
+    shared_tuples = {}
+    for (orig, register) in iter_registers(src=src, expand_names=expand_names,
+        inc_orig=True, expand_alt_names=expand_alt_names,
+        enable_utf8=enable_utf8, enable_comments=enable_comments,
+        render_descriptions=render_descriptions):
+        for device_descriptor in register["devices"]:
+            if device_descriptor["device"] == device:
+                new_entry = make_device_register_entry(
+                    make_shared_register(orig, register),
+                    device_descriptor,
+                    record_type,
+                    shared_tuples
+                )
                 if inc_orig:
-                    device_reg_list.append((register[0], new_entry))
+                    yield (orig, new_entry)
                 else:
-                    device_reg_list.append(new_entry)
+                    yield new_entry
 
-    return device_maps
+
+def get_device_names(src=DEFAULT_FILE_NAME):
+    """Get the names of all devices with registers in a constants file.
+
+    The names are in the same order as the keys of get_device_modbus_maps.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @return: Device names.
+    @rtype: list of str
+    """
+    device_names = []
+    for entry in get_constants_document(src).combined_registers:
+        for firmware in entry["devices"]:
+            device_name = interpret_firmware(firmware)["device"]
+            if not device_name in device_names:
+                device_names.append(device_name)
+    return device_names
 
 def get_errors(src=DEFAULT_FILE_NAME):
     """Load LJM and LJM-supported-device errors."""
-    contents = read_file(src)
-    return json.loads(contents)["errors"]
+    return get_constants_document(src).errors
 
 def get_tag_mappings(src=DEFAULT_FILE_NAME):
     """Load LJM and LJM-supported-tag mappings."""
-    contents = read_file(src)
-    return json.loads(contents)["tag_mappings"]
+    return get_constants_document(src).tag_mappings
+
+def get_header(src=DEFAULT_FILE_NAME):
+    """Load the constants file header."""
+    return get_constants_document(src).header
+
+
+def get_map_cache_path(document, cache_dir=DEFAULT_MAP_CACHE_DIR, **flags):
+    """Get the cache file name for a set of get_device_modbus_maps results.
+
+    The name is derived from the contents of the constants file, how the
+    document decodes it (its enable_utf8 and enable_comments), the
+    MAP_CACHE_FORMAT_VERSION, the marshal format version and the given flags,
+    so editing the constants file, decoding it differently or asking for a
+    different expansion selects a different file. flags must therefore
+    include every other argument that changes the maps.
+
+    @param document: The document the maps are built from.
+    @type document: ConstantsDocument
+    @keyword cache_dir: The directory cache files are kept in.
+    @type cache_dir: str
+    @return: Path of the cache file.
+    @rtype: str
+    """
+    flags = dict(flags, enable_utf8=document.enable_utf8,
+        enable_comments=document.enable_comments)
+    key = "%d:%d:%s:%s" % (
+        MAP_CACHE_FORMAT_VERSION,
+        marshal.version,
+        document.digest,
+        ",".join("%s=%s" % (k, flags[k]) for k in sorted(flags))
+    )
+    key_digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "device_modbus_maps-%s.marshal" % key_digest)
+
+
+def get_cached_device_modbus_maps(src=DEFAULT_FILE_NAME, expand_names=False,
+    inc_orig=False, expand_alt_names=False, enable_utf8=False,
+    enable_comments=False, cache_dir=DEFAULT_MAP_CACHE_DIR,
+    render_descriptions=True):
+    """Same as get_device_modbus_maps, but backed by a cache on disk.
+
+    The first call for a given constants file and set of flags builds the
+    maps with get_device_modbus_maps and marshals them into cache_dir. Later
+    calls, including calls from other processes, load that file instead.
+    A changed constants file hashes to a new cache file, so stale results
+    are never returned.
+
+    Cache files are written to a temporary file and then renamed into
+    place, so concurrent readers and writers only ever see complete files.
+    A cache file that cannot be read is rebuilt. A cache directory that
+    cannot be written to is ignored.
+
+    @keyword cache_dir: The directory cache files are kept in. Defaults to
+        DEFAULT_MAP_CACHE_DIR.
+    @type cache_dir: str
+    @return: dict
+    """
+    document = get_constants_document(src, enable_utf8=enable_utf8,
+        enable_comments=enable_comments)
+    cache_path = get_map_cache_path(
+        document,
+        cache_dir=cache_dir,
+        expand_names=expand_names,
+        inc_orig=inc_orig,
+        expand_alt_names=expand_alt_names,
+        render_descriptions=render_descriptions
+    )
+
+    try:
+        with open(cache_path, "rb") as f:
+            return marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    device_maps = get_device_modbus_maps(src=document,
+        expand_names=expand_names, inc_orig=inc_orig,
+        expand_alt_names=expand_alt_names,
+        render_descriptions=render_descriptions)
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                marshal.dump(device_maps, f)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+    return device_maps
+
+
+class NameResolver(object):
+    """Resolve register names to addresses without expanding LJMMM names.
+
+    Works like LJM_NameToAddress. Each raw register entry of the form
+    PREFIX#(start:end:step)SUFFIX is stored once under its (PREFIX, SUFFIX)
+    key. A queried name is split around each run of digits in it, and the
+    address of a matching entry is computed as:
+
+        address + (n - start) / step * size
+
+    Memory use is therefore proportional to the number of raw register
+    entries, not to the number of expanded names. Altnames are resolved the
+    same way, using the range of the altname itself.
+
+    Entries that contain more than one #(...) range, or whose range is next
+    to a digit, are expanded up front. When several entries resolve the same name, the one that comes first in
+    raw_registers wins, and a name wins over the altnames of its entry.
+    """
+
+    def __init__(self, raw_registers, device=None):
+        """Build the lookup tables.
+
+        @param raw_registers: Raw register entries as found in a constants
+            file.
+        @type raw_registers: list of dict
+        @keyword device: If given, only registers available on this device
+            are resolvable.
+        @type device: str
+        """
+        self._exact = {}
+        self._templates = {}
+        self._num_names = 0
+        for raw_register in raw_registers:
+            if device is not None:
+                devices = [interpret_firmware(x)["device"]
+                    for x in raw_register["devices"]]
+                if not device in devices:
+                    continue
+
+            datatype_str = raw_register["type"]
+            datatype_size = get_datatype_size(datatype_str)
+            address = raw_register["address"]
+            self._add(raw_register["name"], address, datatype_str,
+                datatype_size)
+            for altname in raw_register.get("altnames", []):
+                if altname != "":
+                    self._add(altname, address, datatype_str, datatype_size)
+
+    def _add(self, name, address, datatype_str, datatype_size):
+        """Add a single name, which may contain a #(...) range."""
+        # Names are numbered in the order they are added, for resolve to
+        # pick the first of several matching names
+        order = self._num_names
+        self._num_names += 1
+        template = compile_ljmmm_field(name)
+        # resolve splits names around whole digit runs, so a range next to
+        # a digit, as in FOO1#(0:3), has to be expanded
+        if len(template.ranges) == 1 and datatype_size is not None and \
+            not template.literals[0][-1:].isdigit() and \
+            not template.literals[1][:1].isdigit():
+            key = (template.literals[0], template.literals[1])
+            numbers = template.ranges[0]
+            self._templates.setdefault(key, []).append((numbers.start,
+                numbers.stop - 1, numbers.step, address, datatype_size,
+                datatype_str, order))
+            return
+
+        # Fall back to expansion for names this class can not compute
+        # arithmetically. Variable size registers only get one name, as in
+        # parse_register_data.
+        if datatype_size is None:
+            datatype_size = 0
+            template = itertools.islice(template, 1)
+        for (i, expanded) in enumerate(template):
+            self._exact.setdefault(expanded,
+                (order, (address + i * datatype_size, datatype_str)))
+
+    def resolve(self, name):
+        """Get the address and data type of a register name.
+
+        @param name: The register name, for example AIN137.
+        @type name: str
+        @return: The address and data type name, for example (274, "FLOAT32").
+        @rtype: tuple
+        @raise KeyError: Raised if name is not a known register name.
+        """
+        best = self._exact.get(name)
+        for match in FIND_DIGIT_RUNS.finditer(name):
+            digits = match.group()
+            if len(digits) > 1 and digits[0] == "0":
+                continue
+            templates = self._templates.get(
+                (name[:match.start()], name[match.end():]))
+            if templates is None:
+                continue
+            n = int(digits)
+            for (start, end, step, address, size, datatype_str,
+                order) in templates:
+                if best is not None and best[0] < order:
+                    break
+                if start <= n <= end and (n - start) % step == 0:
+                    best = (order,
+                        (address + (n - start) // step * size, datatype_str))
+                    break
+
+        if best is None:
+            raise KeyError(name)
+        return best[1]
+
+    def get(self, name, default=None):
+        """Same as resolve, but return default for unknown names."""
+        try:
+            return self.resolve(name)
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def names_to_addresses(self, names):
+        """Resolve several names, like LJM_NamesToAddresses.
+
+        @param names: The register names to resolve.
+        @type names: iterable of str
+        @return: List of addresses and list of data type names.
+        @rtype: tuple of lists
+        @raise KeyError: Raised if any name is not a known register name.
+        """
+        addresses = []
+        datatypes = []
+        for name in names:
+            (address, datatype_str) = self.resolve(name)
+            addresses.append(address)
+            datatypes.append(datatype_str)
+        return (addresses, datatypes)
+
+
+def flatten_ljmmm_names(names):
+    """Flatten the nested lists returned by interpret_ljmmm_field.
+
+    @param names: A str or a possibly nested list of str.
+    @type names: str or list
+    @return: The names in order.
+    @rtype: list of str
+    """
+    if isinstance(names, str):
+        return [names]
+    flattened = []
+    for name in names:
+        flattened.extend(flatten_ljmmm_names(name))
+    return flattened
+
+
+def get_name_resolver(src=DEFAULT_FILE_NAME, device=None):
+    """Create a NameResolver for a constants file.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @keyword device: If given, only registers available on this device
+        are resolvable.
+    @type device: str
+    @return: Resolver for the registers in src.
+    @rtype: NameResolver
+    """
+    return NameResolver(get_constants_document(src).combined_registers,
+        device=device)
+
+
+class AddressIndex(object):
+    """Map register addresses back to the registers that cover them.
+
+    Every register covers the span of addresses from its own address up to
+    its address plus get_datatype_span of its type, so the second word of a
+    FLOAT32 or the fourth word of a UINT64 resolves to its register. Spans
+    are kept sorted by starting address and looked up with bisect.
+
+    Registers sharing a starting address are merged into one entry, the
+    first name seen being the name of the entry and the others its
+    altnames. Entries are dicts of the form:
+    {
+        "address": int,
+        "name": str,
+        "type": str,
+        "size": int,
+        "altnames": list of str
+    }
+    """
+
+    def __init__(self, registers):
+        """Build the index.
+
+        @param registers: Expanded registers of a single device, for example
+            one list from get_device_modbus_maps(expand_names=True,
+            expand_alt_names=True).
+        @type registers: list of dict
+        """
+        entries_by_address = {}
+        for register in registers:
+            address = register["address"]
+            entry = entries_by_address.get(address)
+            if entry is None:
+                entries_by_address[address] = {
+                    "address": address,
+                    "name": register["name"],
+                    "type": register["type"],
+                    "size": get_datatype_span(register["type"]),
+                    "altnames": [],
+                }
+            elif register["name"] != entry["name"] and \
+                not register["name"] in entry["altnames"]:
+                entry["altnames"].append(register["name"])
+
+        self._starts = sorted(entries_by_address)
+        self._entries = [entries_by_address[x] for x in self._starts]
+        self._ends = [x["address"] + x["size"] for x in self._entries]
+        self._max_size = max([x["size"] for x in self._entries] or [0])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, address):
+        """Get the registers covering an address.
+
+        @param address: The register address to look up.
+        @type address: int
+        @return: (entry, offset) pairs, where offset is the number of
+            registers address is past the start of entry. Ordered from the
+            nearest starting address, so the first pair has the smallest
+            offset. Empty if no register covers address.
+        @rtype: list of tuple
+        """
+        starts = self._starts
+        ends = self._ends
+        entries = self._entries
+        lowest_start = address - self._max_size
+        hits = []
+        i = bisect.bisect_right(starts, address) - 1
+        while i >= 0 and starts[i] > lowest_start:
+            if address < ends[i]:
+                hits.append((entries[i], address - starts[i]))
+            i -= 1
+        return hits
+
+    def lookup_many(self, addresses):
+        """Same as lookup, for each of a sequence of addresses.
+
+        @param addresses: The register addresses to look up.
+        @type addresses: iterable of int
+        @return: One list of (entry, offset) pairs per address.
+        @rtype: list of list
+        """
+        lookup = self.lookup
+        return [lookup(x) for x in addresses]
+
+    def get_register(self, address):
+        """Get the nearest register covering an address.
+
+        @param address: The register address to look up.
+        @type address: int
+        @return: (entry, offset) or None if no register covers address.
+        @rtype: tuple
+        """
+        hits = self.lookup(address)
+        if hits:
+            return hits[0]
+        return None
+
+
+def get_address_indexes(src=DEFAULT_FILE_NAME):
+    """Create an AddressIndex for each device in a constants file.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @return: AddressIndex by device name.
+    @rtype: dict
+    """
+    device_maps = get_device_modbus_maps(src=src, expand_names=True,
+        expand_alt_names=True, render_descriptions=False)
+    return dict((device, AddressIndex(registers))
+        for (device, registers) in device_maps.items())
+
+
+# Positions of the set bits of every byte value, for RegisterSet iteration
+_BYTE_BIT_POSITIONS = tuple(
+    tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)
+)
+
+def make_bitset(ids):
+    """Create an int bitset with the given bits set.
+
+    @param ids: The bit positions to set.
+    @type ids: iterable of int
+    @return: The bitset.
+    @rtype: int
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    bitset_bytes = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        bitset_bytes[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bytes(bitset_bytes), "little")
+
+
+def iter_bitset(bitset):
+    """Yield the positions of the set bits of an int bitset in order."""
+    bitset_bytes = bitset.to_bytes((bitset.bit_length() + 7) // 8, "little")
+    for (byte_index, value) in enumerate(bitset_bytes):
+        if value:
+            base = byte_index << 3
+            for bit in _BYTE_BIT_POSITIONS[value]:
+                yield base + bit
+
+
+class RegisterSet(object):
+    """Lazy result of a RegisterQueryIndex query.
+
+    Holds the matching register IDs as an int bitset. Registers are only
+    looked up when iterated over. Sets from the same index can be combined
+    with &, | and -.
+    """
+
+    def __init__(self, registers, bitset):
+        self._registers = registers
+        self.bitset = bitset
+
+    def __len__(self):
+        return bin(self.bitset).count("1")
+
+    def __bool__(self):
+        return self.bitset != 0
+
+    def __iter__(self):
+        registers = self._registers
+        for register_id in iter_bitset(self.bitset):
+            yield registers[register_id]
+
+    def __and__(self, other):
+        return RegisterSet(self._registers, self.bitset & other.bitset)
+
+    def __or__(self, other):
+        return RegisterSet(self._registers, self.bitset | other.bitset)
+
+    def __sub__(self, other):
+        return RegisterSet(self._registers, self.bitset & ~other.bitset)
+
+    def ids(self):
+        """Get the IDs (positions in the index) of the registers in the set."""
+        return list(iter_bitset(self.bitset))
+
+    def names(self):
+        """Yield the names of the registers in the set."""
+        for register in self:
+            yield register["name"]
+
+
+class RegisterQueryIndex(object):
+    """Inverted indexes for finding registers by their properties.
+
+    Registers are numbered by their position and every indexed value, such
+    as a tag or a device name, maps to an int bitset of the registers that
+    have it. A query intersects one bitset per condition, so its cost does
+    not depend on how many registers match.
+
+    Indexed properties are tags, devices, streamable, read, write, isBuffer
+    and usesRAM.
+    """
+
+    FLAGS = ("streamable", "read", "write", "isBuffer", "usesRAM")
+
+    def __init__(self, registers):
+        """Build the indexes.
+
+        @param registers: Registers in the form output by
+            parse_register_data, for example from iter_registers.
+        @type registers: iterable of dict
+        """
+        self.registers = []
+        tag_ids = {}
+        device_ids = {}
+        flag_ids = dict((x, []) for x in self.FLAGS)
+        for (register_id, register) in enumerate(registers):
+            self.registers.append(register)
+            for tag in register["tags"]:
+                tag_ids.setdefault(tag, []).append(register_id)
+            for device in register["devices"]:
+                device_ids.setdefault(device["device"], []).append(register_id)
+            readwrite = register["readwrite"]
+            flags = {
+                "streamable": register["streamable"],
+                "read": readwrite["read"],
+                "write": readwrite["write"],
+                "isBuffer": register["isBuffer"],
+                "usesRAM": register["usesRAM"],
+            }
+            for flag in self.FLAGS:
+                if flags[flag]:
+                    flag_ids[flag].append(register_id)
+
+        self.all = make_bitset(range(len(self.registers)))
+        self.tags = dict((x, make_bitset(y)) for (x, y) in tag_ids.items())
+        self.devices = dict((x, make_bitset(y)) for (x, y) in device_ids.items())
+        self.flags = dict((x, make_bitset(y)) for (x, y) in flag_ids.items())
+
+    def __len__(self):
+        return len(self.registers)
+
+    def query(self, tags=None, device=None, **flags):
+        """Find the registers matching all of the given conditions.
+
+        For example, the streamable, readable T7 registers tagged AIN_EF:
+
+            index.query(tags=["AIN_EF"], device="T7", streamable=True,
+                read=True)
+
+        @keyword tags: Tags the registers must all have.
+        @type tags: iterable of str
+        @keyword device: A device the registers must be available on.
+        @type device: str
+        @keyword flags: Required values of streamable, read, write, isBuffer
+            or usesRAM.
+        @type flags: bool
+        @return: The matching registers.
+        @rtype: RegisterSet
+        @raise ValueError: Raised if a flag is not indexed.
+        """
+        bitset = self.all
+        if tags is not None:
+            if isinstance(tags, str):
+                tags = [tags]
+            for tag in tags:
+                bitset &= self.tags.get(tag, 0)
+        if device is not None:
+            bitset &= self.devices.get(device, 0)
+        for (flag, value) in flags.items():
+            if not flag in self.flags:
+                raise ValueError("%s is not an indexed flag." % flag)
+            if value:
+                bitset &= self.flags[flag]
+            else:
+                bitset &= ~self.flags[flag]
+        return RegisterSet(self.registers, bitset)
+
+
+def get_register_query_index(src=DEFAULT_FILE_NAME, expand_names=True,
+    expand_alt_names=False, render_descriptions=False):
+    """Create a RegisterQueryIndex for the registers of a constants file.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @keyword expand_names: Flag to indicate if LJMMM fields should be
+        interpreted. Defaults to True.
+    @type expand_names: bool
+    @keyword expand_alt_names: Flag to indicate if altnames should get their
+        own registers. Defaults to False.
+    @type expand_alt_names: bool
+    @keyword render_descriptions: See parse_register_data. Nothing is indexed
+        by description, so defaults to False.
+    @type render_descriptions: bool
+    @return: The index.
+    @rtype: RegisterQueryIndex
+    """
+    return RegisterQueryIndex(iter_registers(src=src,
+        expand_names=expand_names, expand_alt_names=expand_alt_names,
+        render_descriptions=render_descriptions))
+
+
+class FirmwareView(object):
+    """The registers of a device, ordered by the firmware that added them.
+
+    Registers are sorted by fwmin once, keeping their original order within
+    the same fwmin, so the registers available on a firmware version are
+    always a prefix of the sorted list, found with bisect. The prefix of each
+    version is made once and returned by every later call to at, so the
+    lists returned should not be modified.
+    """
+
+    def __init__(self, registers):
+        """Sort the registers.
+
+        @param registers: One device's list from get_device_modbus_maps.
+            (original, register) pairs from inc_orig=True are accepted too.
+        @type registers: list
+        """
+        def get_fwmin(register):
+            if isinstance(register, tuple):
+                register = register[1]
+            return register["fwmin"]
+
+        self.registers = sorted(registers, key=get_fwmin)
+        self.fwmins = [get_fwmin(x) for x in self.registers]
+        self.versions = sorted(set(self.fwmins))
+        self._prefixes = {}
+
+    def __len__(self):
+        return len(self.registers)
+
+    def count(self, firmware):
+        """Get the number of registers available on a firmware version."""
+        return bisect.bisect_right(self.fwmins, firmware)
+
+    def at(self, firmware):
+        """Get the registers available on a firmware version.
+
+        @param firmware: The firmware version, for example 1.0225.
+        @type firmware: float
+        @return: The registers with fwmin <= firmware, ordered by fwmin.
+        @rtype: list
+        """
+        count = self.count(firmware)
+        prefix = self._prefixes.get(count)
+        if prefix is None:
+            prefix = self._prefixes[count] = self.registers[:count]
+        return prefix
+
+    def added_between(self, old_firmware, new_firmware):
+        """Get the registers gained by updating from one version to another.
+
+        @param old_firmware: The firmware version updated from.
+        @type old_firmware: float
+        @param new_firmware: The firmware version updated to.
+        @type new_firmware: float
+        @return: The registers with old_firmware < fwmin <= new_firmware.
+        @rtype: list
+        """
+        return self.registers[self.count(old_firmware):self.count(new_firmware)]
+
+
+def _get_firmware_maps(document, expand_names, inc_orig, expand_alt_names,
+    record_type, render_descriptions):
+    """Get the device maps of a document and a FirmwareView of each.
+
+    Both are built once per document and set of flags, and then shared.
+    """
+    def build():
+        device_maps = get_device_modbus_maps(src=document,
+            expand_names=expand_names, inc_orig=inc_orig,
+            expand_alt_names=expand_alt_names, record_type=record_type,
+            render_descriptions=render_descriptions)
+        views = dict((device, FirmwareView(registers))
+            for (device, registers) in device_maps.items())
+        return (device_maps, views)
+
+    return document._view(("firmware_maps", expand_names, inc_orig,
+        expand_alt_names, record_type, render_descriptions), build)
+
+
+def get_firmware_views(src=DEFAULT_FILE_NAME, expand_names=False,
+    expand_alt_names=False, record_type=dict, render_descriptions=True):
+    """Get a FirmwareView for each device in a constants file.
+
+    See get_device_modbus_maps for the keyword arguments. The views are
+    built once per ConstantsDocument and set of keyword arguments, so pass
+    the same document to get the same views back. Their registers are
+    shared and should not be modified.
+
+    @return: FirmwareView by device name.
+    @rtype: dict
+    """
+    document = get_constants_document(src)
+    return dict(_get_firmware_maps(document, expand_names, False,
+        expand_alt_names, record_type, render_descriptions)[1])
+
+
+class ReadPlan(object):
+    """Coalesce reads of named registers into few contiguous Modbus reads.
+
+    Works like LJM_ALLOWS_AUTO_CONDENSE_ADDRESSES. The address spans of the
+    requested registers are sorted and merged into frames, each of which is
+    a single read of consecutive registers. Spans are merged when the
+    number of unrequested registers between them is at most max_gap and
+    the merged frame is at most max_frame_registers long.
+
+    A gap above zero trades request count for reading registers nobody
+    asked for, which a device may refuse if an address in the gap is not
+    readable, so max_gap defaults to 0.
+
+    @ivar frames: (address, count) of each read, ordered by address.
+    @ivar fields: (name, type, offset, size) of each requested name, in
+        request order. offset is the index of the first word of the
+        register in the responses of all frames concatenated, size its
+        number of words.
+    """
+
+    def __init__(self, names, resolver, max_gap=0,
+        max_frame_registers=MODBUS_MAX_READ_REGISTERS):
+        """Plan the reads.
+
+        @param names: The register names to read. Names may repeat.
+        @type names: iterable of str
+        @param resolver: Resolver for the device the names are read from.
+        @type resolver: NameResolver
+        @keyword max_gap: The number of unrequested registers allowed
+            between two spans for them to share a frame.
+        @type max_gap: int
+        @keyword max_frame_registers: The most registers a frame may read.
+        @type max_frame_registers: int
+        @raise KeyError: Raised if a name is not a known register name.
+        @raise ValueError: Raised if a register does not fit in one frame.
+        """
+        requests = []
+        spans = {}
+        for name in names:
+            (address, datatype_str) = resolver.resolve(name)
+            size = get_datatype_span(datatype_str)
+            if size > max_frame_registers:
+                raise ValueError(
+                    "%s spans %d registers, more than max_frame_registers %d"
+                    % (name, size, max_frame_registers))
+            requests.append((name, datatype_str, address, size))
+            spans[address] = max(spans.get(address, 0), size)
+
+        frames = []
+        for address in sorted(spans):
+            end = address + spans[address]
+            if frames:
+                (frame_start, frame_end) = frames[-1]
+                if address <= frame_end + max_gap and \
+                    max(end, frame_end) - frame_start <= max_frame_registers:
+                    frames[-1] = (frame_start, max(end, frame_end))
+                    continue
+            frames.append((address, end))
+
+        frame_starts = [x[0] for x in frames]
+        frame_offsets = []
+        total = 0
+        for (start, end) in frames:
+            frame_offsets.append(total)
+            total += end - start
+
+        self.frames = [(start, end - start) for (start, end) in frames]
+        self.fields = []
+        for (name, datatype_str, address, size) in requests:
+            i = bisect.bisect_right(frame_starts, address) - 1
+            offset = frame_offsets[i] + address - frame_starts[i]
+            self.fields.append((name, datatype_str, offset, size))
+        self.num_registers = total
+
+    def __len__(self):
+        return len(self.frames)
+
+    def demux(self, words):
+        """Split the words read by the frames back into registers.
+
+        @param words: The words returned by each frame, concatenated in
+            frame order.
+        @type words: sequence of int
+        @return: The words of each requested name.
+        @rtype: dict
+        @raise ValueError: Raised if words is not num_registers long.
+        """
+        if len(words) != self.num_registers:
+            raise ValueError("Expected %d words, got %d" %
+                (self.num_registers, len(words)))
+        return dict((name, words[offset:offset + size])
+            for (name, datatype_str, offset, size) in self.fields)
+
+
+def get_read_plan(names, src=DEFAULT_FILE_NAME, device=None, max_gap=0,
+    max_frame_registers=MODBUS_MAX_READ_REGISTERS):
+    """Create a ReadPlan for names on a device of a constants file.
+
+    See ReadPlan for the keyword arguments. Reuse a NameResolver with
+    ReadPlan directly when planning many reads for the same device.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @keyword device: The device the names are read from.
+    @type device: str
+    @return: The plan.
+    @rtype: ReadPlan
+    """
+    return ReadPlan(names, get_name_resolver(src, device=device),
+        max_gap=max_gap, max_frame_registers=max_frame_registers)
+
+
+class RegisterCodec(object):
+    """Decode and encode the words of a ReadPlan with NumPy.
+
+    The plan is compiled into a single structured dtype with one field per
+    requested register at its byte offset in the concatenated responses,
+    typed by DATATYPE_NUMPY_DTYPES. Decoding is then numpy.frombuffer over
+    the raw big-endian response bytes: no copy and no per-value unpacking,
+    and a buffer holding many polls of the same plan back to back decodes
+    to one record per poll.
+
+    Requires numpy.
+    """
+
+    def __init__(self, plan):
+        """Compile the plan.
+
+        @param plan: The plan the buffers to decode were read with.
+        @type plan: ReadPlan
+        @raise ImportError: Raised if numpy is not installed.
+        """
+        if numpy is None:
+            raise ImportError("RegisterCodec requires numpy")
+
+        names = []
+        formats = []
+        offsets = []
+        seen = set()
+        for (name, datatype_str, offset, size) in plan.fields:
+            if name in seen:
+                continue
+            seen.add(name)
+            names.append(name)
+            formats.append(DATATYPE_NUMPY_DTYPES[datatype_str])
+            offsets.append(offset * 2)
+
+        self.names = names
+        self.frame_size = plan.num_registers * 2
+        self.dtype = numpy.dtype({"names": names, "formats": formats,
+            "offsets": offsets, "itemsize": self.frame_size})
+
+    def decode_records(self, buffer):
+        """Decode one or more polls without copying.
+
+        @param buffer: The responses of every frame of the plan
+            concatenated, repeated once per poll.
+        @type buffer: bytes, bytearray or memoryview
+        @return: One record per poll, with a field per register name.
+        @rtype: numpy.ndarray
+        @raise ValueError: Raised if buffer is not a whole number of polls.
+        """
+        if len(buffer) % self.frame_size:
+            raise ValueError("Buffer of %d bytes is not a multiple of %d" %
+                (len(buffer), self.frame_size))
+        return numpy.frombuffer(buffer, dtype=self.dtype)
+
+    def decode_columns(self, buffer):
+        """Decode one or more polls into an array per register name.
+
+        @param buffer: See decode_records.
+        @type buffer: bytes, bytearray or memoryview
+        @return: The values of each register name, one per poll, as native
+            byte order arrays.
+        @rtype: dict
+        """
+        records = self.decode_records(buffer)
+        return dict((name, records[name].astype(
+            records.dtype.fields[name][0].newbyteorder("="))) for name in
+            self.names)
+
+    def decode(self, buffer):
+        """Decode a single poll into Python values.
+
+        @param buffer: The responses of every frame of the plan
+            concatenated.
+        @type buffer: bytes, bytearray or memoryview
+        @return: The value of each register name. STRING values are bytes
+            without trailing null bytes.
+        @rtype: dict
+        @raise ValueError: Raised if buffer is not exactly one poll long.
+        """
+        if len(buffer) != self.frame_size:
+            raise ValueError("Expected %d bytes, got %d" %
+                (self.frame_size, len(buffer)))
+        return dict(zip(self.names, self.decode_records(buffer)[0].item()))
+
+    def encode(self, values):
+        """Encode values into the words to write for the plan.
+
+        Every register of the plan must be given a value. Registers in the
+        gaps of the plan are encoded as zero, so write with plans made with
+        max_gap=0.
+
+        @param values: The value of each register name.
+        @type values: dict
+        @return: The words of every frame concatenated, big-endian.
+        @rtype: bytes
+        @raise KeyError: Raised if a register of the plan has no value.
+        """
+        record = numpy.zeros(1, dtype=self.dtype)
+        for name in self.names:
+            record[name] = values[name]
+        return record.tobytes()
+
+
+class ScanList(object):
+    """A stream scan list, checked against a device's register map.
+
+    Stream data is a 16-bit word per channel per scan. For a 32-bit channel
+    the device returns the lower 16 bits and keeps the upper 16 bits for
+    STREAM_DATA_CAPTURE_16, so a STREAM_DATA_CAPTURE_16 channel is added
+    after each UINT32 or INT32 channel not already followed by one, and the
+    two words are recombined when demultiplexing. Other channels, including
+    FLOAT32 analog inputs, are streamed as their raw 16-bit value.
+
+    @ivar channels: (name, address, type) of each channel of the scan, in
+        scan order, including STREAM_DATA_CAPTURE_16 channels.
+    @ivar addresses: The address of each channel, for LJM_eStreamStart.
+    @ivar columns: (name, type, index, capture_index) of each requested
+        name. index is the channel of the name in a scan, capture_index
+        the channel of its upper 16 bits or None for 16-bit channels.
+    """
+
+    def __init__(self, names, registers):
+        """Build the scan list.
+
+        @param names: The registers to stream, in scan order.
+        @type names: list of str
+        @param registers: The expanded registers of the device, for example
+            one list from get_device_modbus_maps(expand_names=True,
+            expand_alt_names=True).
+        @type registers: iterable of dict
+        @raise KeyError: Raised if a name is not a register of the device.
+        @raise ValueError: Raised if a register can not be streamed or read.
+        """
+        registers_by_name = {}
+        for register in registers:
+            registers_by_name.setdefault(register["name"], register)
+
+        def get_channel(name):
+            register = registers_by_name[name]
+            if not register["streamable"]:
+                raise ValueError("%s is not streamable" % name)
+            if not register["read"]:
+                raise ValueError("%s is not readable" % name)
+            return (name, register["address"], register["type"])
+
+        self.channels = []
+        self.columns = []
+        i = 0
+        while i < len(names):
+            channel = get_channel(names[i])
+            index = len(self.channels)
+            self.channels.append(channel)
+            capture_index = None
+            if channel[2] in STREAM_32_BIT_DATATYPES:
+                capture_index = index + 1
+                self.channels.append(get_channel(STREAM_DATA_CAPTURE_16))
+                if names[i + 1:i + 2] == [STREAM_DATA_CAPTURE_16]:
+                    i += 1
+            self.columns.append((channel[0], channel[2], index, capture_index))
+            i += 1
+
+        self.addresses = [x[1] for x in self.channels]
+
+    def __len__(self):
+        return len(self.channels)
+
+    def reshape(self, buffer, byteorder=">"):
+        """View interleaved stream data as one row per scan, without copying.
+
+        @param buffer: Stream data, a whole number of scans long.
+        @type buffer: bytes, bytearray, memoryview or numpy.ndarray
+        @keyword byteorder: Byte order of the words in buffer, ">" or "<".
+            Ignored if buffer is already an array of uint16.
+        @type byteorder: str
+        @return: A (scans x channels) array of uint16.
+        @rtype: numpy.ndarray
+        @raise ImportError: Raised if numpy is not installed.
+        @raise ValueError: Raised if buffer is not a whole number of scans.
+        """
+        if numpy is None:
+            raise ImportError("ScanList.reshape requires numpy")
+        if isinstance(buffer, numpy.ndarray):
+            words = buffer.reshape(-1)
+        else:
+            words = numpy.frombuffer(buffer, dtype=byteorder + "u2")
+        if len(words) % len(self.channels):
+            raise ValueError("%d words is not a multiple of %d channels" %
+                (len(words), len(self.channels)))
+        return words.reshape(-1, len(self.channels))
+
+    def demux(self, buffer, byteorder=">"):
+        """Split interleaved stream data into the values of each name.
+
+        16-bit channels are returned as views into buffer. 32-bit channels
+        are recombined with their STREAM_DATA_CAPTURE_16 channel into new
+        uint32 or int32 arrays.
+
+        @param buffer: See reshape.
+        @keyword byteorder: See reshape.
+        @return: One array per requested name, one value per scan.
+        @rtype: dict
+        """
+        scans = self.reshape(buffer, byteorder=byteorder)
+        values = {}
+        for (name, datatype_str, index, capture_index) in self.columns:
+            if capture_index is None:
+                values[name] = scans[:, index]
+            else:
+                combined = scans[:, capture_index].astype(numpy.uint32) << 16
+                combined |= scans[:, index]
+                values[name] = combined.view(
+                    STREAM_32_BIT_DATATYPES[datatype_str])
+        return values
+
+
+def get_scan_list(names, src=DEFAULT_FILE_NAME, device="T7"):
+    """Create a ScanList for names on a device of a constants file.
+
+    @param names: The registers to stream, in scan order.
+    @type names: list of str
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @keyword device: The device to stream from. Defaults to T7.
+    @type device: str
+    @return: The scan list.
+    @rtype: ScanList
+    """
+    return ScanList(names, iter_device_registers(device, src=src,
+        expand_names=True, expand_alt_names=True, render_descriptions=False))
+
+
+def get_register_columns(registers):
+    """Convert registers into columns of a table, one row per register.
+
+    The columns are those of REGISTER_TABLE_DTYPE. size is the
+    get_datatype_span of the register type, type the DATATYPE_TYPE_INDEX
+    of it as an int or -1 for types without one. name is an index into a
+    table of the distinct register names.
+
+    @param registers: Registers of a single device, for example one list
+        from get_device_modbus_maps(expand_names=True).
+    @type registers: iterable of dict
+    @return: Lists of values by column name, and the name table.
+    @rtype: tuple of (dict, list of str)
+    """
+    columns = dict((name, []) for (name, dtype) in REGISTER_TABLE_DTYPE)
+    strings = []
+    string_indexes = {}
+    type_codes = {}
+    for register in registers:
+        datatype_str = register["type"]
+        type_code = type_codes.get(datatype_str)
+        if type_code is None:
+            type_code = DATATYPE_TYPE_INDEX.get(datatype_str, "N/A")
+            type_code = int(type_code) if type_code.isdigit() else -1
+            type_codes[datatype_str] = type_code
+        name = register["name"]
+        name_index = string_indexes.get(name)
+        if name_index is None:
+            name_index = string_indexes[name] = len(strings)
+            strings.append(name)
+
+        columns["address"].append(register["address"])
+        columns["size"].append(get_datatype_span(datatype_str))
+        columns["type"].append(type_code)
+        columns["read"].append(register["read"])
+        columns["write"].append(register["write"])
+        columns["streamable"].append(register["streamable"])
+        columns["fwmin"].append(register["fwmin"])
+        columns["name"].append(name_index)
+    return (columns, strings)
+
+
+def get_register_array(registers):
+    """Same as get_register_columns, as a NumPy structured array.
+
+    @param registers: See get_register_columns.
+    @type registers: iterable of dict
+    @return: Array with the fields of REGISTER_TABLE_DTYPE, and the name
+        table.
+    @rtype: tuple of (numpy.ndarray, list of str)
+    @raise ImportError: Raised if numpy is not installed.
+    """
+    if numpy is None:
+        raise ImportError("get_register_array requires numpy")
+    (columns, strings) = get_register_columns(registers)
+    table = numpy.empty(len(columns["address"]), dtype=REGISTER_TABLE_DTYPE)
+    for (name, dtype) in REGISTER_TABLE_DTYPE:
+        table[name] = columns[name]
+    return (table, strings)
+
+
+def get_device_register_arrays(src=DEFAULT_FILE_NAME, expand_names=True,
+    expand_alt_names=False):
+    """Create a get_register_array table for each device.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @keyword expand_names: If true, one row per expanded name. Defaults to
+        True.
+    @type expand_names: bool
+    @keyword expand_alt_names: If true, altnames get their own rows.
+    @type expand_alt_names: bool
+    @return: (table, name table) by device name.
+    @rtype: dict
+    """
+    device_maps = get_device_modbus_maps(src=src, expand_names=expand_names,
+        expand_alt_names=expand_alt_names, record_type=DeviceRegisterView,
+        render_descriptions=False)
+    return dict((device, get_register_array(registers))
+        for (device, registers) in device_maps.items())
+
+
+class ErrorIndex(object):
+    """Constant time lookups of the error codes of a constants file.
+
+    Codes below ERROR_INDEX_DENSE_SIZE are stored in a list indexed by code
+    and the rest in a dict. When a code appears more than once, the first
+    entry wins and the code is listed in duplicates.
+
+    Codes are classified into the ranges delimited by the LJME_*_BEGIN and
+    LJME_*_END marker errors, like LJME_WARNINGS_BEGIN, plus the ranges of
+    ERROR_CODE_RANGES. Range starts are kept sorted and searched with
+    bisect.
+
+    @ivar errors: The error entries, as returned by get_errors.
+    @ivar duplicates: Codes found more than once, in order of appearance.
+    @ivar ranges: (name, first, last) of each range, ordered by first.
+    """
+
+    def __init__(self, errors):
+        """Build the index.
+
+        @param errors: Error entries, as returned by get_errors.
+        @type errors: list of dict
+        """
+        self.errors = errors
+        self.duplicates = []
+        self._dense = [None] * ERROR_INDEX_DENSE_SIZE
+        self._sparse = {}
+        self._codes_by_name = {}
+        markers = {}
+        for entry in errors:
+            code = entry["error"]
+            name = entry["string"]
+            self._codes_by_name.setdefault(name, code)
+
+            if code in self:
+                if not code in self.duplicates:
+                    self.duplicates.append(code)
+            elif 0 <= code < ERROR_INDEX_DENSE_SIZE:
+                self._dense[code] = entry
+            else:
+                self._sparse[code] = entry
+
+            match = FIND_ERROR_RANGE_MARKER.match(name)
+            if match:
+                markers.setdefault(match.group(1), {})[match.group(2)] = code
+
+        ranges = list(ERROR_CODE_RANGES)
+        for (range_name, bounds) in markers.items():
+            if "BEGIN" in bounds and "END" in bounds:
+                ranges.append((range_name, bounds["BEGIN"], bounds["END"]))
+        self.ranges = sorted(ranges, key=lambda x: x[1])
+        self._range_firsts = [x[1] for x in self.ranges]
+
+    def __len__(self):
+        return len(self.errors) - len(self.duplicates)
+
+    def get(self, code, default=None):
+        """Get the error entry of a code, or default if there is none."""
+        if 0 <= code < ERROR_INDEX_DENSE_SIZE:
+            entry = self._dense[code]
+            return default if entry is None else entry
+        return self._sparse.get(code, default)
+
+    def __getitem__(self, code):
+        entry = self.get(code)
+        if entry is None:
+            raise KeyError(code)
+        return entry
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def get_name(self, code):
+        """Get the name of an error code, like LJM_ErrorToString.
+
+        @param code: The error code.
+        @type code: int
+        @return: The name of the code, for example LJME_INVALID_HANDLE.
+        @rtype: str
+        @raise KeyError: Raised if code is not a known error code.
+        """
+        return self[code]["string"]
+
+    def get_code(self, name):
+        """Get the error code of a name.
+
+        @param name: The error name, for example LJME_INVALID_HANDLE.
+        @type name: str
+        @return: The error code.
+        @rtype: int
+        @raise KeyError: Raised if name is not a known error name.
+        """
+        return self._codes_by_name[name]
+
+    def classify(self, code):
+        """Get the name of the range containing an error code.
+
+        @param code: The error code, which need not be a known one.
+        @type code: int
+        @return: The range name, for example WARNINGS, LIBRARY_ERRORS or
+            DEVICE_ERRORS, or RESERVED if no range contains code.
+        @rtype: str
+        """
+        i = bisect.bisect_right(self._range_firsts, code) - 1
+        if i >= 0 and code <= self.ranges[i][2]:
+            return self.ranges[i][0]
+        return "RESERVED"
+
+
+def get_error_index(src=DEFAULT_FILE_NAME):
+    """Create an ErrorIndex for a constants file.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @return: Index of the errors in src.
+    @rtype: ErrorIndex
+    """
+    return ErrorIndex(get_errors(src))
+
+
+def compile_constants(src=DEFAULT_FILE_NAME):
+    """Compile a constants file into the format read by CompiledConstants.
+
+    Every expanded name and altname of every register gets a fixed-width
+    record. Descriptions are stored without anchors and, like all strings,
+    only once in the string table. Names are hashed with CRC-32 into an
+    open addressing table of twice as many slots as records.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @return: The compiled file contents.
+    @rtype: bytes
+    """
+    document = get_constants_document(src)
+    strings = bytearray()
+    string_refs = {}
+
+    def add_string(value):
+        ref = string_refs.get(value)
+        if ref is None:
+            encoded = value.encode("utf-8")
+            ref = string_refs[value] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return ref
+
+    devices = get_device_names(document)
+    device_indexes = dict((x, i) for (i, x) in enumerate(devices))
+    register_struct = struct.Struct(COMPILED_REGISTER.format +
+        "d" * len(devices))
+
+    records = []
+    names = []
+    for register in iter_registers(src=document, expand_names=True,
+        expand_alt_names=True, render_descriptions=False):
+        fwmins = [float("nan")] * len(devices)
+        for device in register["devices"]:
+            fwmins[device_indexes[device["device"]]] = device.get("fwmin", 0)
+        flags = 0
+        for (i, flag) in enumerate(COMPILED_FLAGS):
+            if register["readwrite"].get(flag, register.get(flag)):
+                flags |= 1 << i
+        name_ref = add_string(register["name"])
+        records.append(register_struct.pack(*(name_ref +
+            add_string(register["description"]) + (register["address"],
+            COMPILED_DATATYPES.index(register["type"]), flags) +
+            tuple(fwmins))))
+        names.append(register["name"].encode("utf-8"))
+
+    hash_size = 1
+    while hash_size < 2 * len(records):
+        hash_size *= 2
+    slots = [0] * hash_size
+    for (i, name) in enumerate(names):
+        slot = zlib.crc32(name) & (hash_size - 1)
+        while slots[slot]:
+            if names[slots[slot] - 1] == name:
+                break
+            slot = (slot + 1) & (hash_size - 1)
+        else:
+            slots[slot] = i + 1
+
+    by_address = sorted(range(len(records)),
+        key=lambda i: struct.unpack_from("<I", records[i], 16)[0])
+    addresses = [struct.unpack_from("<I", records[i], 16)[0]
+        for i in by_address]
+
+    errors = {}
+    for error in document.errors:
+        errors.setdefault(error["error"], error)
+    error_codes = sorted(errors)
+    error_records = [COMPILED_ERROR.pack(*(
+        add_string(errors[x]["string"]) +
+        add_string(errors[x].get("description", ""))))
+        for x in error_codes]
+
+    device_refs = b"".join(COMPILED_STRING_REF.pack(*add_string(x))
+        for x in devices)
+    try:
+        version_ref = add_string(document.header["version"])
+    except KeyError:
+        version_ref = add_string("")
+
+    sections = [
+        device_refs,
+        b"".join(records),
+        struct.pack("<%dI" % hash_size, *slots),
+        struct.pack("<%dI" % len(addresses), *addresses),
+        struct.pack("<%dI" % len(by_address), *by_address),
+        struct.pack("<%di" % len(error_codes), *error_codes),
+        b"".join(error_records),
+        bytes(strings),
+    ]
+    offsets = []
+    position = COMPILED_HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    header = COMPILED_HEADER.pack(
+        COMPILED_CONSTANTS_MAGIC, COMPILED_CONSTANTS_FORMAT_VERSION,
+        register_struct.size, len(devices), offsets[0], version_ref[0],
+        version_ref[1], len(records), offsets[1], hash_size, offsets[2],
+        offsets[3], offsets[4], len(error_codes), offsets[5], offsets[6],
+        offsets[7])
+    return header + b"".join(sections)
+
+
+def write_compiled_constants(path, src=DEFAULT_FILE_NAME):
+    """Compile a constants file and write it to path atomically.
+
+    The file is written to a temporary file and renamed into place, so
+    processes that have the old file mapped keep reading it unchanged. It
+    is made readable by everyone (0644) rather than keeping the owner-only
+    permissions of the temporary file, so other users can map it.
+
+    @param path: The file to write.
+    @type path: str
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    """
+    contents = compile_constants(src)
+    (fd, tmp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), COMPILED_CONSTANTS_MODE)
+            f.write(contents)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class CompiledConstants(object):
+    """Read a file written by compile_constants through mmap.
+
+    Nothing is decoded up front: lookups hash or bisect directly over the
+    mapped file, so opening is constant time and every process mapping the
+    same file shares one copy of it in the page cache. from_buffer reads
+    the same format from any buffer, like shared memory.
+
+    Requires a little-endian host, on which the integer arrays of the file
+    are read in place through memoryview.
+
+    @ivar version: The header version of the constants file, or "" if it
+        had no header.
+    @ivar devices: The device names of the constants file.
+    """
+
+    def __init__(self, path):
+        """Map the file.
+
+        @param path: A file written by compile_constants.
+        @type path: str
+        @raise ValueError: Raised if path is not a compiled constants file
+            of a supported format version.
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load(mapped, path)
+        except BaseException:
+            mapped.close()
+            raise
+        self._close = mapped.close
+
+    @classmethod
+    def from_buffer(cls, buffer, close=None):
+        """Read compiled constants from a buffer, without copying it.
+
+        @param buffer: The output of compile_constants, possibly followed
+            by unused bytes.
+        @type buffer: bytes, bytearray, memoryview or mmap
+        @keyword close: Called by close after the buffer is released, or
+            before raising if buffer can not be read.
+        @type close: callable
+        @return: Reader over buffer.
+        @rtype: CompiledConstants
+        @raise ValueError: Raised if buffer does not hold compiled
+            constants of a supported format version.
+        """
+        constants = cls.__new__(cls)
+        view = memoryview(buffer).toreadonly()
+        try:
+            constants._load(view, "buffer")
+        except BaseException:
+            view.release()
+            if close is not None:
+                close()
+            raise
+        constants._views.insert(0, view)
+        constants._close = close
+        return constants
+
+    def _load(self, buffer, source):
+        """Read the header and index arrays of buffer.
+
+        Raises without closing anything, but releases the views it made, so
+        the caller can close buffer.
+        """
+        if sys.byteorder != "little":
+            raise ValueError("CompiledConstants requires a little-endian host")
+        self._buffer = buffer
+        self._views = []
+        try:
+            (magic, format_version, record_size, num_devices, devices_offset,
+                version_offset, version_length, num_registers,
+                self._records_offset, hash_size, hash_offset,
+                addresses_offset, address_records_offset, num_errors,
+                error_codes_offset, self._errors_offset,
+                self._strings_offset) = COMPILED_HEADER.unpack_from(buffer)
+            if magic != COMPILED_CONSTANTS_MAGIC or \
+                format_version != COMPILED_CONSTANTS_FORMAT_VERSION:
+                raise ValueError("%s is not a compiled constants file of "
+                    "format version %d" % (source,
+                    COMPILED_CONSTANTS_FORMAT_VERSION))
+
+            self._register_struct = struct.Struct(COMPILED_REGISTER.format +
+                "d" * num_devices)
+            self._record_size = record_size
+            self._num_registers = num_registers
+            self.version = self._get_string(version_offset, version_length)
+            self.devices = [self._get_string(*COMPILED_STRING_REF.unpack_from(
+                buffer, devices_offset + i * COMPILED_STRING_REF.size))
+                for i in range(num_devices)]
+
+            view = memoryview(buffer)
+            self._views.append(view)
+            self._slots = self._cast(view, hash_offset, hash_size, "I")
+            self._addresses = self._cast(view, addresses_offset,
+                num_registers, "I")
+            self._address_records = self._cast(view, address_records_offset,
+                num_registers, "I")
+            self._error_codes = self._cast(view, error_codes_offset,
+                num_errors, "i")
+        except BaseException as e:
+            for view in reversed(self._views):
+                view.release()
+            self._views = []
+            if isinstance(e, (struct.error, TypeError)):
+                raise ValueError("%s is not a compiled constants file" %
+                    source)
+            raise
+
+    def _cast(self, view, offset, count, code):
+        cast = view[offset:offset + count * 4].cast(code)
+        self._views.append(cast)
+        return cast
+
+    def close(self):
+        """Release the file or buffer. Lookups fail afterwards."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._num_registers
+
+    def _get_string(self, offset, length):
+        start = self._strings_offset + offset
+        return str(self._buffer[start:start + length], "utf-8")
+
+    def _unpack_record(self, index):
+        return self._register_struct.unpack_from(self._buffer,
+            self._records_offset + index * self._record_size)
+
+    def _find(self, name):
+        encoded = name.encode("utf-8")
+        slots = self._slots
+        mask = len(slots) - 1
+        slot = zlib.crc32(encoded) & mask
+        while slots[slot]:
+            index = slots[slot] - 1
+            (name_offset, name_length) = COMPILED_STRING_REF.unpack_from(
+                self._buffer, self._records_offset + index * self._record_size)
+            start = self._strings_offset + name_offset
+            if name_length == len(encoded) and \
+                self._buffer[start:start + name_length] == encoded:
+                return index
+            slot = (slot + 1) & mask
+        raise KeyError(name)
+
+    def _make_register(self, record):
+        fields = dict(zip(COMPILED_FLAGS,
+            [bool(record[6] >> i & 1) for i in range(len(COMPILED_FLAGS))]))
+        fields.update({
+            "name": self._get_string(record[0], record[1]),
+            "description": self._get_string(record[2], record[3]),
+            "address": record[4],
+            "type": COMPILED_DATATYPES[record[5]],
+            "devices": [{"device": device, "fwmin": fwmin} for
+                (device, fwmin) in zip(self.devices, record[7:])
+                if fwmin == fwmin],
+        })
+        return fields
+
+    def resolve(self, name):
+        """Get the address and data type of a register name.
+
+        @param name: The register name, for example AIN137.
+        @type name: str
+        @return: The address and data type name, for example (274, "FLOAT32").
+        @rtype: tuple
+        @raise KeyError: Raised if name is not a known register name.
+        """
+        record = self._unpack_record(self._find(name))
+        return (record[4], COMPILED_DATATYPES[record[5]])
+
+    def __contains__(self, name):
+        try:
+            self._find(name)
+        except KeyError:
+            return False
+        return True
+
+    def get_register(self, name):
+        """Get everything stored about a register name.
+
+        @param name: The register name, for example AIN137.
+        @type name: str
+        @return: The name, description, address, type, devices (dicts of
+            device and fwmin) and COMPILED_FLAGS of the register.
+        @rtype: dict
+        @raise KeyError: Raised if name is not a known register name.
+        """
+        return self._make_register(self._unpack_record(self._find(name)))
+
+    def get_names_at(self, address):
+        """Get the names of the registers starting at an address.
+
+        @param address: The register address.
+        @type address: int
+        @return: The names, in constants file order.
+        @rtype: list of str
+        """
+        start = bisect.bisect_left(self._addresses, address)
+        end = bisect.bisect_right(self._addresses, address, start)
+        return [self._get_string(*self._unpack_record(
+            self._address_records[i])[:2]) for i in range(start, end)]
+
+    def get_error(self, code):
+        """Get an error entry by code.
+
+        @param code: The error code.
+        @type code: int
+        @return: The error in the form of get_errors entries.
+        @rtype: dict
+        @raise KeyError: Raised if code is not a known error code.
+        """
+        i = bisect.bisect_left(self._error_codes, code)
+        if i == len(self._error_codes) or self._error_codes[i] != code:
+            raise KeyError(code)
+        (name_offset, name_length, description_offset,
+            description_length) = COMPILED_ERROR.unpack_from(self._buffer,
+            self._errors_offset + i * COMPILED_ERROR.size)
+        return {
+            "error": code,
+            "string": self._get_string(name_offset, name_length),
+            "description": self._get_string(description_offset,
+                description_length),
+        }
+
+    def iter_device_registers(self, device, firmware=None):
+        """Iterate over the registers of one device, in address order.
+
+        @param device: The device name, for example "T7".
+        @type device: str
+        @keyword firmware: Only yield registers with a fwmin of at most this
+            firmware version. Defaults to all registers of the device.
+        @type firmware: float
+        @return: Registers in the form of get_register.
+        @rtype: iterator over dict
+        @raise KeyError: Raised if device is not a known device name.
+        """
+        if not device in self.devices:
+            raise KeyError(device)
+        field = 7 + self.devices.index(device)
+        for i in range(self._num_registers):
+            record = self._unpack_record(self._address_records[i])
+            fwmin = record[field]
+            if fwmin == fwmin and (firmware is None or fwmin <= firmware):
+                yield self._make_register(record)
+
+
+def publish_constants(src=DEFAULT_FILE_NAME, name=None):
+    """Compile a constants file into a new shared memory block.
+
+    Meant for worker pools: the parent parses the constants file once and
+    workers read it with attach_constants, without parsing or copying it.
+    The parent owns the block and has to unlink it when the workers are
+    done with it.
+
+    @keyword src: The name of the file to open or a ConstantsDocument.
+        Defaults to DEFAULT_FILE_NAME.
+    @type src: str or ConstantsDocument
+    @keyword name: The name of the block. Defaults to a unique name.
+    @type name: str
+    @return: The block, whose name is passed to attach_constants.
+    @rtype: multiprocessing.shared_memory.SharedMemory
+    @raise ImportError: Raised if multiprocessing.shared_memory is not
+        available.
+    """
+    if shared_memory is None:
+        raise ImportError("publish_constants requires Python 3.8 or later")
+    contents = compile_constants(src)
+    block = shared_memory.SharedMemory(name=name, create=True,
+        size=len(contents))
+    block.buf[:len(contents)] = contents
+    return block
+
+
+def attach_constants(name):
+    """Read a block published by publish_constants, read-only and in place.
+
+    Closing the returned reader detaches from the block without unlinking
+    it. Before Python 3.13 attaching registers the block with the resource
+    tracker of the attaching process, which unlinks it when that process
+    exits; workers started by the publishing process share its tracker, but
+    unrelated processes should attach with Python 3.13 or later.
+
+    @param name: The name of the block.
+    @type name: str
+    @return: Reader over the block.
+    @rtype: CompiledConstants
+    @raise ImportError: Raised if multiprocessing.shared_memory is not
+        available.
+    @raise ValueError: Raised if the block does not hold compiled
+        constants of a supported format version.
+    """
+    if shared_memory is None:
+        raise ImportError("attach_constants requires Python 3.8 or later")
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+    return CompiledConstants.from_buffer(block.buf, close=block.close)
+
+
+class PhaseProfile(object):
+    """Timings of the phases of loading a constants file.
+
+    Filled in by profile_phases. For each phase, the report has:
+    {
+        "calls": int,
+        "seconds": float, wall time including nested phases,
+        "self_seconds": float, wall time excluding nested phases,
+        "allocated_bytes": int, net bytes allocated including nested
+            phases, or None if memory was not traced
+    }
+    make_device_register_entry is additionally reported per device, as
+    device_assembly:<device>. Generators like iter_register_data count one
+    call each and are timed while producing values. A call made while its
+    phase is already being measured, such as interpret_ljmmm_field calling
+    compile_ljmmm_field, is part of the outer call and is not counted again.
+
+    Only calls made from the thread that started the profile are measured.
+    Allocated bytes are process wide, so they include allocations by other
+    threads.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self._stack = []
+        self._running = set()
+        self._thread_id = None
+
+    def _get_stats(self, phase):
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = {
+                "calls": 0,
+                "seconds": 0.0,
+                "self_seconds": 0.0,
+                "allocated_bytes": 0 if self.trace_memory else None,
+            }
+        return stats
+
+    def _outermost(self, phases):
+        return tuple(x for x in phases if not x in self._running)
+
+    def _enter(self, phases):
+        for phase in phases:
+            self._get_stats(phase)["calls"] += 1
+
+    def _start(self, phases):
+        self._running.update(phases)
+        memory = tracemalloc.get_traced_memory()[0] if self.trace_memory \
+            else 0
+        # [start time, time spent in nested phases, traced memory]
+        frame = [time.perf_counter(), 0.0, memory]
+        self._stack.append(frame)
+        return frame
+
+    def _stop(self, frame, phases):
+        elapsed = time.perf_counter() - frame[0]
+        self._stack.pop()
+        self._running.difference_update(phases)
+        if self._stack:
+            self._stack[-1][1] += elapsed
+        for phase in phases:
+            stats = self.phases[phase]
+            stats["seconds"] += elapsed
+            stats["self_seconds"] += elapsed - frame[1]
+            if self.trace_memory:
+                stats["allocated_bytes"] += \
+                    tracemalloc.get_traced_memory()[0] - frame[2]
+
+    def _wrap(self, phase, func):
+        profile = self
+
+        def get_phases(args):
+            if func.__name__ == "make_device_register_entry":
+                return (phase, "%s:%s" % (phase, args[1]["device"]))
+            return (phase,)
+
+        if func.__name__ == "iter_register_data":
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                phases = profile._outermost(get_phases(args))
+                if threading.get_ident() != profile._thread_id or \
+                    not phases:
+                    for value in func(*args, **kwargs):
+                        yield value
+                    return
+                profile._enter(phases)
+                frame = profile._start(phases)
+                try:
+                    iterator = func(*args, **kwargs)
+                finally:
+                    profile._stop(frame, phases)
+                while True:
+                    running = profile._outermost(phases)
+                    if not running:
+                        try:
+                            value = next(iterator)
+                        except StopIteration:
+                            return
+                        yield value
+                        continue
+                    frame = profile._start(running)
+                    try:
+                        value = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        profile._stop(frame, running)
+                    yield value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if threading.get_ident() != profile._thread_id:
+                    return func(*args, **kwargs)
+                phases = profile._outermost(get_phases(args))
+                if not phases:
+                    return func(*args, **kwargs)
+                profile._enter(phases)
+                frame = profile._start(phases)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    profile._stop(frame, phases)
+        return wrapper
+
+    def report(self):
+        """Get the phases, slowest first.
+
+        @return: The stats of each phase, with its name under "phase".
+        @rtype: list of dict
+        """
+        report = []
+        for (phase, stats) in self.phases.items():
+            entry = {"phase": phase}
+            entry.update(stats)
+            report.append(entry)
+        return sorted(report, key=lambda x: -x["self_seconds"])
+
+    def format(self):
+        """Get the report as a text table."""
+        lines = ["%-32s %8s %10s %10s %14s" % ("phase", "calls", "seconds",
+            "self", "bytes")]
+        for entry in self.report():
+            lines.append("%-32s %8d %10.4f %10.4f %14s" % (entry["phase"],
+                entry["calls"], entry["seconds"], entry["self_seconds"],
+                "-" if entry["allocated_bytes"] is None else
+                entry["allocated_bytes"]))
+        return "\n".join(lines)
+
+
+class profile_phases(object):
+    """Context manager reporting the phases of loading constants files.
+
+    While active, the module functions in PROFILED_PHASES are replaced by
+    timing wrappers, so nothing is measured, and nothing costs anything,
+    outside of it. Memory is traced with tracemalloc if trace_memory, which
+    slows loading down considerably.
+
+    The wrappers are module wide, so profiles can not be nested or run in
+    several threads at once. Calls from threads other than the one that
+    entered the profile go through the wrappers unmeasured.
+
+    Usage:
+        with ljmmm.profile_phases() as profile:
+            ljmmm.get_device_modbus_maps(expand_names=True)
+        print(profile.format())
+    """
+
+    _active = False
+    _lock = threading.Lock()
+
+    def __init__(self, trace_memory=False, callback=None):
+        """Set up the profile.
+
+        @keyword trace_memory: If true, also report allocated bytes.
+        @type trace_memory: bool
+        @keyword callback: Called with the PhaseProfile on exit.
+        @type callback: callable
+        """
+        self.profile = PhaseProfile(trace_memory=trace_memory)
+        self.callback = callback
+        self._originals = {}
+        self._started_tracing = False
+
+    def __enter__(self):
+        with profile_phases._lock:
+            if profile_phases._active:
+                raise RuntimeError("profile_phases is already active")
+            profile_phases._active = True
+        try:
+            module = sys.modules[__name__]
+            self.profile._thread_id = threading.get_ident()
+            if self.profile.trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            for (phase, name) in PROFILED_PHASES:
+                func = getattr(module, name)
+                self._originals[name] = func
+                setattr(module, name, self.profile._wrap(phase, func))
+        except BaseException:
+            self._restore()
+            raise
+        return self.profile
+
+    def _restore(self):
+        module = sys.modules[__name__]
+        for (name, func) in self._originals.items():
+            setattr(module, name, func)
+        self._originals = {}
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        profile_phases._active = False
+
+    def __exit__(self, *args):
+        self._restore()
+        if self.callback is not None:
+            self.callback(self.profile)
+
+
+def get_register_entry_digest(raw_register):
+    """Get a SHA-256 hex digest of the contents of a raw register entry.
+
+    Entries with the same keys and values have the same digest, whatever
+    the order of their keys.
+
+    @param raw_register: A raw register entry as found in a constants file.
+    @type raw_register: dict
+    @return: The digest.
+    @rtype: str
+    """
+    return hashlib.sha256(json.dumps(raw_register,
+        sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ConstantsSnapshot(object):
+    """The maps and indexes of one version of a constants file.
+
+    Snapshots are never modified once built, so a reader holding one sees a
+    consistent state for as long as it keeps it. Get a new one from
+    ConstantsWatcher.snapshot for each unit of work instead of keeping
+    references to its maps or indexes.
+
+    @ivar document: The ConstantsDocument the snapshot was built from.
+    @ivar digest: The SHA-256 hex digest of the constants file.
+    @ivar version: The header version of the constants file, or None if it
+        has no header.
+    @ivar device_maps: Registers by device name, like get_device_modbus_maps.
+    @ivar resolver: NameResolver of all registers.
+    @ivar address_indexes: AddressIndex of device_maps by device name.
+    @ivar error_index: ErrorIndex of the errors.
+    @ivar num_parsed: Number of raw register entries parsed to build the
+        snapshot, the others being reused from the previous snapshot.
+    """
+
+    def __init__(self, document, entries, num_parsed):
+        """Build the indexes.
+
+        @param document: The document the snapshot is built from.
+        @type document: ConstantsDocument
+        @param entries: For each raw register entry of the document, its
+            (device name, entry) pairs, entry being None for DIGIT
+            registers.
+        @type entries: list of list of tuple
+        @param num_parsed: See num_parsed.
+        @type num_parsed: int
+        """
+        self.document = document
+        self.digest = document.digest
+        self.version = document.contents.get("header", {}).get("version")
+        self.num_parsed = num_parsed
+
+        self.device_maps = {}
+        for register_entries in entries:
+            for (device_name, entry) in register_entries:
+                device_reg_list = self.device_maps.setdefault(device_name, [])
+                if entry is not None:
+                    device_reg_list.append(entry)
+        self.resolver = NameResolver(document.combined_registers)
+        self.address_indexes = dict((device, AddressIndex(registers))
+            for (device, registers) in self.device_maps.items())
+        self.error_index = ErrorIndex(document.errors)
+
+
+class ConstantsWatcher(object):
+    """Keep the maps and indexes of a constants file up to date as it changes.
+
+    A background thread checks the modification time, size and inode of the
+    file every interval seconds. When one of them changed and the contents
+    did too, a new ConstantsSnapshot is built and replaces the current one
+    in a single assignment, so readers never wait for a rebuild or see a
+    partly built snapshot.
+
+    Rebuilds are incremental: device entries are cached by the
+    get_register_entry_digest of the raw register entry they were parsed
+    from, and only entries that are new or changed are parsed again.
+    Unchanged entries are shared between snapshots, so they should be
+    treated as read-only.
+
+    If a rebuild fails, for example because the file was read while being
+    written, the current snapshot is kept, the exception is stored in
+    last_error and the rebuild is retried at the next check.
+
+    @ivar src: The constants file watched.
+    @ivar interval: Seconds between checks.
+    @ivar last_error: The exception of the last failed check or rebuild, by
+        the thread or by reload, or None if the last one succeeded.
+    @ivar callback_error: The exception raised by the callback for the
+        latest snapshot, or None if it returned normally. The snapshot is
+        published either way.
+    """
+
+    def __init__(self, src=DEFAULT_FILE_NAME, interval=DEFAULT_WATCH_INTERVAL,
+        expand_names=True, expand_alt_names=True, record_type=dict,
+        render_descriptions=True, callback=None):
+        """Build the first snapshot. Call start to start watching.
+
+        See get_device_modbus_maps for expand_names, expand_alt_names,
+        record_type and render_descriptions, which apply to every snapshot.
+
+        @keyword src: The name of the file to watch.
+        @type src: str
+        @keyword interval: Seconds between checks.
+        @type interval: float
+        @keyword callback: Called with each new snapshot after it replaced
+            the current one, from the thread that built it.
+        @type callback: callable
+        """
+        self.src = src
+        self.interval = interval
+        self.expand_names = expand_names
+        self.expand_alt_names = expand_alt_names
+        self.record_type = record_type
+        self.render_descriptions = render_descriptions
+        self.callback = callback
+        self.last_error = None
+        self.callback_error = None
+        self._entry_cache = {}
+        self._stat_key = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._snapshot = None
+        self.reload()
+
+    @property
+    def snapshot(self):
+        """The snapshot of the latest successfully built version of the file."""
+        return self._snapshot
+
+    def _get_stat_key(self):
+        stat = os.stat(self.src)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _parse_entry(self, orig, shared_tuples):
+        entries = []
+        for register in iter_register_data(orig, self.expand_names,
+            self.expand_alt_names, self.render_descriptions):
+            shared = None
+            for device in register["devices"]:
+                device_name = device["device"]
+                if device_name == "DIGIT":
+                    entries.append((device_name, None))
+                    continue
+                if shared is None:
+                    shared = make_shared_register(orig, register)
+                entries.append((device_name, make_device_register_entry(
+                    shared, device, self.record_type, shared_tuples)))
+        return entries
+
+    def reload(self, force=False):
+        """Rebuild the snapshot now if the file changed.
+
+        Sets last_error, and callback_error if the callback was called.
+        Exceptions raised by the callback are not propagated.
+
+        @keyword force: Check the contents even if the modification time,
+            size and inode of the file did not change.
+        @type force: bool
+        @return: True if a new snapshot replaced the current one.
+        @rtype: bool
+        @raise Exception: Anything raised reading or parsing the file, in
+            which case the current snapshot is kept.
+        """
+        try:
+            snapshot = self._rebuild(force)
+        except Exception as e:
+            self.last_error = e
+            raise
+        self.last_error = None
+        if snapshot is None:
+            return False
+
+        if self.callback is not None:
+            try:
+                self.callback(snapshot)
+                self.callback_error = None
+            except Exception as e:
+                self.callback_error = e
+        return True
+
+    def _rebuild(self, force):
+        """Build and publish a new snapshot if the file changed.
+
+        @return: The new snapshot, or None if the file did not change.
+        @rtype: ConstantsSnapshot
+        """
+        with self._lock:
+            # Stat before reading, so a write during the rebuild is caught
+            # by the next check
+            stat_key = self._get_stat_key()
+            if stat_key == self._stat_key and not force:
+                return None
+            document = ConstantsDocument(self.src)
+            if self._snapshot is not None and \
+                document.digest == self._snapshot.digest:
+                self._stat_key = stat_key
+                return None
+
+            entry_cache = {}
+            shared_tuples = {}
+            entries = []
+            num_parsed = 0
+            for orig in document.combined_registers:
+                digest = get_register_entry_digest(orig)
+                if digest in entry_cache:
+                    register_entries = entry_cache[digest]
+                elif digest in self._entry_cache:
+                    register_entries = self._entry_cache[digest]
+                else:
+                    register_entries = self._parse_entry(orig, shared_tuples)
+                    num_parsed += 1
+                entry_cache[digest] = register_entries
+                entries.append(register_entries)
+            snapshot = ConstantsSnapshot(document, entries, num_parsed)
+
+            self._entry_cache = entry_cache
+            self._stat_key = stat_key
+            self._snapshot = snapshot
+        return snapshot
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.reload()
+            except Exception:
+                # Stored in last_error by reload, retried at the next check
+                pass
+
+    def start(self):
+        """Start checking the file in a daemon thread.
+
+        @raise RuntimeError: Raised if already started.
+        """
+        if self._thread is not None:
+            raise RuntimeError("ConstantsWatcher is already started")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+            name="ConstantsWatcher(%s)" % self.src)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop checking the file, waiting for a running rebuild to finish."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -4,7 +4,13 @@
 @license GNU GPL v2
 """
 
+import json
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
+import timeit
 
 import unittest
 
@@ -13,6 +19,11 @@ import ljmmm
 def cmp(a, b):
     return (a > b) - (a < b) 
 
+def resolve_shared(args):
+    (name, register_name) = args
+    with ljmmm.attach_constants(name) as constants:
+        return constants.resolve(register_name)
+
 # TODO: This is still somewhat incomplete
 class LJMMMTests(unittest.TestCase):
     """Test case for reading LabJack Modbus Map Markup notation maps."""
@@ -53,6 +64,39 @@ class LJMMMTests(unittest.TestCase):
         expected = ["test#0", "test#2", "test#4"]
         self.assertEqual(result, expected)
 
+    def test_ljmmm_multiple_enumerations(self):
+        """Test ljmmm field with more than one numerical enumeration."""
+        result = ljmmm.interpret_ljmmm_field("A#(0:1)_B#(2:3)")
+        expected = [["A0_B2", "A1_B2"], ["A0_B3", "A1_B3"]]
+        self.assertEqual(result, expected)
+
+    def test_compile_ljmmm_field(self):
+        """Test working with a compiled ljmmm field without expanding it."""
+        template = ljmmm.compile_ljmmm_field("DIO#(0:22)_EF_CONFIG_A")
+        self.assertIs(template, ljmmm.compile_ljmmm_field("DIO#(0:22)_EF_CONFIG_A"))
+        self.assertEqual(23, len(template))
+        self.assertEqual("DIO5_EF_CONFIG_A", template[5])
+        self.assertEqual("DIO22_EF_CONFIG_A", template[-1])
+        self.assertEqual(5, template.index("DIO5_EF_CONFIG_A"))
+        self.assertIn("DIO22_EF_CONFIG_A", template)
+        for name in ["DIO23_EF_CONFIG_A", "DIO05_EF_CONFIG_A", "DIO5_EF_CONFIG_B"]:
+            self.assertNotIn(name, template)
+        with self.assertRaises(IndexError):
+            template[23]
+        with self.assertRaises(ValueError):
+            template.index("DIO23_EF_CONFIG_A")
+
+        template = ljmmm.compile_ljmmm_field("X#pound#(0:4:2)_#(1:2)")
+        names = ["X#0_1", "X#2_1", "X#4_1", "X#0_2", "X#2_2", "X#4_2"]
+        self.assertEqual(names, list(template))
+        self.assertEqual(6, len(template))
+        self.assertEqual([4, 2], template.get_numbers("X#4_2"))
+        for (i, name) in enumerate(names):
+            self.assertEqual(name, template[i])
+            self.assertEqual(i, template.index(name))
+
+        self.assertEqual(["SPI_DATA_TX"], list(ljmmm.compile_ljmmm_field("SPI_DATA_TX")))
+
     def test_enumerate_addresses(self):
         """Test generating modbus addresses based on a datatype size."""
         expected = [1000, 1002, 1004, 1006, 1008]
@@ -310,6 +354,63 @@ class LJMMMTests(unittest.TestCase):
         self.assertEqual(0, len(ljmmm.FIND_URLS.findall('this desc has https://labjack.nope as the not a link')))
 
 
+    def test_apply_anchors(self):
+        text = "See labjack.com/support. Or labjack.com/support, again."
+        anchor = ljmmm.ANCHOR_TEMPLATE % ("labjack.com/support", "labjack.com/support")
+        expected = "See %s. Or %s, again." % (anchor, anchor)
+        self.assertEqual(expected, ljmmm.apply_anchors(text))
+
+        hits = ljmmm.apply_anchors.cache_info().hits
+        self.assertEqual(expected, ljmmm.apply_anchors(text))
+        self.assertEqual(hits + 1, ljmmm.apply_anchors.cache_info().hits)
+
+    def test_parse_register_data_without_rendering_descriptions(self):
+        raw_register = {
+            "address": 2000,
+            "name": "FIO#(0:1)",
+            "type": "UINT16",
+            "devices": ["T7"],
+            "readwrite": "RW",
+            "description": "See labjack.com/support.",
+        }
+        result = ljmmm.parse_register_data(raw_register, expand_names=True,
+            render_descriptions=False)
+        self.assertEqual(["See labjack.com/support."] * 2,
+            [x["description"] for x in result])
+
+    def test_parse_json_str_for_comments(self):
+        src = (
+            "// Leading comment\n"
+            "{\n"
+            "  \"url\": \"http://labjack.com\", // trailing comment\n"
+            "  /* block\n"
+            "     comment */ \"a\": \"/* not a comment */\",\n"
+            "  \"b\": \"quote \\\" // not a comment\" /* inline */\n"
+            "}\n"
+        )
+        result = ljmmm.parse_json_str_for_comments(src)
+        self.assertEqual(src.count("\n"), result.count("\n"))
+        self.assertEqual(
+            {
+                "url": "http://labjack.com",
+                "a": "/* not a comment */",
+                "b": "quote \" // not a comment",
+            },
+            json.loads(result)
+        )
+
+        for separator in ["\u2028", "\u2029", "\x1c", "\x85", "\x0b", "\x0c"]:
+            src = "{\"a\": \"x%s// not a comment\"} // comment\n" % separator
+            self.assertEqual("{\"a\": \"x%s// not a comment\"} \n" % separator,
+                ljmmm.parse_json_str_for_comments(src))
+
+    def test_load_json_with_comments(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0],
+            "LabJack", "LJM", "ljm_startup_configs.json")
+        with open(src) as f:
+            configs = ljmmm.load_json_with_comments(f)
+        self.assertIn("LJM_CONFIG_VALUES", configs)
+
     def test_get_device_modbus_maps(self):
         EXPECTED_MAPS = {
             'T7': [
@@ -433,7 +534,868 @@ class LJMMMTests(unittest.TestCase):
             src=os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json"),
         )
         self.assertEqual(EXPECTED_ERRORS, errors)
-        
+
+    def test_load_json_sections(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            src = os.path.join(temp_dir, "constants.json")
+            cache_dir = os.path.join(temp_dir, "cache")
+            shutil.copy(os.path.join(os.path.split(os.path.realpath(__file__))[0],
+                "ljmmm_test.json"), src)
+            with open(src) as f:
+                expected = json.load(f)
+
+            sections = ljmmm.load_json_sections(src, ["errors", "missing"],
+                cache_dir=cache_dir)
+            self.assertEqual({"errors": expected["errors"]}, sections)
+            self.assertEqual(["cache", "constants.json"], sorted(os.listdir(temp_dir)))
+            self.assertTrue(os.path.exists(ljmmm.get_json_section_index_path(
+                ljmmm.ConstantsDocument(src), cache_dir=cache_dir)))
+
+            original_build = ljmmm.build_json_section_offsets
+            ljmmm.build_json_section_offsets = None
+            try:
+                self.assertEqual(expected, ljmmm.load_json_sections(src,
+                    cache_dir=cache_dir))
+            finally:
+                ljmmm.build_json_section_offsets = original_build
+
+            with open(src, "w") as f:
+                json.dump({"header": {"version": "2"}, "errors": []}, f)
+            self.assertEqual({"errors": []},
+                ljmmm.load_json_sections(src, ["errors"], cache_dir=cache_dir))
+            self.assertEqual(2, len(os.listdir(cache_dir)))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_constants_document_decodes_once(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            src = os.path.join(temp_dir, "constants.json")
+            shutil.copy(os.path.join(os.path.split(os.path.realpath(__file__))[0],
+                "ljmmm_test.json"), src)
+            document = ljmmm.ConstantsDocument(src)
+            reads = []
+            decodes = []
+            original_read_file = ljmmm.read_file
+            original_decode_json_str = ljmmm.decode_json_str
+            def counting_read_file(*args, **kwargs):
+                reads.append(args)
+                return original_read_file(*args, **kwargs)
+            def counting_decode_json_str(*args, **kwargs):
+                decodes.append(args)
+                return original_decode_json_str(*args, **kwargs)
+            ljmmm.read_file = counting_read_file
+            ljmmm.decode_json_str = counting_decode_json_str
+            try:
+                errors = ljmmm.get_errors(document)
+                # Replacing the file must not mix versions within a document
+                with open(src, "w") as f:
+                    json.dump({"registers": [], "errors": []}, f)
+                maps = ljmmm.get_device_modbus_maps(document, expand_names=True)
+                registers = ljmmm.get_raw_registers_data(document)
+                self.assertEqual([], document.registers_beta)
+            finally:
+                ljmmm.read_file = original_read_file
+                ljmmm.decode_json_str = original_decode_json_str
+        finally:
+            shutil.rmtree(temp_dir)
+
+        self.assertEqual(1, len(reads))
+        self.assertEqual(1, len(decodes))
+        self.assertIs(errors, document.errors)
+        self.assertEqual(4, len(errors))
+        self.assertEqual(["T4", "T7"], sorted(maps.keys()))
+        self.assertEqual(1, len(registers))
+
+    def test_constants_document_combined_registers_is_not_cumulative(self):
+        document = ljmmm.ConstantsDocument(
+            os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        )
+        document.contents["registers_beta"] = [{"name": "BETA"}]
+        self.assertEqual(2, len(document.combined_registers))
+        self.assertEqual(2, len(document.combined_registers))
+        self.assertEqual(1, len(document.registers))
+
+    def test_cached_device_modbus_maps(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        cache_dir = tempfile.mkdtemp()
+        try:
+            expected = ljmmm.get_device_modbus_maps(src, expand_names=True,
+                inc_orig=True)
+            built = ljmmm.get_cached_device_modbus_maps(src,
+                expand_names=True, inc_orig=True, cache_dir=cache_dir)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+            original_get_device_modbus_maps = ljmmm.get_device_modbus_maps
+            ljmmm.get_device_modbus_maps = None
+            try:
+                loaded = ljmmm.get_cached_device_modbus_maps(src,
+                    expand_names=True, inc_orig=True, cache_dir=cache_dir)
+            finally:
+                ljmmm.get_device_modbus_maps = original_get_device_modbus_maps
+
+            self.assertEqual(expected, built)
+            self.assertEqual(expected, loaded)
+
+            ljmmm.get_cached_device_modbus_maps(src, cache_dir=cache_dir)
+            self.assertEqual(2, len(os.listdir(cache_dir)))
+
+            ljmmm.get_cached_device_modbus_maps(src, cache_dir=cache_dir,
+                enable_comments=True)
+            self.assertEqual(3, len(os.listdir(cache_dir)))
+            self.assertNotEqual(
+                ljmmm.get_map_cache_path(ljmmm.ConstantsDocument(src)),
+                ljmmm.get_map_cache_path(ljmmm.ConstantsDocument(src,
+                    enable_utf8=True)))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cached_device_modbus_maps_is_faster(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0],
+            "LabJack", "LJM", "ljm_constants.json")
+        cache_dir = tempfile.mkdtemp()
+        try:
+            ljmmm.get_cached_device_modbus_maps(src, expand_names=True,
+                cache_dir=cache_dir)
+            hit = min(timeit.repeat(lambda: ljmmm.get_cached_device_modbus_maps(
+                src, expand_names=True, cache_dir=cache_dir), number=1, repeat=3))
+            build = min(timeit.repeat(lambda: ljmmm.get_device_modbus_maps(
+                src, expand_names=True), number=1, repeat=3))
+            self.assertLess(hit, build)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_name_resolver(self):
+        resolver = ljmmm.NameResolver([
+            {"address": 0, "name": "AIN#(0:254)", "type": "FLOAT32",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 2008, "name": "EIO#(0:7)", "type": "UINT16",
+                "devices": ["T7", "T4"], "readwrite": "RW",
+                "altnames": ["DIO#(8:15)"]},
+            {"address": 44900, "name": "DIO_EF_CLOCK#(0:2)_DIVISOR",
+                "type": "UINT16", "devices": ["T7"], "readwrite": "RW"},
+            {"address": 100, "name": "STEP#(0:8:4)_X", "type": "UINT32",
+                "devices": ["T4"], "readwrite": "RW"},
+            {"address": 60500, "name": "DEVICE_NAME_DEFAULT",
+                "type": "STRING", "devices": ["T7"], "readwrite": "RW"},
+        ])
+        self.assertEqual((274, "FLOAT32"), resolver.resolve("AIN137"))
+        self.assertEqual((2010, "UINT16"), resolver.resolve("EIO2"))
+        self.assertEqual((2010, "UINT16"), resolver.resolve("DIO10"))
+        self.assertEqual((44902, "UINT16"),
+            resolver.resolve("DIO_EF_CLOCK2_DIVISOR"))
+        self.assertEqual((104, "UINT32"), resolver.resolve("STEP8_X"))
+        self.assertEqual((60500, "STRING"),
+            resolver.resolve("DEVICE_NAME_DEFAULT"))
+        self.assertEqual(([0, 2008], ["FLOAT32", "UINT16"]),
+            resolver.names_to_addresses(["AIN0", "DIO8"]))
+
+        for name in ["AIN255", "AIN01", "DIO7", "STEP3_X", "AIN#(0:254)",
+            "DIO_EF_CLOCK3_DIVISOR", "NOPE"]:
+            self.assertNotIn(name, resolver)
+            with self.assertRaises(KeyError):
+                resolver.resolve(name)
+
+    def test_name_resolver_duplicate_names(self):
+        resolver = ljmmm.NameResolver([
+            {"address": 0, "name": "A#(0:9)B1", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 100, "name": "A1B#(0:9)", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 200, "name": "C#(0:1)_D#(0:1)", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 300, "name": "C#(0:3)_D1", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 400, "name": "C3_D1", "type": "UINT32",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 500, "name": "E5", "type": "UINT32",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 600, "name": "E#(0:9)", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "R",
+                "altnames": ["A#(0:9)B1"]},
+        ])
+        # A1B1 matches both templates, split around different digit runs
+        self.assertEqual((1, "UINT16"), resolver.resolve("A1B1"))
+        self.assertEqual((102, "UINT16"), resolver.resolve("A1B2"))
+        # Expanded multi-range names against a later template
+        self.assertEqual((203, "UINT16"), resolver.resolve("C1_D1"))
+        # A template against a later exact name, and the other way around
+        self.assertEqual((303, "UINT16"), resolver.resolve("C3_D1"))
+        self.assertEqual((500, "UINT32"), resolver.resolve("E5"))
+        self.assertEqual((604, "UINT16"), resolver.resolve("E4"))
+        # A later altname does not shadow an earlier name
+        self.assertEqual((2, "UINT16"), resolver.resolve("A2B1"))
+
+    def test_name_resolver_range_next_to_digits(self):
+        resolver = ljmmm.NameResolver([
+            {"address": 0, "name": "FOO1#(0:3)", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 10, "name": "BAR#(0:3)2_X", "type": "UINT32",
+                "devices": ["T7"], "readwrite": "R"},
+        ])
+        self.assertEqual((0, "UINT16"), resolver.resolve("FOO10"))
+        self.assertEqual((3, "UINT16"), resolver.resolve("FOO13"))
+        self.assertEqual((16, "UINT32"), resolver.resolve("BAR32_X"))
+        self.assertNotIn("FOO14", resolver)
+        self.assertNotIn("BAR42_X", resolver)
+
+    def test_name_resolver_matches_expanded_map(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        resolver = ljmmm.get_name_resolver(src, device="T4")
+        maps = ljmmm.get_device_modbus_maps(src, expand_names=True,
+            expand_alt_names=True)
+        for register in maps["T4"]:
+            self.assertEqual((register["address"], register["type"]),
+                resolver.resolve(register["name"]))
+
+    def test_address_index(self):
+        index = ljmmm.AddressIndex([
+            {"address": 0, "name": "AIN0", "type": "FLOAT32"},
+            {"address": 2, "name": "AIN1", "type": "FLOAT32"},
+            {"address": 2010, "name": "EIO2", "type": "UINT16"},
+            {"address": 2010, "name": "DIO10", "type": "UINT16"},
+            {"address": 4898, "name": "WIDE", "type": "UINT32"},
+            {"address": 4899, "name": "NARROW", "type": "UINT16"},
+            {"address": 61500, "name": "CORE_TIMER_64", "type": "UINT64"},
+            {"address": 60500, "name": "DEVICE_NAME_DEFAULT", "type": "STRING"},
+        ])
+        self.assertEqual(7, len(index))
+
+        (entry, offset) = index.get_register(3)
+        self.assertEqual(("AIN1", 1), (entry["name"], offset))
+
+        (entry, offset) = index.get_register(2010)
+        self.assertEqual(("EIO2", 0, ["DIO10"]),
+            (entry["name"], offset, entry["altnames"]))
+
+        self.assertEqual([("NARROW", 0), ("WIDE", 1)],
+            [(x["name"], y) for (x, y) in index.lookup(4899)])
+
+        self.assertEqual(
+            [[("CORE_TIMER_64", 0)], [("CORE_TIMER_64", 3)], [],
+                [("DEVICE_NAME_DEFAULT", 24)], [], []],
+            [[(x["name"], y) for (x, y) in hits] for hits in
+                index.lookup_many([61500, 61503, 61504, 60524, 60525, 4])]
+        )
+        self.assertIsNone(index.get_register(1999))
+
+    def test_get_address_indexes(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        indexes = ljmmm.get_address_indexes(src)
+        self.assertEqual(["T4", "T7"], sorted(indexes.keys()))
+        (entry, offset) = indexes["T7"].get_register(2990)
+        self.assertEqual(("LED_COMM", 0), (entry["name"], offset))
+
+    def test_iter_registers(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        registers = ljmmm.iter_registers(src, expand_names=True)
+        self.assertFalse(isinstance(registers, list))
+        self.assertEqual(ljmmm.get_registers_data(src, expand_names=True),
+            list(registers))
+
+        maps = ljmmm.get_device_modbus_maps(src, expand_names=True,
+            inc_orig=True)
+        for device in ljmmm.get_device_names(src):
+            self.assertEqual(maps[device], list(ljmmm.iter_device_registers(
+                device, src, expand_names=True, inc_orig=True)))
+        self.assertEqual([], list(ljmmm.iter_device_registers("U3", src)))
+
+    def test_iter_register_data_is_lazy(self):
+        registers = ljmmm.iter_register_data(
+            {
+                "address": 0,
+                "name": "AIN#(0:249)",
+                "type": "FLOAT32",
+                "devices": ["T7"],
+                "readwrite": "R",
+            },
+            expand_names=True
+        )
+        self.assertEqual(("AIN0", 0), next((x["name"], x["address"])
+            for x in registers))
+        self.assertEqual(("AIN1", 2), next((x["name"], x["address"])
+            for x in registers))
+        self.assertEqual(248, len(list(registers)))
+
+    def test_device_modbus_map_entries_are_independent(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        document = ljmmm.ConstantsDocument(src)
+        maps = ljmmm.get_device_modbus_maps(document, expand_names=True)
+        maps["T7"][0]["tags"].append("CHANGED")
+        maps["T7"][0]["constants"][0]["name"] = "CHANGED"
+        self.assertEqual(["DIO"], maps["T4"][0]["tags"])
+        self.assertEqual("Off", maps["T4"][0]["constants"][0]["name"])
+        self.assertEqual(["DIO"], document.registers[0]["tags"])
+        self.assertEqual("Off", document.registers[0]["constants"][0]["name"])
+
+    def test_device_register_views(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        expected = ljmmm.get_device_modbus_maps(src, expand_names=True)
+        views = ljmmm.get_device_modbus_maps(src, expand_names=True,
+            record_type=ljmmm.DeviceRegisterView)
+        self.assertEqual(expected, views)
+
+        t7_view = views["T7"][0]
+        t4_view = views["T4"][0]
+        self.assertIsInstance(t7_view, ljmmm.DeviceRegisterView)
+        self.assertEqual(list(expected["T7"][0].keys()), list(t7_view.keys()))
+        self.assertEqual((1.7777, 1.4444), (t7_view["fwmin"], t4_view["fwmin"]))
+        self.assertIs(t7_view["tags"], t4_view["tags"])
+        with self.assertRaises(TypeError):
+            t7_view["fwmin"] = 0
+
+        with self.assertRaises(ValueError):
+            ljmmm.get_device_modbus_maps(src, record_type=list)
+
+    def test_register_records(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        maps = ljmmm.get_device_modbus_maps(src, expand_names=True,
+            record_type=ljmmm.Register)
+        expected = ljmmm.get_device_modbus_maps(src, expand_names=True)
+
+        t7_register = maps["T7"][0]
+        t4_register = maps["T4"][0]
+        self.assertIsInstance(t7_register, ljmmm.Register)
+        self.assertFalse(hasattr(t7_register, "__dict__"))
+        self.assertEqual(list(expected["T7"][0].keys()), list(t7_register.keys()))
+        self.assertEqual("LED_COMM", t7_register.name)
+        self.assertEqual(2990, t7_register["address"])
+        self.assertEqual(("DIO",), t7_register.tags)
+        self.assertIs(t7_register.tags, t4_register.tags)
+        self.assertIs(t7_register.constants, t4_register.constants)
+        self.assertEqual((1.7777, 1.4444), (t7_register.fwmin, t4_register.fwmin))
+        with self.assertRaises(KeyError):
+            t7_register["devices"]
+        with self.assertRaises(AttributeError):
+            t7_register.name = "LED_POWER"
+
+        other_maps = ljmmm.get_device_modbus_maps(src, expand_names=True,
+            record_type=ljmmm.Register)
+        self.assertEqual(maps, other_maps)
+        self.assertIsNot(t7_register.tags, other_maps["T7"][0].tags)
+
+        registers = ljmmm.get_registers_data(src, expand_names=True,
+            record_type=ljmmm.Register)
+        self.assertEqual(1, len(registers))
+        self.assertEqual({"read": True, "write": True}, registers[0].readwrite)
+        self.assertEqual("T7", registers[0].devices[0]["device"])
+
+    def test_register_query_index(self):
+        def register(name, tags, devices, readwrite, **flags):
+            raw_register = {"address": 0, "name": name, "type": "UINT16",
+                "tags": tags, "devices": devices, "readwrite": readwrite}
+            raw_register.update(flags)
+            return ljmmm.parse_register_data(raw_register)[0]
+
+        index = ljmmm.RegisterQueryIndex([
+            register("AIN0", ["AIN"], ["T7", "T4"], "R", streamable=True),
+            register("AIN0_EF_READ_A", ["AIN_EF"], ["T7"], "R", streamable=True),
+            register("AIN0_EF_INDEX", ["AIN_EF"], ["T7", "T4"], "RW"),
+            register("DIO0", ["DIO", "CORE"], ["T4"], "RW", streamable=True),
+            register("SPI_DATA_TX", ["SPI"], ["T7"], "W", isBuffer=True),
+        ])
+        self.assertEqual(5, len(index))
+
+        result = index.query(tags=["AIN_EF"], device="T7", streamable=True,
+            read=True)
+        self.assertEqual(1, len(result))
+        self.assertEqual(["AIN0_EF_READ_A"], list(result.names()))
+
+        self.assertEqual(["AIN0", "DIO0"],
+            list(index.query(device="T4", streamable=True).names()))
+        self.assertEqual(["AIN0_EF_INDEX", "DIO0", "SPI_DATA_TX"],
+            list(index.query(write=True).names()))
+        self.assertEqual(["AIN0", "AIN0_EF_READ_A"],
+            list(index.query(write=False).names()))
+        self.assertEqual([], list(index.query(tags="NOPE").names()))
+        self.assertFalse(index.query(device="U3"))
+
+        combined = index.query(tags="AIN") | index.query(tags="SPI")
+        self.assertEqual([0, 4], combined.ids())
+        self.assertEqual([4], (combined - index.query(read=True)).ids())
+        self.assertEqual([0], (combined & index.query(device="T4")).ids())
+
+        with self.assertRaises(ValueError):
+            index.query(fast=True)
+
+    def test_register_query_index_skips_descriptions(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        rendered = []
+        original_apply_anchors = ljmmm.apply_anchors
+        ljmmm.apply_anchors = lambda text: rendered.append(text) or text
+        try:
+            index = ljmmm.get_register_query_index(src)
+        finally:
+            ljmmm.apply_anchors = original_apply_anchors
+        self.assertEqual([], rendered)
+        self.assertIn("LED_COMM", list(index.query(device="T4").names()))
+
+    def test_bitsets(self):
+        ids = [0, 7, 8, 63, 64, 1000]
+        bitset = ljmmm.make_bitset(ids)
+        self.assertEqual(sum(1 << x for x in ids), bitset)
+        self.assertEqual(ids, list(ljmmm.iter_bitset(bitset)))
+        self.assertEqual(0, ljmmm.make_bitset([]))
+        self.assertEqual([], list(ljmmm.iter_bitset(0)))
+
+    def test_firmware_view(self):
+        registers = [
+            {"name": "A", "fwmin": 1.0012},
+            {"name": "B", "fwmin": 0},
+            {"name": "C", "fwmin": 1.02},
+            {"name": "D", "fwmin": 0.2},
+            {"name": "E", "fwmin": 1.0012},
+        ]
+        view = ljmmm.FirmwareView(registers)
+        self.assertEqual(5, len(view))
+        self.assertEqual([0, 0.2, 1.0012, 1.02], view.versions)
+        self.assertEqual(["B"], [x["name"] for x in view.at(0.1)])
+        self.assertEqual(["B", "D", "A", "E"], [x["name"] for x in view.at(1.0012)])
+        self.assertEqual(5, view.count(2))
+        self.assertEqual(["A", "E", "C"],
+            [x["name"] for x in view.added_between(0.2, 1.02)])
+
+    def test_get_device_modbus_maps_for_firmware(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        maps = ljmmm.get_device_modbus_maps(src, firmware=1.5)
+        self.assertEqual(([], ["LED_COMM"]),
+            (maps["T7"], [x["name"] for x in maps["T4"]]))
+
+        maps = ljmmm.get_device_modbus_maps(src, inc_orig=True,
+            firmware={"T4": 1.0})
+        self.assertEqual((1, 0), (len(maps["T7"]), len(maps["T4"])))
+
+        views = ljmmm.get_firmware_views(src)
+        self.assertEqual([1.7777], views["T7"].versions)
+        self.assertIs(views["T7"].at(2), views["T7"].at(1.8))
+
+        document = ljmmm.ConstantsDocument(src)
+        maps = ljmmm.get_device_modbus_maps(document, firmware=2)
+        original_iter_registers = ljmmm.iter_registers
+        ljmmm.iter_registers = None
+        try:
+            self.assertEqual(([], maps["T4"]), tuple(
+                ljmmm.get_device_modbus_maps(document, firmware=x)[y]
+                for (x, y) in [(1.5, "T7"), (2, "T4")]))
+            views = ljmmm.get_firmware_views(document)
+            self.assertIs(views["T7"],
+                ljmmm.get_firmware_views(document)["T7"])
+        finally:
+            ljmmm.iter_registers = original_iter_registers
+        maps["T7"][0]["tags"].append("CHANGED")
+        self.assertEqual(["DIO"], ljmmm.get_device_modbus_maps(document,
+            firmware=2)["T7"][0]["tags"])
+
+    def test_read_plan(self):
+        resolver = ljmmm.NameResolver([
+            {"address": 0, "name": "AIN#(0:254)", "type": "FLOAT32",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 2008, "name": "EIO#(0:7)", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "RW",
+                "altnames": ["DIO#(8:15)"]},
+            {"address": 60500, "name": "DEVICE_NAME_DEFAULT",
+                "type": "STRING", "devices": ["T7"], "readwrite": "RW"},
+        ])
+        names = ["EIO0", "AIN1", "AIN0", "DIO8", "AIN3", "DEVICE_NAME_DEFAULT"]
+
+        plan = ljmmm.ReadPlan(names, resolver)
+        self.assertEqual([(0, 4), (6, 2), (2008, 1), (60500, 25)], plan.frames)
+        self.assertEqual(("EIO0", "UINT16", 6, 1), plan.fields[0])
+        self.assertEqual(("AIN3", "FLOAT32", 4, 2), plan.fields[4])
+
+        plan = ljmmm.ReadPlan(names, resolver, max_gap=2)
+        self.assertEqual([(0, 8), (2008, 1), (60500, 25)], plan.frames)
+        words = list(range(plan.num_registers))
+        values = plan.demux(words)
+        self.assertEqual([0, 1], values["AIN0"])
+        self.assertEqual([6, 7], values["AIN3"])
+        self.assertEqual([8], values["DIO8"])
+        self.assertEqual(list(range(9, 34)), values["DEVICE_NAME_DEFAULT"])
+        with self.assertRaises(ValueError):
+            plan.demux(words[1:])
+
+        plan = ljmmm.ReadPlan(["AIN%d" % x for x in range(100)], resolver,
+            max_frame_registers=125)
+        self.assertEqual([(0, 124), (124, 76)], plan.frames)
+
+        with self.assertRaises(ValueError):
+            ljmmm.ReadPlan(["DEVICE_NAME_DEFAULT"], resolver,
+                max_frame_registers=20)
+        with self.assertRaises(KeyError):
+            ljmmm.ReadPlan(["AIN255"], resolver)
+
+    @unittest.skipIf(ljmmm.numpy is None, "numpy is not installed")
+    def test_register_codec(self):
+        resolver = ljmmm.NameResolver([
+            {"address": 0, "name": "AIN#(0:254)", "type": "FLOAT32",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 2008, "name": "EIO#(0:7)", "type": "UINT16",
+                "devices": ["T7"], "readwrite": "RW"},
+            {"address": 3000, "name": "COUNT", "type": "INT32",
+                "devices": ["T7"], "readwrite": "RW"},
+            {"address": 61500, "name": "CORE_TIMER_64", "type": "UINT64",
+                "devices": ["T7"], "readwrite": "R"},
+            {"address": 60500, "name": "DEVICE_NAME_DEFAULT",
+                "type": "STRING", "devices": ["T7"], "readwrite": "RW"},
+        ])
+        plan = ljmmm.ReadPlan(["EIO1", "AIN1", "COUNT", "CORE_TIMER_64",
+            "DEVICE_NAME_DEFAULT", "AIN1"], resolver)
+        codec = ljmmm.RegisterCodec(plan)
+        values = {"EIO1": 7, "AIN1": 1.5, "COUNT": -2,
+            "CORE_TIMER_64": 2 ** 40 + 3, "DEVICE_NAME_DEFAULT": b"T7"}
+
+        buffer = codec.encode(values)
+        self.assertEqual(plan.num_registers * 2, len(buffer))
+        self.assertEqual(b"\x3f\xc0\x00\x00", buffer[:4])
+        self.assertEqual(values, codec.decode(buffer))
+
+        columns = codec.decode_columns(memoryview(buffer * 3))
+        self.assertEqual([-2, -2, -2], columns["COUNT"].tolist())
+        self.assertEqual(3, len(codec.decode_records(buffer * 3)))
+
+        with self.assertRaises(ValueError):
+            codec.decode(buffer * 2)
+        with self.assertRaises(ValueError):
+            codec.decode_records(buffer[1:])
+        with self.assertRaises(KeyError):
+            codec.encode({"EIO1": 1})
+
+    def test_scan_list(self):
+        registers = [
+            {"address": 0, "name": "AIN0", "type": "FLOAT32",
+                "streamable": True, "read": True},
+            {"address": 2, "name": "AIN1", "type": "FLOAT32",
+                "streamable": True, "read": True},
+            {"address": 3000, "name": "DIO0_EF_READ_A", "type": "UINT32",
+                "streamable": True, "read": True},
+            {"address": 4899, "name": "STREAM_DATA_CAPTURE_16",
+                "type": "UINT16", "streamable": True, "read": True},
+            {"address": 61520, "name": "CORE_TIMER", "type": "UINT32",
+                "streamable": True, "read": True},
+            {"address": 1000, "name": "DAC0", "type": "FLOAT32",
+                "streamable": False, "read": True},
+        ]
+        scan_list = ljmmm.ScanList(["AIN0", "DIO0_EF_READ_A",
+            "STREAM_DATA_CAPTURE_16", "CORE_TIMER", "AIN1"], registers)
+        self.assertEqual([0, 3000, 4899, 61520, 4899, 2], scan_list.addresses)
+        self.assertEqual(("CORE_TIMER", "UINT32", 3, 4), scan_list.columns[2])
+        self.assertEqual(("AIN1", "FLOAT32", 5, None), scan_list.columns[3])
+
+        with self.assertRaises(ValueError):
+            ljmmm.ScanList(["DAC0"], registers)
+        with self.assertRaises(KeyError):
+            ljmmm.ScanList(["AIN2"], registers)
+
+    @unittest.skipIf(ljmmm.numpy is None, "numpy is not installed")
+    def test_scan_list_demux(self):
+        registers = [
+            {"address": 0, "name": "AIN0", "type": "FLOAT32",
+                "streamable": True, "read": True},
+            {"address": 3000, "name": "COUNT", "type": "INT32",
+                "streamable": True, "read": True},
+            {"address": 4899, "name": "STREAM_DATA_CAPTURE_16",
+                "type": "UINT16", "streamable": True, "read": True},
+        ]
+        scan_list = ljmmm.ScanList(["AIN0", "COUNT"], registers)
+        words = ljmmm.numpy.array([7, 0xfffe, 0xffff, 8, 5, 1],
+            dtype=">u2")
+        scans = scan_list.reshape(words.tobytes())
+        self.assertEqual((2, 3), scans.shape)
+        values = scan_list.demux(words.tobytes())
+        self.assertEqual([7, 8], values["AIN0"].tolist())
+        self.assertEqual([-2, 65541], values["COUNT"].tolist())
+        self.assertEqual([7, 8], scan_list.demux(
+            words.byteswap().tobytes(), byteorder="<")["AIN0"].tolist())
+
+        with self.assertRaises(ValueError):
+            scan_list.reshape(words[1:].tobytes())
+
+    def test_register_columns(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        registers = ljmmm.get_device_modbus_maps(src, expand_names=True)["T7"]
+        (columns, strings) = ljmmm.get_register_columns(registers + registers)
+        self.assertEqual(2 * len(registers), len(columns["address"]))
+        self.assertEqual(len(registers), len(strings))
+        self.assertEqual([1, 1], columns["size"])
+        self.assertEqual([0, 0], columns["type"])
+        self.assertEqual([0, 0], columns["name"])
+        self.assertEqual(["LED_COMM"], strings)
+
+        (columns, strings) = ljmmm.get_register_columns([
+            {"address": 0, "name": "A", "type": "UINT64", "read": True,
+                "write": False, "streamable": False, "fwmin": 0},
+            {"address": 4, "name": "B", "type": "STRING", "read": True,
+                "write": True, "streamable": False, "fwmin": 1.5},
+        ])
+        self.assertEqual([-1, 98], columns["type"])
+        self.assertEqual([4, 25], columns["size"])
+        self.assertEqual([False, True], columns["write"])
+
+    @unittest.skipIf(ljmmm.numpy is None, "numpy is not installed")
+    def test_register_array(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        tables = ljmmm.get_device_register_arrays(src)
+        (table, strings) = tables["T7"]
+        registers = ljmmm.get_device_modbus_maps(src, expand_names=True)["T7"]
+        self.assertEqual([x["address"] for x in registers],
+            table["address"].tolist())
+        self.assertEqual([x["name"] for x in registers],
+            [strings[x] for x in table["name"]])
+        self.assertTrue(table["read"].all())
+
+    def test_error_index(self):
+        index = ljmmm.ErrorIndex([
+            {"error": 0, "string": "LJ_SUCCESS"},
+            {"error": 200, "string": "LJME_WARNINGS_BEGIN"},
+            {"error": 399, "string": "LJME_WARNINGS_END"},
+            {"error": 201, "string": "LJME_FRAMES_OMITTED_DUE_TO_PACKET_SIZE"},
+            {"error": 1220, "string": "LJME_LIBRARY_ERRORS_BEGIN"},
+            {"error": 1399, "string": "LJME_LIBRARY_ERRORS_END"},
+            {"error": 1223, "string": "LJME_INVALID_HANDLE"},
+            {"error": 2941, "string": "STREAM_AUTO_RECOVER_END"},
+            {"error": 1223, "string": "LJME_ALSO_INVALID_HANDLE"},
+            {"error": 5000, "string": "FAR_AWAY"},
+        ])
+        self.assertEqual(9, len(index))
+        self.assertEqual([1223], index.duplicates)
+        self.assertEqual("LJME_INVALID_HANDLE", index.get_name(1223))
+        self.assertEqual("FAR_AWAY", index[5000]["string"])
+        self.assertEqual(2941, index.get_code("STREAM_AUTO_RECOVER_END"))
+        self.assertNotIn(202, index)
+        self.assertIsNone(index.get(-1))
+        with self.assertRaises(KeyError):
+            index[6000]
+        with self.assertRaises(KeyError):
+            index.get_code("NOPE")
+
+        self.assertEqual("SUCCESS", index.classify(0))
+        self.assertEqual("WARNINGS", index.classify(200))
+        self.assertEqual("WARNINGS", index.classify(399))
+        self.assertEqual("LIBRARY_ERRORS", index.classify(1300))
+        self.assertEqual("DEVICE_ERRORS", index.classify(2941))
+        self.assertEqual("RESERVED", index.classify(400))
+        self.assertEqual("RESERVED", index.classify(1219))
+        self.assertEqual("RESERVED", index.classify(-5))
+
+    def test_compiled_constants(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "constants.bin")
+            ljmmm.write_compiled_constants(path, src=src)
+            self.assertEqual(0o644, os.stat(path).st_mode & 0o777)
+            with ljmmm.CompiledConstants(path) as constants:
+                resolver = ljmmm.get_name_resolver(src)
+                registers = list(ljmmm.iter_registers(src, expand_names=True,
+                    expand_alt_names=True))
+                self.assertEqual(len(registers), len(constants))
+                for register in registers:
+                    self.assertEqual(resolver.resolve(register["name"]),
+                        constants.resolve(register["name"]))
+                self.assertEqual("", constants.version)
+
+                register = constants.get_register("LED_COMM")
+                self.assertEqual(2990, register["address"])
+                self.assertEqual([{"device": "T7", "fwmin": 1.7777},
+                    {"device": "T4", "fwmin": 1.4444}], register["devices"])
+                self.assertEqual((True, True, False), (register["read"],
+                    register["write"], register["streamable"]))
+                self.assertEqual(["LED_COMM"], constants.get_names_at(2990))
+                self.assertEqual([], constants.get_names_at(2991))
+                self.assertNotIn("NOPE", constants)
+                with self.assertRaises(KeyError):
+                    constants.resolve("NOPE")
+
+                for error in ljmmm.get_errors(src):
+                    self.assertEqual(error["string"],
+                        constants.get_error(error["error"])["string"])
+                with self.assertRaises(KeyError):
+                    constants.get_error(123456)
+
+            with open(path, "wb") as f:
+                f.write(b"not constants")
+            with self.assertRaises(ValueError):
+                ljmmm.CompiledConstants(path)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipIf(ljmmm.shared_memory is None,
+        "multiprocessing.shared_memory not available")
+    def test_shared_constants(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        block = ljmmm.publish_constants(src)
+        try:
+            with ljmmm.attach_constants(block.name) as constants:
+                self.assertEqual((2990, "UINT16"), constants.resolve("LED_COMM"))
+                self.assertEqual(["LED_COMM"], [x["name"] for x in
+                    constants.iter_device_registers("T7")])
+                self.assertEqual([], list(constants.iter_device_registers("T7",
+                    firmware=1.5)))
+                with self.assertRaises(KeyError):
+                    list(constants.iter_device_registers("U3"))
+                with self.assertRaises(TypeError):
+                    constants._buffer[0] = 0
+
+            pool = multiprocessing.Pool(2)
+            try:
+                self.assertEqual([(2990, "UINT16")] * 2, pool.map(resolve_shared,
+                    [(block.name, "LED_COMM")] * 2))
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            block.close()
+            block.unlink()
+
+        with self.assertRaises(ValueError):
+            ljmmm.CompiledConstants.from_buffer(b"not constants")
+        contents = ljmmm.compile_constants(src)
+        closed = []
+        with self.assertRaises(ValueError):
+            ljmmm.CompiledConstants.from_buffer(
+                contents[:ljmmm.COMPILED_HEADER.size + 3],
+                close=lambda: closed.append(True))
+        self.assertEqual([True], closed)
+
+        block = ljmmm.shared_memory.SharedMemory(create=True, size=4096)
+        try:
+            block.buf[:13] = b"not constants"
+            with self.assertRaises(ValueError):
+                ljmmm.attach_constants(block.name)
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_constants_watcher(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        with open(src) as f:
+            contents = json.load(f)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "constants.json")
+            with open(path, "w") as f:
+                json.dump(contents, f)
+            watcher = ljmmm.ConstantsWatcher(path)
+            old = watcher.snapshot
+            self.assertEqual(ljmmm.get_device_modbus_maps(path,
+                expand_names=True, expand_alt_names=True), old.device_maps)
+            self.assertEqual((2990, "UINT16"), old.resolver.resolve("LED_COMM"))
+            self.assertFalse(watcher.reload())
+            self.assertFalse(watcher.reload(force=True))
+            self.assertIs(old, watcher.snapshot)
+
+            contents["registers"].append({"address": 3000, "name": "NEW#(0:1)",
+                "type": "UINT32", "devices": ["T7"], "readwrite": "R"})
+            with open(path + ".tmp", "w") as f:
+                json.dump(contents, f)
+            os.replace(path + ".tmp", path)
+            self.assertTrue(watcher.reload())
+            new = watcher.snapshot
+            self.assertEqual(1, new.num_parsed)
+            self.assertEqual((3002, "UINT32"), new.resolver.resolve("NEW1"))
+            self.assertIs(old.device_maps["T7"][0], new.device_maps["T7"][0])
+            self.assertEqual([[({"address": 3002, "name": "NEW1",
+                "type": "UINT32", "size": 2, "altnames": []}, 1)]],
+                new.address_indexes["T7"].lookup_many([3003]))
+            self.assertNotIn("NEW0", old.resolver)
+
+            with open(path, "w") as f:
+                f.write("{")
+            with self.assertRaises(ValueError):
+                watcher.reload()
+            self.assertIs(new, watcher.snapshot)
+            self.assertIsInstance(watcher.last_error, ValueError)
+
+            def failing_callback(snapshot):
+                raise RuntimeError("callback")
+            watcher.callback = failing_callback
+            contents["registers"][-1]["address"] = 3004
+            with open(path, "w") as f:
+                json.dump(contents, f)
+            self.assertTrue(watcher.reload())
+            self.assertIsNone(watcher.last_error)
+            self.assertIsInstance(watcher.callback_error, RuntimeError)
+            self.assertEqual((3004, "UINT32"),
+                watcher.snapshot.resolver.resolve("NEW0"))
+
+            snapshots = []
+            published = threading.Event()
+            def on_snapshot(snapshot):
+                snapshots.append(snapshot)
+                published.set()
+            watcher.callback = on_snapshot
+            watcher.interval = 0.01
+            with watcher:
+                with self.assertRaises(RuntimeError):
+                    watcher.start()
+                del contents["registers"][-1]
+                with open(path, "w") as f:
+                    json.dump(contents, f)
+                self.assertTrue(published.wait(5))
+            self.assertIsNone(watcher.last_error)
+            self.assertIsNone(watcher.callback_error)
+            self.assertEqual([watcher.snapshot], snapshots)
+            self.assertNotIn("NEW0", watcher.snapshot.resolver)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_profile_phases(self):
+        src = os.path.join(os.path.split(os.path.realpath(__file__))[0], "ljmmm_test.json")
+        original_read_file = ljmmm.read_file
+        profiles = []
+        with ljmmm.profile_phases(trace_memory=True,
+            callback=profiles.append) as profile:
+            self.assertNotEqual(original_read_file, ljmmm.read_file)
+            with self.assertRaises(RuntimeError):
+                with ljmmm.profile_phases():
+                    pass
+            maps = ljmmm.get_device_modbus_maps(src, expand_names=True)
+            thread = threading.Thread(target=ljmmm.get_device_modbus_maps,
+                args=(src,))
+            thread.start()
+            thread.join()
+        self.assertEqual(original_read_file, ljmmm.read_file)
+        self.assertEqual([profile], profiles)
+        self.assertEqual(maps, ljmmm.get_device_modbus_maps(src,
+            expand_names=True))
+
+        for phase in ["read_file", "json_decode", "parse_register_data",
+            "apply_anchors", "device_assembly:T7", "device_assembly:T4"]:
+            self.assertIn(phase, profile.phases)
+        self.assertEqual(1, profile.phases["read_file"]["calls"])
+        self.assertEqual(1, profile.phases["device_assembly:T7"]["calls"])
+        self.assertTrue(profile.phases["read_file"]["allocated_bytes"] > 0)
+        for entry in profile.report():
+            self.assertTrue(entry["seconds"] >= entry["self_seconds"] >= 0)
+        self.assertIn("parse_register_data", profile.format())
+
+        original_start = ljmmm.tracemalloc.start
+        def failing_start():
+            raise MemoryError()
+        ljmmm.tracemalloc.start = failing_start
+        try:
+            with self.assertRaises(MemoryError):
+                with ljmmm.profile_phases(trace_memory=True):
+                    pass
+        finally:
+            ljmmm.tracemalloc.start = original_start
+        self.assertEqual(original_read_file, ljmmm.read_file)
+        with ljmmm.profile_phases() as profile:
+            ljmmm.get_errors(src)
+        self.assertIn("json_decode", profile.phases)
+
+    def test_profile_phases_nested_calls(self):
+        with ljmmm.profile_phases() as profile:
+            self.assertEqual(["A0", "A1"], ljmmm.interpret_ljmmm_field("A#(0:1)"))
+        stats = profile.phases["interpret_ljmmm_field"]
+        self.assertEqual(1, stats["calls"])
+        self.assertEqual(stats["seconds"], stats["self_seconds"])
+
+        with ljmmm.profile_phases() as profile:
+            ljmmm.interpret_ljmmm_field("A#(0:1)")
+            ljmmm.compile_ljmmm_field("B#(0:1)")
+        self.assertEqual(2, profile.phases["interpret_ljmmm_field"]["calls"])
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,72 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+import generate_synthetic_constants
+
+class BenchmarkTests(unittest.TestCase):
+    def test_compare_results(self):
+        baseline = {"a": 1.0, "b": 1.0, "c": 1.0}
+        results = {"a": 1.2, "b": 1.3, "d": 5.0}
+        self.assertEqual([("b", 1.0, 1.3)],
+            benchmark.compare_results(baseline, results, threshold=0.25))
+        self.assertEqual([],
+            benchmark.compare_results(baseline, results, threshold=0.5))
+
+    def test_benchmark_names(self):
+        names = [x[0] for x in benchmark.get_benchmarks(benchmark.SRC_FILE,
+            ".")]
+        self.assertEqual(16 + 3, len(set(names)))
+        self.assertIn("validate.validate", names)
+
+    def test_save(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "baseline.json")
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(0, benchmark.main(["--save", "--repeat", "1",
+                    "--scales", "1,2", "--baseline", path]))
+            with open(path) as f:
+                results = json.load(f)["results"]
+            self.assertEqual(2 * (16 + 3), len(results))
+            self.assertIn("x2/validate.validate", results)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_validate_past_valid_scale(self):
+        scale = 10
+        self.assertTrue(scale > generate_synthetic_constants.MAX_VALID_SCALE)
+        directory = tempfile.mkdtemp()
+        try:
+            path = benchmark.write_scaled_file(benchmark.SRC_FILE, scale,
+                directory)
+            run_validate = dict(benchmark.get_benchmarks(path, directory,
+                expect_valid=False))["validate.validate"]
+            run_validate()
+            run_validate = dict(benchmark.get_benchmarks(path,
+                directory))["validate.validate"]
+            with self.assertRaises(RuntimeError):
+                run_validate()
+        finally:
+            shutil.rmtree(directory)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = benchmark.run(scales=[scale], repeat=1,
+                name_filter="validate")
+        self.assertEqual(["x10/validate.validate"], list(results))
+
+    def test_failure_names_benchmark(self):
+        def fail():
+            exit(1)
+        with benchmark.patched(benchmark,
+            get_benchmarks=lambda *args, **kwargs: [("broken", fail)]):
+            with self.assertRaisesRegex(RuntimeError, "x1/broken"):
+                benchmark.run(scales=[1], repeat=1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+import generate_perfect_hash as genhash
+
+registers = genhash.get_registers()
+
+class PerfectHashTests(unittest.TestCase):
+    def test_hash_is_minimal_and_perfect(self):
+        names = [x[0] for x in registers]
+        displacements, slots = genhash.make_perfect_hash(names)
+        self.assertEqual(sorted(names), sorted(slots))
+        for i in range(0, len(slots)):
+            self.assertEqual(
+                i,
+                genhash.get_slot(slots[i], displacements, len(slots))
+            )
+
+    def test_small_name_sets(self):
+        for names in [["A"], ["A", "B"], ["AIN%d" % x for x in range(0, 50)]]:
+            displacements, slots = genhash.make_perfect_hash(names)
+            self.assertEqual(sorted(names), sorted(slots))
+
+    def test_python_output(self):
+        tables = genhash.make_tables(registers)
+        output = []
+        class Writer:
+            def write(self, text):
+                output.append(text)
+        genhash.write_python(Writer(), "test", tables)
+        module = {}
+        exec("".join(output), module)
+
+        for (name, address, data_type) in registers:
+            self.assertEqual((address, data_type), module["lookup"](name))
+        self.assertEqual(None, module["lookup"]("NOT_A_REGISTER"))
+        self.assertEqual(None, module["lookup"](""))
+
+    def test_first_name_wins(self):
+        names = [x[0] for x in registers]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(("AIN0", 0, 3), registers[0])
+
+if __name__ == '__main__':
+    unittest.main()
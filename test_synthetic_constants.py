@@ -0,0 +1,106 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import generate_embedded_constants as genconsts
+import generate_synthetic_constants as gensynth
+import ljmmm
+import validate
+
+with open(gensynth.SRC_FILE) as f:
+    real_contents = json.load(f)
+
+def make_synthetic_constants(scale, seed=gensynth.DEFAULT_SEED):
+    output = io.StringIO()
+    gensynth.write_synthetic_constants(output, scale, seed=seed)
+    return output.getvalue()
+
+class SyntheticConstantsTests(unittest.TestCase):
+    def test_stem(self):
+        self.assertEqual("SYNTHA", gensynth.get_stem(0))
+        self.assertEqual("SYNTHZ", gensynth.get_stem(25))
+        self.assertEqual("SYNTHBA", gensynth.get_stem(26))
+
+    def test_deterministic(self):
+        self.assertEqual(make_synthetic_constants(2, seed=5),
+            make_synthetic_constants(2, seed=5))
+        self.assertNotEqual(make_synthetic_constants(2, seed=5),
+            make_synthetic_constants(2, seed=6))
+
+    def test_counts(self):
+        contents = json.loads(make_synthetic_constants(3))
+        self.assertEqual(3 * len(real_contents["registers"]),
+            len(contents["registers"]))
+        self.assertEqual(3 * len(real_contents["errors"]),
+            len(contents["errors"]))
+        self.assertEqual(real_contents["registers"],
+            contents["registers"][:len(real_contents["registers"])])
+        self.assertEqual(real_contents["header"], contents["header"])
+
+    def test_valid(self):
+        directory = tempfile.mkdtemp()
+        try:
+            # validate only fully checks files named ljm_constants.json
+            path = os.path.join(directory, "ljm_constants.json")
+            gensynth.generate(3, path)
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                validate.validate(path, raw_only=True)
+            self.assertIn("seems fine", output.getvalue())
+
+            maps = ljmmm.get_device_modbus_maps(path, expand_names=True,
+                expand_alt_names=True)
+            names = [x["name"] for x in maps["T7"]]
+            self.assertTrue(any("_CH" in x for x in names))
+            self.assertTrue(any(x.startswith("ALTA_SYNTH") for x in names))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_addresses(self):
+        self.assertEqual([(0, 10), (12, 20), (30, 65536)],
+            gensynth.get_free_address_ranges([
+                {"address": 10, "name": "A", "type": "UINT16"},
+                {"address": 20, "name": "B#(0:4)", "type": "UINT32"},
+                {"address": 26, "name": "C", "type": "UINT64"},
+                {"address": 11, "name": "D", "type": "UINT16"}]))
+
+        addresses = gensynth.AddressAllocator([(0, 4), (10, 13)])
+        self.assertEqual([0, 2, 10, 0], [addresses.allocate(2)
+            for i in range(4)])
+        with self.assertRaises(ValueError):
+            addresses.allocate(5)
+
+        contents = json.loads(make_synthetic_constants(10))
+        real_ranges = [(x["address"], x["address"] +
+            gensynth.get_address_span(x)) for x in
+            real_contents["registers"] + real_contents["registers_beta"]]
+        for register in contents["registers"][len(real_contents["registers"]):]:
+            start = register["address"]
+            end = start + gensynth.get_address_span(register)
+            self.assertTrue(0 <= start < end <= gensynth.MAX_ADDRESS + 1)
+            for (real_start, real_end) in real_ranges:
+                self.assertFalse(start < real_end and real_start < end)
+
+    def test_embedded_conflicts(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "ljm_constants.json")
+            gensynth.generate(3, path)
+            original = (genconsts.SRC_FILE, genconsts.OUTPUT_FILE)
+            genconsts.SRC_FILE = path
+            genconsts.OUTPUT_FILE = os.path.join(directory, "LJM_EC.h")
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    reg_dir, conflict_dir, num_dup = genconsts.generate()
+            finally:
+                (genconsts.SRC_FILE, genconsts.OUTPUT_FILE) = original
+            self.assertTrue(any(x.startswith("LJM_EC_Conflict_SYNTH")
+                for x in conflict_dir))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
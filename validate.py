@@ -10,8 +10,10 @@ import os
 def validate(json_file_path, raw_only=True):
     """Validates json_file_path as ljm constants JSON. Exits with non-zero on error."""
     print ('Checking JSON file...')
+    document = ljmmm.ConstantsDocument(json_file_path,
+        enable_comments=(not raw_only))
     try:
-        jsonFile = ljmmm.load_json_file(json_file_path, enable_comments=(not raw_only))
+        document.contents
     except Exception as e:
         print('[ERROR] JSON file could not be parsed. (' + str(e) + ')')
         traceback.print_exc()
@@ -25,9 +27,10 @@ def validate(json_file_path, raw_only=True):
     print('Checking ljm_constants JSON file...')
     try:
         json_map = ljmmm.get_device_modbus_maps(
-            json_file_path,
+            document,
             expand_names=True,
-            inc_orig=True
+            inc_orig=True,
+            render_descriptions=False
         )
 
     except Exception as e:
@@ -35,7 +38,7 @@ def validate(json_file_path, raw_only=True):
         exit(1)
 
     try:
-        errors = ljmmm.get_errors(json_file_path)
+        errors = ljmmm.get_errors(document)
     except Exception as e:
         print ('[ERROR] JSON file errors could not be parsed. (' + str(e) + ')')
         exit(1)
@@ -45,9 +48,9 @@ def validate(json_file_path, raw_only=True):
     print('Checking register map duplicates and streamable validity...')
     # Track all register names so we do not throw the same error twice for a
     # register (if the register is used with multiple devices)
-    all_names = []
+    all_names = set()
     for device in json_map:
-        previous_names = []
+        previous_names = set()
         previous_addresses = {}
         device_registers = json_map[device]
 
@@ -68,7 +71,7 @@ def validate(json_file_path, raw_only=True):
 
             if reg_name in previous_names:
                 err_msgs.append('Duplicate entries for %s found.' % reg_name)
-            previous_names.append(reg_name)
+            previous_names.add(reg_name)
 
             reg_addr = resolved['address']
             if reg_addr in previous_addresses and previous_addresses[reg_addr]['name'] != unresolved['name']:
@@ -96,23 +99,15 @@ def validate(json_file_path, raw_only=True):
                         'No register description field for: %s\n'
                         % str(reg_name)
                     )
-            all_names.append(reg_name)
+            all_names.add(reg_name)
 
     print('Checking error duplicates...')
-    dup_ierrs = []
-    dup_jerrs = []
-    for i_it in range(0, len(errors)):
-        for j_it in range(i_it + 1, len(errors)):
-            ierr = errors[i_it]
-            jerr = errors[j_it]
-            if ierr['error'] == jerr['error'] and ierr['error'] not in dup_ierrs:
-                dup_ierrs.append(ierr)
-                dup_jerrs.append(jerr)
-
-    if dup_ierrs:
+    dup_errs = ljmmm.ErrorIndex(errors).duplicates
+
+    if dup_errs:
         print ('Duplicate errors:')
-        for err in range(0, len(dup_ierrs)):
-            print ('  ' + str(dup_ierrs[err]['error']))
+        for err in dup_errs:
+            print ('  ' + str(err))
         err_msgs.append('Duplication errors were found (see above)')
 
     for err in err_msgs: